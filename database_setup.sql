@@ -26,7 +26,7 @@ CREATE TABLE IF NOT EXISTS user_configs (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
--- 3. 邮件日志表
+-- 3. 邮件日志表（同时作为通知发件箱，见 scripts/outbox.py）
 CREATE TABLE IF NOT EXISTS email_logs (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     user_email VARCHAR(255) NOT NULL,
@@ -34,9 +34,20 @@ CREATE TABLE IF NOT EXISTS email_logs (
     subject VARCHAR(500),
     content TEXT,
     sent_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    status VARCHAR(20) DEFAULT 'sent' CHECK (status IN ('sent', 'failed', 'pending'))
+    status VARCHAR(20) DEFAULT 'sent' CHECK (status IN ('sent', 'failed', 'pending', 'sending'))
 );
 
+-- 发件箱字段（已有的 email_logs 表执行这一段即可升级）
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS feishu_text TEXT;
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS dedupe_key VARCHAR(255);
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0;
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS email_sent BOOLEAN DEFAULT FALSE;
+ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS feishu_sent BOOLEAN DEFAULT FALSE;
+ALTER TABLE email_logs DROP CONSTRAINT IF EXISTS email_logs_status_check;
+ALTER TABLE email_logs ADD CONSTRAINT email_logs_status_check CHECK (status IN ('sent', 'failed', 'pending', 'sending'));
+
 -- 4. 任务历史记录表
 CREATE TABLE IF NOT EXISTS task_history (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -65,12 +76,30 @@ CREATE TABLE IF NOT EXISTS statistics_reports (
     UNIQUE(user_email, report_type, report_period)
 );
 
+-- 6. 邮箱游标表（记录已检查过的邮件 UIDL，检查回复时只处理新邮件）
+CREATE TABLE IF NOT EXISTS mailbox_state (
+    mailbox VARCHAR(255) PRIMARY KEY,
+    seen_uids JSONB DEFAULT '[]'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 7. 已处理的回复（按 Message-ID 登记，POP3 定时检查和 IMAP 监听同时运行时不会重复处理同一封回复）
+CREATE TABLE IF NOT EXISTS processed_replies (
+    mailbox VARCHAR(255) NOT NULL,
+    message_key TEXT NOT NULL,
+    source VARCHAR(10),
+    processed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (mailbox, message_key)
+);
+
 -- 创建索引以提高查询性能
 CREATE INDEX IF NOT EXISTS idx_tasks_user_email ON tasks(user_email);
 CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
 CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks(updated_at);
 CREATE INDEX IF NOT EXISTS idx_email_logs_user_email ON email_logs(user_email);
 CREATE INDEX IF NOT EXISTS idx_email_logs_sent_at ON email_logs(sent_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_email_logs_dedupe_key ON email_logs(dedupe_key);
+CREATE INDEX IF NOT EXISTS idx_email_logs_outbox ON email_logs(status, next_attempt_at);
 CREATE INDEX IF NOT EXISTS idx_task_history_user_email ON task_history(user_email);
 CREATE INDEX IF NOT EXISTS idx_task_history_changed_at ON task_history(changed_at);
 CREATE INDEX IF NOT EXISTS idx_statistics_user_email ON statistics_reports(user_email);
@@ -82,6 +111,8 @@ ALTER TABLE user_configs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE email_logs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE task_history ENABLE ROW LEVEL SECURITY;
 ALTER TABLE statistics_reports ENABLE ROW LEVEL SECURITY;
+ALTER TABLE mailbox_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE processed_replies ENABLE ROW LEVEL SECURITY;
 
 -- 示例RLS策略（需要根据实际认证方式调整）
 -- CREATE POLICY "Users can only access their own tasks" ON tasks
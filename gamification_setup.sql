@@ -0,0 +1,668 @@
+-- AI邮件督导系统 游戏化数据表与原子更新函数
+-- 在Supabase SQL编辑器中执行此脚本（也可在本地 Postgres 中执行测试）
+--
+-- 函数通过 PostgREST 暴露为 /rest/v1/rpc/<函数名>：
+--   apply_exp_and_coins    原子增加经验值/金币，并在数据库内完成升级计算
+--   apply_punishment_delta 原子扣除经验值/金币，并在数据库内完成降级计算
+--   spend_coins            原子扣除金币（余额不足时不扣）
+--   apply_task_operations  在一个事务内执行一封回复的全部任务操作（查找、修改、重新编号、奖励、经验值历史）
+-- 升级所需经验值与 gamification_utils.LEVEL_EXP_REQUIRED 一致：LV n 需要 n * 100 EXP，最高 LV20
+
+-- 1. 游戏化数据表
+CREATE TABLE IF NOT EXISTS user_gamification (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_email VARCHAR(255) NOT NULL UNIQUE,
+    level INTEGER DEFAULT 1,
+    current_exp INTEGER DEFAULT 0,
+    total_exp INTEGER DEFAULT 0,
+    coins INTEGER DEFAULT 200,
+    ai_personality VARCHAR(20) DEFAULT 'friendly',
+    consecutive_q1_days INTEGER DEFAULT 0,
+    last_q1_complete_date DATE,
+    consecutive_reply_days INTEGER DEFAULT 0,
+    last_reply_date DATE,
+    total_reply_days INTEGER DEFAULT 0,
+    last_punishment_date DATE,
+    total_punishments INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 2. 经验值历史表
+CREATE TABLE IF NOT EXISTS exp_history (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_email VARCHAR(255) NOT NULL,
+    exp_gained INTEGER DEFAULT 0,
+    coins_gained INTEGER DEFAULT 0,
+    reason TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 3. 惩罚历史表
+CREATE TABLE IF NOT EXISTS punishment_history (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_email VARCHAR(255) NOT NULL,
+    punishment_type VARCHAR(50) NOT NULL,
+    coins_deducted INTEGER DEFAULT 0,
+    exp_deducted INTEGER DEFAULT 0,
+    level_before INTEGER,
+    level_after INTEGER,
+    reason TEXT,
+    is_newbie_protected BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_exp_history_user_email ON exp_history(user_email);
+CREATE INDEX IF NOT EXISTS idx_punishment_history_user_email ON punishment_history(user_email);
+
+-- 4. 原子增加经验值和金币（含升级）
+CREATE OR REPLACE FUNCTION apply_exp_and_coins(
+    p_user_email TEXT,
+    p_exp_delta INTEGER,
+    p_coins_delta INTEGER
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_row user_gamification%ROWTYPE;
+    v_old_level INTEGER;
+    v_level INTEGER;
+    v_exp INTEGER;
+BEGIN
+    -- 没有记录时按默认值创建
+    INSERT INTO user_gamification (user_email)
+    VALUES (p_user_email)
+    ON CONFLICT (user_email) DO NOTHING;
+
+    -- 行锁保证并发运行不会丢失更新
+    SELECT * INTO v_row FROM user_gamification
+    WHERE user_email = p_user_email
+    FOR UPDATE;
+
+    v_old_level := COALESCE(v_row.level, 1);
+    v_level := v_old_level;
+    v_exp := COALESCE(v_row.current_exp, 0) + p_exp_delta;
+
+    WHILE v_level < 20 AND v_exp >= v_level * 100 LOOP
+        v_exp := v_exp - v_level * 100;
+        v_level := v_level + 1;
+    END LOOP;
+
+    UPDATE user_gamification
+    SET level = v_level,
+        current_exp = v_exp,
+        total_exp = COALESCE(total_exp, 0) + p_exp_delta,
+        coins = COALESCE(coins, 0) + p_coins_delta,
+        updated_at = NOW()
+    WHERE user_email = p_user_email
+    RETURNING * INTO v_row;
+
+    RETURN jsonb_build_object(
+        'old_level', v_old_level,
+        'level', v_row.level,
+        'current_exp', v_row.current_exp,
+        'total_exp', v_row.total_exp,
+        'coins', v_row.coins
+    );
+END;
+$$;
+
+-- 5. 原子扣除经验值和金币（含降级，金币最低为0，总经验值不减少）
+CREATE OR REPLACE FUNCTION apply_punishment_delta(
+    p_user_email TEXT,
+    p_coins_deduct INTEGER,
+    p_exp_deduct INTEGER,
+    p_clear_q1_streak BOOLEAN DEFAULT FALSE
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_row user_gamification%ROWTYPE;
+    v_old_level INTEGER;
+    v_level INTEGER;
+    v_exp INTEGER;
+BEGIN
+    INSERT INTO user_gamification (user_email)
+    VALUES (p_user_email)
+    ON CONFLICT (user_email) DO NOTHING;
+
+    SELECT * INTO v_row FROM user_gamification
+    WHERE user_email = p_user_email
+    FOR UPDATE;
+
+    v_old_level := COALESCE(v_row.level, 1);
+    v_level := v_old_level;
+    v_exp := COALESCE(v_row.current_exp, 0) - p_exp_deduct;
+
+    WHILE v_exp < 0 AND v_level > 1 LOOP
+        v_level := v_level - 1;
+        v_exp := v_exp + v_level * 100;
+    END LOOP;
+
+    IF v_level = 1 THEN
+        v_exp := GREATEST(0, v_exp);
+    END IF;
+
+    UPDATE user_gamification
+    SET level = v_level,
+        current_exp = v_exp,
+        coins = GREATEST(0, COALESCE(coins, 0) - p_coins_deduct),
+        consecutive_q1_days = CASE WHEN p_clear_q1_streak THEN 0 ELSE consecutive_q1_days END,
+        last_punishment_date = CURRENT_DATE,
+        total_punishments = COALESCE(total_punishments, 0) + 1,
+        updated_at = NOW()
+    WHERE user_email = p_user_email
+    RETURNING * INTO v_row;
+
+    RETURN jsonb_build_object(
+        'old_level', v_old_level,
+        'level', v_row.level,
+        'current_exp', v_row.current_exp,
+        'total_exp', v_row.total_exp,
+        'coins', v_row.coins
+    );
+END;
+$$;
+
+-- 6. 原子扣除金币（购买道具）
+CREATE OR REPLACE FUNCTION spend_coins(
+    p_user_email TEXT,
+    p_amount INTEGER
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_coins INTEGER;
+BEGIN
+    UPDATE user_gamification
+    SET coins = coins - p_amount,
+        updated_at = NOW()
+    WHERE user_email = p_user_email
+      AND coins >= p_amount
+    RETURNING coins INTO v_coins;
+
+    IF NOT FOUND THEN
+        SELECT coins INTO v_coins FROM user_gamification WHERE user_email = p_user_email;
+        RETURN jsonb_build_object('success', FALSE, 'coins', v_coins);
+    END IF;
+
+    RETURN jsonb_build_object('success', TRUE, 'coins', v_coins);
+END;
+$$;
+
+-- 7. 任务奖励计算（与 gamification_utils.calculate_exp_gain / calculate_coins_gain 一致）
+CREATE OR REPLACE FUNCTION task_exp_gain(
+    p_progress_change INTEGER,
+    p_quadrant INTEGER
+) RETURNS INTEGER
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN p_progress_change <= 0 THEN 0
+        ELSE GREATEST(1, FLOOR(p_progress_change * CASE p_quadrant
+            WHEN 1 THEN 2.0
+            WHEN 2 THEN 1.5
+            WHEN 3 THEN 1.0
+            WHEN 4 THEN 0.5
+            ELSE 1.0
+        END)::INTEGER)
+    END;
+$$;
+
+CREATE OR REPLACE FUNCTION task_coins_gain(
+    p_completion_rate INTEGER
+) RETURNS INTEGER
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN p_completion_rate >= 100 THEN 100
+        WHEN p_completion_rate >= 80 THEN 50
+        WHEN p_completion_rate >= 60 THEN 20
+        ELSE 5
+    END;
+$$;
+
+-- 8. 在一个事务内执行一封回复的全部任务操作
+--    规则与 gamification_utils.compile_task_plan 一致：编号按操作前的快照解析，同一任务的重复操作合并，
+--    受影响的象限和暂缓池重新编号，奖励通过 apply_exp_and_coins 结算并写入 exp_history。
+--    p_ops 为规范化后的操作列表：[{"operation_type", "quadrant", "task_number", "progress", "task_name"}]
+--    返回 {"results": [{"operation", "result"}], "total_exp_gain", "total_coins_gain", "reward"}，
+--    results 的格式与 process_task_operations_v4 相同；任何一步失败时整个事务回滚
+CREATE OR REPLACE FUNCTION apply_task_operations(
+    p_user_email TEXT,
+    p_ops JSONB,
+    p_sparse BOOLEAN DEFAULT FALSE
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_gap CONSTANT INTEGER := 1024;  -- 与 gamification_utils.TASK_ORDER_GAP 一致
+    v_op JSONB;
+    v_type TEXT;
+    v_quadrant INTEGER;
+    v_number INTEGER;
+    v_progress INTEGER;
+    v_name TEXT;
+    v_task RECORD;
+    v_item JSONB;
+    v_results JSONB := '[]'::JSONB;
+    v_index INTEGER;
+    v_seq INTEGER := 0;
+    v_position INTEGER;
+    v_max_order INTEGER;
+    v_exp INTEGER;
+    v_coins INTEGER;
+    v_total_exp INTEGER := 0;
+    v_total_coins INTEGER := 0;
+    v_reward JSONB;
+BEGIN
+    -- 行锁：同一用户的两封回复同时处理时按顺序执行
+    PERFORM 1 FROM tasks
+    WHERE user_email = p_user_email AND is_deleted = FALSE AND status IN ('active', 'paused')
+    FOR UPDATE;
+
+    -- 操作前的快照，显示编号按 task_order 排序后的位置计算（与 build_task_number_index 一致）
+    DROP TABLE IF EXISTS pg_temp.task_plan_rows;
+    CREATE TEMP TABLE task_plan_rows ON COMMIT DROP AS
+    SELECT id,
+           task_name,
+           quadrant,
+           status,
+           task_order,
+           display_number,
+           COALESCE(progress_percentage, 0) AS progress_percentage,
+           ROW_NUMBER() OVER (
+               PARTITION BY status, CASE WHEN status = 'active' THEN quadrant END
+               ORDER BY COALESCE(task_order, 0), id
+           )::INTEGER AS display_position,
+           status AS new_status,
+           quadrant AS new_quadrant,
+           COALESCE(progress_percentage, 0) AS new_progress,
+           task_order AS new_order,
+           display_number AS new_display_number,
+           FALSE AS progress_updated,
+           NULL::INTEGER AS seq,           -- 暂缓 / 恢复的先后顺序
+           NULL::INTEGER AS update_index   -- 进度更新结果在 v_results 中的位置
+    FROM tasks
+    WHERE user_email = p_user_email AND is_deleted = FALSE AND status IN ('active', 'paused');
+
+    DROP TABLE IF EXISTS pg_temp.task_plan_created;
+    CREATE TEMP TABLE task_plan_created (
+        seq INTEGER,
+        task_name TEXT,
+        quadrant INTEGER,
+        task_order INTEGER,
+        display_number TEXT,
+        result_index INTEGER,
+        name_taken BOOLEAN DEFAULT FALSE   -- 与已有任务重名（UNIQUE(user_email, task_name)），不插入
+    ) ON COMMIT DROP;
+
+    -- 第一步：按快照解析每条操作，合并同一任务的重复操作
+    FOR v_op IN SELECT value FROM jsonb_array_elements(p_ops) WITH ORDINALITY AS e(value, n) ORDER BY n LOOP
+        v_type := LOWER(COALESCE(v_op->>'operation_type', ''));
+        v_quadrant := (v_op->>'quadrant')::INTEGER;
+        v_number := (v_op->>'task_number')::INTEGER;
+        v_progress := GREATEST(0, COALESCE((v_op->>'progress')::INTEGER, 0));
+        v_name := BTRIM(COALESCE(v_op->>'task_name', ''));
+        v_seq := v_seq + 1;
+
+        IF v_type = 'update' AND v_progress >= 100 THEN
+            v_type := 'complete';
+        END IF;
+
+        IF v_type IN ('complete', 'update', 'pause') THEN
+            SELECT * INTO v_task FROM task_plan_rows
+            WHERE status = 'active' AND quadrant = v_quadrant AND display_position = v_number;
+
+            IF NOT FOUND THEN
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', v_type,
+                    'result', jsonb_build_object(
+                        'success', FALSE,
+                        'error', format('任务不存在：Q%s任务%s', v_quadrant, v_number)
+                    )
+                ));
+                CONTINUE;
+            END IF;
+
+            -- 已完成或暂缓的任务忽略后续操作
+            CONTINUE WHEN v_task.new_status <> 'active';
+
+            IF v_type = 'update' THEN
+                IF v_task.update_index IS NULL THEN
+                    v_index := jsonb_array_length(v_results);
+                    v_results := v_results || jsonb_build_array(jsonb_build_object(
+                        'operation', 'update',
+                        'task_id', v_task.id,
+                        'result', jsonb_build_object(
+                            'success', TRUE,
+                            'task_name', v_task.task_name,
+                            'old_progress', v_task.progress_percentage,
+                            'new_progress', v_progress,
+                            'display_number', format('Q%s-%s', v_quadrant, v_number),
+                            'quadrant', v_quadrant,
+                            'task_number', v_number
+                        )
+                    ));
+                ELSE
+                    -- 同一任务多次更新只保留最后一次
+                    v_index := v_task.update_index;
+                    v_results := jsonb_set(v_results, ARRAY[v_index::TEXT, 'result', 'new_progress'], to_jsonb(v_progress));
+                END IF;
+
+                UPDATE task_plan_rows
+                SET new_progress = v_progress, progress_updated = TRUE, update_index = v_index
+                WHERE id = v_task.id;
+
+            ELSIF v_type = 'complete' THEN
+                -- 完成已包含之前的进度更新，奖励按快照中的进度计算
+                IF v_task.update_index IS NOT NULL THEN
+                    v_results := jsonb_set(v_results, ARRAY[v_task.update_index::TEXT], 'null'::JSONB);
+                END IF;
+
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', 'complete',
+                    'task_id', v_task.id,
+                    'result', jsonb_build_object(
+                        'success', TRUE,
+                        'task_name', v_task.task_name,
+                        'display_number', format('Q%s-%s', v_quadrant, v_number),
+                        'quadrant', v_quadrant,
+                        'task_number', v_number
+                    )
+                ));
+
+                UPDATE task_plan_rows
+                SET new_status = 'completed', new_progress = 100, update_index = NULL
+                WHERE id = v_task.id;
+
+            ELSE
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', 'pause',
+                    'task_id', v_task.id,
+                    'result', jsonb_build_object(
+                        'success', TRUE,
+                        'task_name', v_task.task_name,
+                        'old_display_number', format('Q%s-%s', v_quadrant, v_number),
+                        'quadrant', v_quadrant,
+                        'task_number', v_number
+                    )
+                ));
+
+                UPDATE task_plan_rows
+                SET new_status = 'paused', seq = v_seq
+                WHERE id = v_task.id;
+            END IF;
+
+        ELSIF v_type = 'resume' THEN
+            SELECT * INTO v_task FROM task_plan_rows
+            WHERE status = 'paused' AND display_position = v_number;
+
+            IF NOT FOUND THEN
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', v_type,
+                    'result', jsonb_build_object(
+                        'success', FALSE,
+                        'error', format('暂缓任务不存在：暂缓任务%s', v_number)
+                    )
+                ));
+                CONTINUE;
+            END IF;
+
+            IF v_quadrant IS NULL OR v_quadrant NOT BETWEEN 1 AND 4 THEN
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', v_type,
+                    'result', jsonb_build_object(
+                        'success', FALSE,
+                        'error', format('目标象限无效：%s', v_op->>'quadrant')
+                    )
+                ));
+                CONTINUE;
+            END IF;
+
+            -- 已恢复过的忽略
+            CONTINUE WHEN v_task.new_status <> 'paused';
+
+            v_results := v_results || jsonb_build_array(jsonb_build_object(
+                'operation', 'resume',
+                'task_id', v_task.id,
+                'result', jsonb_build_object(
+                    'success', TRUE,
+                    'task_name', v_task.task_name,
+                    'target_quadrant', v_quadrant
+                )
+            ));
+
+            UPDATE task_plan_rows
+            SET new_status = 'active', new_quadrant = v_quadrant, seq = v_seq
+            WHERE id = v_task.id;
+
+        ELSIF v_type = 'create' THEN
+            IF v_name = '' OR v_quadrant IS NULL OR v_quadrant NOT BETWEEN 1 AND 4 THEN
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', v_type,
+                    'result', jsonb_build_object(
+                        'success', FALSE,
+                        'error', CASE WHEN v_name = '' THEN '新增任务缺少任务名称'
+                                      ELSE format('象限无效：%s', v_op->>'quadrant') END
+                    )
+                ));
+                CONTINUE;
+            END IF;
+
+            -- 同一象限重复新增的忽略
+            CONTINUE WHEN EXISTS (
+                SELECT 1 FROM task_plan_created WHERE quadrant = v_quadrant AND task_name = v_name
+            );
+
+            -- 与已有任务（含已完成的）或本次其他象限新增的任务重名时只有这一条失败，不让整个事务回滚
+            IF EXISTS (SELECT 1 FROM tasks WHERE user_email = p_user_email AND task_name = v_name)
+               OR EXISTS (SELECT 1 FROM task_plan_created WHERE task_name = v_name) THEN
+                INSERT INTO task_plan_created (seq, task_name, quadrant, name_taken)
+                VALUES (v_seq, v_name, v_quadrant, TRUE);
+                v_results := v_results || jsonb_build_array(jsonb_build_object(
+                    'operation', v_type,
+                    'result', jsonb_build_object(
+                        'success', FALSE,
+                        'error', format('任务名称已存在：%s', v_name)
+                    )
+                ));
+                CONTINUE;
+            END IF;
+
+            INSERT INTO task_plan_created (seq, task_name, quadrant, result_index)
+            VALUES (v_seq, v_name, v_quadrant, jsonb_array_length(v_results));
+
+            v_results := v_results || jsonb_build_array(jsonb_build_object(
+                'operation', 'create',
+                'result', jsonb_build_object(
+                    'success', TRUE,
+                    'task_name', v_name,
+                    'quadrant', v_quadrant
+                )
+            ));
+        END IF;
+    END LOOP;
+
+    -- 第二步：重新编号，受影响的象限 = 剩下的任务 + 恢复的任务 + 新增的任务
+    FOR v_quadrant IN
+        SELECT quadrant FROM task_plan_rows WHERE status = 'active' AND new_status <> 'active'
+        UNION
+        SELECT new_quadrant FROM task_plan_rows WHERE status = 'paused' AND new_status = 'active'
+        UNION
+        SELECT quadrant FROM task_plan_created WHERE NOT name_taken
+        ORDER BY 1
+    LOOP
+        v_position := 0;
+        SELECT COALESCE(MAX(task_order), 0) INTO v_max_order
+        FROM task_plan_rows WHERE status = 'active' AND quadrant = v_quadrant;
+
+        FOR v_task IN
+            SELECT id, status FROM task_plan_rows
+            WHERE new_status = 'active' AND new_quadrant = v_quadrant
+            ORDER BY (status = 'paused'), CASE WHEN status = 'active' THEN display_position ELSE seq END
+        LOOP
+            v_position := v_position + 1;
+
+            IF v_task.status = 'paused' THEN
+                -- 恢复的任务追加到象限末尾
+                IF p_sparse THEN
+                    v_max_order := v_max_order + v_gap;
+                END IF;
+                UPDATE task_plan_rows
+                SET new_order = CASE WHEN p_sparse THEN v_max_order ELSE v_position END,
+                    new_display_number = format('Q%s-%s', v_quadrant, v_position)
+                WHERE id = v_task.id;
+            ELSIF NOT p_sparse THEN
+                -- sparse 模式下已有任务的编号在展示时计算，不需要改写
+                UPDATE task_plan_rows
+                SET new_order = v_position,
+                    new_display_number = format('Q%s-%s', v_quadrant, v_position)
+                WHERE id = v_task.id;
+            END IF;
+        END LOOP;
+
+        FOR v_index IN SELECT seq FROM task_plan_created WHERE quadrant = v_quadrant AND NOT name_taken ORDER BY seq LOOP
+            v_position := v_position + 1;
+            IF p_sparse THEN
+                v_max_order := v_max_order + v_gap;
+            END IF;
+            UPDATE task_plan_created
+            SET task_order = CASE WHEN p_sparse THEN v_max_order ELSE v_position END,
+                display_number = format('Q%s-%s', v_quadrant, v_position)
+            WHERE seq = v_index;
+        END LOOP;
+    END LOOP;
+
+    -- 暂缓池：剩下的暂缓任务 + 新暂缓的任务
+    IF EXISTS (SELECT 1 FROM task_plan_rows WHERE status <> new_status AND 'paused' IN (status, new_status)) THEN
+        v_position := 0;
+        SELECT COALESCE(MAX(task_order), 0) INTO v_max_order
+        FROM task_plan_rows WHERE status = 'paused';
+
+        FOR v_task IN
+            SELECT id, status FROM task_plan_rows
+            WHERE new_status = 'paused'
+            ORDER BY (status = 'active'), CASE WHEN status = 'paused' THEN display_position ELSE seq END
+        LOOP
+            v_position := v_position + 1;
+
+            IF NOT p_sparse THEN
+                UPDATE task_plan_rows
+                SET new_order = v_position, new_display_number = format('暂缓-%s', v_position)
+                WHERE id = v_task.id;
+            ELSIF v_task.status = 'active' THEN
+                v_max_order := v_max_order + v_gap;
+                UPDATE task_plan_rows SET new_order = v_max_order WHERE id = v_task.id;
+            END IF;
+        END LOOP;
+    END IF;
+
+    -- 第三步：写回变化的任务，插入新任务
+    UPDATE tasks t
+    SET status = r.new_status,
+        quadrant = r.new_quadrant,
+        progress_percentage = r.new_progress,
+        task_order = r.new_order,
+        display_number = r.new_display_number,
+        is_deleted = (r.new_status = 'completed'),
+        deleted_at = CASE WHEN r.new_status = 'completed' THEN NOW() ELSE t.deleted_at END,
+        updated_at = CASE WHEN r.progress_updated THEN NOW() ELSE t.updated_at END,
+        last_progress_update = CASE WHEN r.progress_updated THEN CURRENT_DATE ELSE t.last_progress_update END,
+        last_reminded_date = CASE WHEN r.status = 'active' AND r.new_status = 'paused'
+                                  THEN CURRENT_DATE ELSE t.last_reminded_date END
+    FROM task_plan_rows r
+    WHERE t.id = r.id
+      AND (r.progress_updated
+           OR r.new_status <> r.status
+           OR r.new_quadrant IS DISTINCT FROM r.quadrant
+           OR r.new_order IS DISTINCT FROM r.task_order
+           OR r.new_display_number IS DISTINCT FROM r.display_number);
+
+    INSERT INTO tasks (user_email, task_name, quadrant, task_order, display_number,
+                       progress_percentage, status, is_deleted, created_at, updated_at)
+    SELECT p_user_email, task_name, quadrant, task_order, display_number, 0, 'active', FALSE, NOW(), NOW()
+    FROM task_plan_created
+    WHERE NOT name_taken
+    ORDER BY seq;
+
+    -- 第四步：补全结果中的编号，计算奖励并记录经验值历史
+    FOR v_index IN 0 .. jsonb_array_length(v_results) - 1 LOOP
+        v_item := v_results -> v_index;
+        CONTINUE WHEN v_item = 'null'::JSONB OR NOT (v_item #>> '{result,success}')::BOOLEAN;
+
+        v_type := v_item ->> 'operation';
+
+        IF v_type = 'create' THEN
+            SELECT * INTO v_task FROM task_plan_created WHERE result_index = v_index;
+            v_item := jsonb_set(v_item, '{result}', (v_item -> 'result') || jsonb_build_object(
+                'display_number', v_task.display_number,
+                'task_number', split_part(v_task.display_number, '-', 2)::INTEGER
+            ));
+
+        ELSIF v_type = 'resume' THEN
+            SELECT * INTO v_task FROM task_plan_rows WHERE id = (v_item ->> 'task_id')::UUID;
+            v_item := jsonb_set(v_item, '{result}', (v_item -> 'result') || jsonb_build_object(
+                'new_display_number', v_task.new_display_number,
+                'new_task_number', split_part(v_task.new_display_number, '-', 2)::INTEGER
+            ));
+
+        ELSIF v_type = 'complete' THEN
+            SELECT * INTO v_task FROM task_plan_rows WHERE id = (v_item ->> 'task_id')::UUID;
+            v_exp := task_exp_gain(100 - v_task.progress_percentage, v_task.quadrant);
+            v_coins := task_coins_gain(100);
+            v_item := jsonb_set(v_item, '{result}', (v_item -> 'result') || jsonb_build_object(
+                'exp_gain', v_exp,
+                'coins_gain', v_coins
+            ));
+
+            INSERT INTO exp_history (user_email, exp_gained, coins_gained, reason)
+            VALUES (p_user_email, v_exp, v_coins, '完成任务：' || v_task.task_name);
+            v_total_exp := v_total_exp + v_exp;
+            v_total_coins := v_total_coins + v_coins;
+
+        ELSIF v_type = 'update' THEN
+            SELECT * INTO v_task FROM task_plan_rows WHERE id = (v_item ->> 'task_id')::UUID;
+            v_progress := (v_item #>> '{result,new_progress}')::INTEGER - v_task.progress_percentage;
+            v_exp := task_exp_gain(v_progress, v_task.quadrant);
+            v_coins := CASE WHEN v_progress > 0 THEN task_coins_gain(v_task.new_progress) ELSE 0 END;
+            v_item := jsonb_set(v_item, '{result}', (v_item -> 'result') || jsonb_build_object(
+                'exp_gain', v_exp,
+                'coins_gain', v_coins
+            ));
+
+            IF v_progress > 0 THEN
+                INSERT INTO exp_history (user_email, exp_gained, coins_gained, reason)
+                VALUES (p_user_email, v_exp, v_coins, format('更新任务进度：%s (%s%% → %s%%)',
+                        v_task.task_name, v_task.progress_percentage, v_task.new_progress));
+                v_total_exp := v_total_exp + v_exp;
+                v_total_coins := v_total_coins + v_coins;
+            END IF;
+        END IF;
+
+        v_results := jsonb_set(v_results, ARRAY[v_index::TEXT], v_item);
+    END LOOP;
+
+    SELECT COALESCE(jsonb_agg(item - 'task_id' ORDER BY n), '[]'::JSONB) INTO v_results
+    FROM jsonb_array_elements(v_results) WITH ORDINALITY AS e(item, n)
+    WHERE item <> 'null'::JSONB;
+
+    IF v_total_exp <> 0 OR v_total_coins <> 0 THEN
+        v_reward := apply_exp_and_coins(p_user_email, v_total_exp, v_total_coins);
+    END IF;
+
+    RETURN jsonb_build_object(
+        'results', v_results,
+        'total_exp_gain', v_total_exp,
+        'total_coins_gain', v_total_coins,
+        'reward', v_reward
+    );
+END;
+$$;
+
+-- 启用RLS（service_role key 不受影响）
+ALTER TABLE user_gamification ENABLE ROW LEVEL SECURITY;
+ALTER TABLE exp_history ENABLE ROW LEVEL SECURITY;
+ALTER TABLE punishment_history ENABLE ROW LEVEL SECURITY;
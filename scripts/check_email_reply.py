@@ -7,7 +7,6 @@ import sys
 import poplib
 import email
 from email.header import decode_header
-import requests
 from datetime import datetime, timedelta, date
 import re
 import json
@@ -17,7 +16,6 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入游戏化工具
 from gamification_utils import (
-    update_user_exp_and_coins,
     check_and_update_q1_streak,
     format_level_up_message,
     get_user_gamification_data,
@@ -39,14 +37,21 @@ from gamification_utils import (
     get_user_inventory_summary,
     # v4.0 任务编号系统函数
     parse_task_operations_v4,
+    parse_task_operations_batch,
     process_task_operations_v4,
-    format_operation_feedback_v4
+    format_operation_feedback_v4,
+    UserGamificationCache
 )
+from supabase_client import SupabaseClient
+from outbox import send_notification
+from mailbox_cursor import MailboxCursor, list_message_uids, reply_message_key, claim_reply
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
 
-def update_user_reply_tracking(supabase_url, headers, user_email):
+def update_user_reply_tracking(client, user_email):
     """更新用户回复追踪"""
     try:
-        update_url = f"{supabase_url}/rest/v1/user_reply_tracking?user_email=eq.{user_email}"
+        update_url = f"user_reply_tracking?user_email=eq.{user_email}"
         update_data = {
             "last_reply_date": date.today().isoformat(),
             "consecutive_no_reply_days": 0,
@@ -54,14 +59,14 @@ def update_user_reply_tracking(supabase_url, headers, user_email):
             "updated_at": datetime.now().isoformat()
         }
         
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+        response = client.patch(update_url, json=update_data)
         
         if response.status_code in [200, 204]:
             print("✅ 更新用户回复追踪成功")
             return True
         
         # 如果更新失败，尝试创建
-        create_url = f"{supabase_url}/rest/v1/user_reply_tracking"
+        create_url = "user_reply_tracking"
         create_data = {
             "user_email": user_email,
             "last_reply_date": date.today().isoformat(),
@@ -69,7 +74,7 @@ def update_user_reply_tracking(supabase_url, headers, user_email):
             "total_replies": 1
         }
         
-        response = requests.post(create_url, headers=headers, json=create_data, timeout=30)
+        response = client.post(create_url, json=create_data)
         
         if response.status_code in [200, 201]:
             print("✅ 创建用户回复追踪成功")
@@ -119,196 +124,176 @@ def parse_email_content(msg):
     
     return content.strip()
 
-def check_and_process_email_reply():
-    """检查邮件回复并处理"""
-    print(f"[{datetime.now()}] 开始检查邮件回复")
+# 目标邮件标题（用于筛选）
+TARGET_SUBJECTS = [
+    "回复：📊 每日复盘提醒",
+    "Re: 📊 每日复盘提醒",
+    "回复：📊 每日跟进提醒",
+    "Re: 📊 每日跟进提醒"
+]
+
+# 只处理最近多长时间内的回复
+REPLY_WINDOW = timedelta(hours=2)
+
+def fetch_message_headers(pop_server, index):
+    """
+    只获取邮件头（POP3 TOP n 0），不下载正文和附件
     
-    # 获取环境变量
-    email_username = os.getenv("EMAIL_163_USERNAME", "").strip()
-    email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
-    webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    supabase_url = os.getenv("SUPABASE_URL", "").strip()
-    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
-    deepseek_api_key = os.getenv("DEEPSEEK_API_KEY", "").strip()
+    服务器不支持 TOP 时退回到 RETR
+    """
+    try:
+        response, lines, octets = pop_server.top(index, 0)
+    except poplib.error_proto:
+        response, lines, octets = pop_server.retr(index)
+    return email.message_from_bytes(b'\r\n'.join(lines))
+
+def find_reply_candidates(pop_server, indices, use_window=True):
+    """
+    扫描指定邮件的邮件头，筛选标题匹配（且在时间窗口内）的回复
     
-    if not all([email_username, email_password, supabase_url, supabase_key, deepseek_api_key]):
-        print("❌ 环境变量未配置完整")
-        return False
+    参数:
+        pop_server: 已登录的 POP3 连接
+        indices: 要检查的邮件序号
+        use_window: 是否只保留最近 REPLY_WINDOW 内的回复（没有邮箱游标时使用）
     
-    try:
-        # 连接到 POP3 服务器
-        print("连接到 163 邮箱...")
-        pop_server = poplib.POP3_SSL("pop.163.com", 995)
-        pop_server.user(email_username)
-        pop_server.pass_(email_password)
-        
-        # 获取邮件数量
-        num_messages = len(pop_server.list()[1])
-        print(f"邮箱中共有 {num_messages} 封邮件")
+    Returns:
+        tuple: (candidates, failed)
+            candidates: [(邮件时间, 邮件序号, 去重键)]，按时间从新到旧排序
+            failed: 读取失败的邮件序号（下次运行重新检查）
+    """
+    from email.utils import parsedate_to_datetime
+    
+    candidates = []
+    failed = []
+    
+    for i in indices:
+        try:
+            headers = fetch_message_headers(pop_server, i)
+        except Exception as e:
+            print(f"读取邮件 #{i} 失败: {e}")
+            failed.append(i)
+            continue
         
-        if num_messages == 0:
-            print("没有新邮件")
-            pop_server.quit()
-            return True
+        # 获取邮件时间和标题
+        date_str = headers.get("Date", "")
+        subject = decode_str(headers.get("Subject", ""))
         
-        # 只检查最近的邮件（最多检查最新的10封）
-        check_count = min(10, num_messages)
-        latest_reply = None
-        latest_time = None
-        
-        # 目标邮件标题（用于筛选）
-        target_subjects = [
-            "回复：📊 每日复盘提醒",
-            "Re: 📊 每日复盘提醒",
-            "回复：📊 每日跟进提醒",
-            "Re: 📊 每日跟进提醒"
-        ]
-        
-        # 从最新的邮件开始检查
-        for i in range(num_messages, num_messages - check_count, -1):
-            try:
-                # 获取邮件
-                response, lines, octets = pop_server.retr(i)
-                msg_content = b'\r\n'.join(lines)
-                msg = email.message_from_bytes(msg_content)
-                
-                # 获取邮件时间和标题
-                date_str = msg.get("Date", "")
-                subject = decode_str(msg.get("Subject", ""))
-                
-                print(f"\n检查邮件 #{i}: {subject}")
-                print(f"时间: {date_str}")
-                
-                # 检查标题是否符合要求
-                subject_match = False
-                for target_subject in target_subjects:
-                    if target_subject in subject:
-                        subject_match = True
-                        print(f"  → 标题匹配: {target_subject}")
-                        break
-                
-                if not subject_match:
-                    print(f"  → 标题不匹配，跳过")
-                    continue
-                
-                # 检查是否是最近的邮件（最近2小时内）
-                try:
-                    from email.utils import parsedate_to_datetime
-                    email_date = parsedate_to_datetime(date_str)
-                    now = datetime.now(email_date.tzinfo)
-                    
-                    # 只处理最近2小时内的邮件
-                    two_hours_ago = now - timedelta(hours=2)
-                    
-                    if email_date < two_hours_ago:
-                        print(f"  → 邮件时间早于2小时前，跳过")
-                        continue
-                    
-                    # 解析邮件内容
-                    content = parse_email_content(msg)
-                    
-                    if content and len(content) > 10:
-                        # 找到最新的回复
-                        if latest_time is None or email_date > latest_time:
-                            latest_reply = content
-                            latest_time = email_date
-                            print(f"  → 找到符合条件的回复内容（{len(content)}字符）")
-                    
-                except Exception as e:
-                    print(f"  → 解析邮件失败: {e}")
-                    continue
-                    
-            except Exception as e:
-                print(f"读取邮件 #{i} 失败: {e}")
-                continue
+        print(f"\n检查邮件 #{i}: {subject}")
+        print(f"时间: {date_str}")
         
-        pop_server.quit()
+        # 检查标题是否符合要求
+        matched_subject = next((target for target in TARGET_SUBJECTS if target in subject), None)
+        if not matched_subject:
+            print(f"  → 标题不匹配，跳过")
+            continue
+        print(f"  → 标题匹配: {matched_subject}")
         
-        # 如果没有找到符合条件的回复
-        if not latest_reply:
-            print("\n没有找到符合标题要求的回复邮件")
-            
-            # 发送提醒到飞书和邮箱
-            reminder_text = ("📧 邮件检查结果\n\n"
-                           "没有检测到符合要求的回复邮件。\n\n"
-                           "请确认：\n"
-                           "1. 回复了「📊 每日复盘提醒」或「📊 每日跟进提醒」邮件\n"
-                           "2. 邮件标题包含「回复：」或「Re:」\n"
-                           "3. 回复时间在最近2小时内\n\n"
-                           "💡 如需修改计划，请访问：\n"
-                           "https://github.com/Zihui1112/ai-email-coach/actions\n"
-                           "手动运行「处理用户回复」workflow")
+        try:
+            email_date = parsedate_to_datetime(date_str)
             
-            # 发送到飞书
-            if webhook_url:
-                message = {
-                    "msg_type": "text",
-                    "content": {
-                        "text": reminder_text
-                    }
-                }
-                requests.post(webhook_url, json=message, timeout=30)
+            # 检查是否是最近的邮件（最近2小时内）
+            if use_window:
+                now = datetime.now(email_date.tzinfo)
+                if email_date < now - REPLY_WINDOW:
+                    print(f"  → 邮件时间早于2小时前，跳过")
+                    continue
             
-            # 发送邮件提醒
-            try:
-                import smtplib
-                from email.mime.text import MIMEText
-                from email.mime.multipart import MIMEMultipart
-                
-                print("\n发送提醒邮件...")
-                
-                msg = MIMEMultipart()
-                msg['From'] = email_username
-                msg['To'] = email_username
-                msg['Subject'] = "⚠️ 未检测到回复"
-                
-                msg.attach(MIMEText(reminder_text, 'plain', 'utf-8'))
-                
-                server = smtplib.SMTP_SSL("smtp.163.com", 465)
-                server.login(email_username, email_password)
-                server.send_message(msg)
-                server.quit()
-                
-                print("✅ 提醒邮件发送成功")
-                
-            except Exception as e:
-                print(f"❌ 提醒邮件发送失败: {e}")
+            candidates.append((email_date, i, reply_message_key(headers)))
             
-            return True
+        except Exception as e:
+            print(f"  → 解析邮件失败: {e}")
+            continue
+    
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    return candidates, failed
+
+def download_reply_content(pop_server, index):
+    """
+    下载一封邮件并解析正文
+    
+    Returns:
+        str: 回复内容，读取失败或内容过短（不超过10字符）时返回 None
+    """
+    try:
+        response, lines, octets = pop_server.retr(index)
+        msg = email.message_from_bytes(b'\r\n'.join(lines))
         
-        print(f"\n✅ 找到最新回复（{latest_time}）")
-        print(f"内容预览: {latest_reply[:100]}...")
+        # 解析邮件内容
+        content = parse_email_content(msg)
         
-        # 数据库headers
-        db_headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if content and len(content) > 10:
+            print(f"  → 邮件 #{index} 符合条件的回复内容（{len(content)}字符）")
+            return content
+        
+        print(f"  → 邮件 #{index} 内容过短，跳过")
         
+    except Exception as e:
+        print(f"读取邮件 #{index} 失败: {e}")
+    
+    return None
+
+def send_no_reply_reminder(client, email_username, email_password, webhook_url):
+    """没有找到回复时，发送提醒到飞书和邮箱"""
+    reminder_text = ("📧 邮件检查结果\n\n"
+                   "没有检测到符合要求的回复邮件。\n\n"
+                   "请确认：\n"
+                   "1. 回复了「📊 每日复盘提醒」或「📊 每日跟进提醒」邮件\n"
+                   "2. 邮件标题包含「回复：」或「Re:」\n"
+                   "3. 回复时间在最近2小时内\n\n"
+                   "💡 如需修改计划，请访问：\n"
+                   "https://github.com/Zihui1112/ai-email-coach/actions\n"
+                   "手动运行「处理用户回复」workflow")
+    
+    # 飞书和邮件并发发送
+    print("\n发送提醒...")
+    send_notification(
+        client, email_username, "no_reply_reminder", "⚠️ 未检测到回复", reminder_text,
+        feishu_text=reminder_text if webhook_url else None,
+        sender_email=email_username, email_password=email_password, webhook_url=webhook_url
+    )
+
+# process_reply(operations=...) 的取值：这封回复的批量解析和逐封重试都已经失败，不再调用 AI
+PARSE_ALREADY_FAILED = object()
+
+def process_reply(client, reply_content, email_username, email_password, webhook_url, deepseek_api_key,
+                  operations=None):
+    """
+    处理一封回复：执行命令和任务操作，并发送反馈
+    
+    参数:
+        operations: 已经批量解析好的任务操作（parse_task_operations_batch），为 None 时在这里解析；
+                    为 PARSE_ALREADY_FAILED 时按未检测到任务操作处理
+    
+    Returns:
+        bool: 是否处理成功
+    """
+    # 游戏化数据只读一次，修改在发送反馈前统一写回
+    client.gamification_cache = UserGamificationCache(client)
+    
+    try:
         # 检查是否有性格切换命令
-        personality_switch_cmd = parse_personality_switch_command(latest_reply)
+        personality_switch_cmd = parse_personality_switch_command(reply_content)
         personality_switch_result = None
         
         if personality_switch_cmd:
             print(f"\n检测到性格切换命令: {personality_switch_cmd}")
-            personality_switch_result = switch_ai_personality(supabase_url, db_headers, email_username, personality_switch_cmd)
+            personality_switch_result = switch_ai_personality(client, email_username, personality_switch_cmd)
         
         # 检查是否有购买命令
-        purchase_cmd = parse_purchase_command(latest_reply)
+        purchase_cmd = parse_purchase_command(reply_content)
         purchase_result = None
         
         if purchase_cmd:
             print(f"\n检测到购买命令: {purchase_cmd}")
             
             # 获取道具信息
-            item_data = get_shop_item_by_name(supabase_url, db_headers, purchase_cmd)
+            item_data = get_shop_item_by_name(client, purchase_cmd)
             
             if not item_data:
                 purchase_result = {'success': False, 'error_type': 'item_not_found'}
             else:
                 # 获取用户数据
-                user_data = get_user_gamification_data(supabase_url, db_headers, email_username)
+                user_data = get_user_gamification_data(client, email_username)
                 
                 # 检查购买资格
                 eligibility = check_purchase_eligibility(user_data, item_data)
@@ -321,7 +306,7 @@ def check_and_process_email_reply():
                     }
                 else:
                     # 检查使用限制
-                    limit_check = check_usage_limit(supabase_url, db_headers, email_username, item_data['item_code'], item_data)
+                    limit_check = check_usage_limit(client, email_username, item_data['item_code'], item_data)
                     
                     if not limit_check['within_limit']:
                         purchase_result = {
@@ -331,15 +316,22 @@ def check_and_process_email_reply():
                         }
                     else:
                         # 执行购买
-                        purchase_result = purchase_item(supabase_url, db_headers, email_username, item_data['item_code'], item_data)
+                        purchase_result = purchase_item(client, email_username, item_data['item_code'], item_data)
         
         # ============================================
         # v4.1：使用任务编号系统处理任务操作
         # ============================================
         print("\n使用 v4.0 任务编号系统解析回复...")
         
+        # 任务操作的数据库函数调用失败（结果未确认）时，反馈照常发送，但这封回复按处理失败返回
+        operations_failed = False
+        
         # 解析任务操作
-        operations = parse_task_operations_v4(latest_reply, deepseek_api_key)
+        if operations is None:
+            operations = parse_task_operations_v4(reply_content, deepseek_api_key)
+        elif operations is PARSE_ALREADY_FAILED:
+            print("⚠️ 批量解析和逐封重试都已失败，不再调用 AI")
+            operations = None
         
         if not operations or len(operations) == 0:
             print("⚠️ 未检测到任务操作")
@@ -354,25 +346,19 @@ def check_and_process_email_reply():
             print(f"✅ 解析到 {len(operations)} 个任务操作")
             
             # 处理任务操作
-            operation_results = process_task_operations_v4(supabase_url, db_headers, email_username, operations)
+            operation_results = process_task_operations_v4(client, email_username, operations)
+            operations_failed = operation_results.get('failed', False)
             
             # 格式化反馈（v4.1：极简风格）
             feedback_content = format_operation_feedback_v4_minimalist(operation_results)
             
-            # 更新用户经验值和金币
+            # 经验值和金币已在 process_task_operations_v4 中统一结算
             total_exp_gain = operation_results.get('total_exp_gain', 0)
             total_coins_gain = operation_results.get('total_coins_gain', 0)
             
             if total_exp_gain > 0 or total_coins_gain > 0:
                 print(f"\n更新游戏化数据: EXP +{total_exp_gain}, Coins +{total_coins_gain}")
-                update_result = update_user_exp_and_coins(
-                    supabase_url, 
-                    db_headers, 
-                    email_username, 
-                    total_exp_gain, 
-                    total_coins_gain,
-                    f"任务更新"
-                )
+                update_result = operation_results.get('reward_result')
                 
                 # 检查是否升级
                 if update_result and update_result.get('level_up'):
@@ -383,19 +369,19 @@ def check_and_process_email_reply():
                 else:
                     # 如果没有升级，显示解锁进度激励
                     if update_result:
-                        user_game_data_updated = get_user_gamification_data(supabase_url, db_headers, email_username)
+                        user_game_data_updated = get_user_gamification_data(client, email_username)
                         if user_game_data_updated:
                             unlock_progress_msg = format_unlock_progress_message(user_game_data_updated, total_exp_gain)
                             feedback_content += unlock_progress_msg
         
         # 更新用户回复追踪
-        update_user_reply_tracking(supabase_url, db_headers, email_username)
+        update_user_reply_tracking(client, email_username)
         
         # 更新连续回复天数
-        consecutive_reply_days = update_consecutive_reply_days(supabase_url, db_headers, email_username)
+        consecutive_reply_days = update_consecutive_reply_days(client, email_username)
         
         # 检查坚持里程碑奖励
-        persistence_reward = check_persistence_milestone(supabase_url, db_headers, email_username, consecutive_reply_days)
+        persistence_reward = check_persistence_milestone(client, email_username, consecutive_reply_days)
         
         # 如果有坚持奖励，添加到反馈中
         if persistence_reward:
@@ -418,53 +404,162 @@ def check_and_process_email_reply():
                 feedback_content += "\n\n" + format_purchase_error_message(error_type, error_data)
         
         # 显示背包摘要
-        inventory_summary = get_user_inventory_summary(supabase_url, db_headers, email_username)
+        inventory_summary = get_user_inventory_summary(client, email_username)
         if inventory_summary:
             feedback_content += inventory_summary
         
-        # 发送反馈到飞书
-        if webhook_url:
-            message = {
-                "msg_type": "text",
-                "content": {
-                    "text": feedback_content
-                }
-            }
-            
-            response = requests.post(webhook_url, json=message, timeout=30)
-            
-            if response.status_code == 200:
-                print("✅ 反馈已发送到飞书")
-            else:
-                print(f"❌ 发送飞书消息失败: {response.status_code}")
+        # 写回本次运行的游戏化数据修改（每个用户一次 PATCH）
+        if not client.gamification_cache.flush():
+            print("⚠️ 游戏化数据写回失败")
+        
+        # 反馈并发发送到飞书和邮箱
+        print("\n发送反馈...")
+        send_notification(
+            client, email_username, "reply_feedback", "📊 任务更新反馈", feedback_content,
+            feishu_text=feedback_content if webhook_url else None,
+            sender_email=email_username, email_password=email_password, webhook_url=webhook_url
+        )
+        
+        if operations_failed:
+            print("\n❌ 任务操作失败，结果未确认")
+            return False
+        
+        print("\n✅ 邮件回复处理完成")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 处理失败: {e}")
+        import traceback
+        traceback.print_exc()
+        # 任务已经修改时，尽量保住已计算的奖励
+        client.gamification_cache.flush()
+        return False
+    
+    finally:
+        client.gamification_cache = None
+
+def check_and_process_email_reply():
+    """
+    检查邮件回复并处理
+    
+    使用邮箱游标（UIDL）时只检查上次运行之后新到的邮件，每封符合条件的回复都处理且只处理一次；
+    还没有游标状态时（首次运行或游标不可用），退回到只处理最新10封中最近2小时内的最新一封回复。
+    """
+    print(f"[{datetime.now()}] 开始检查邮件回复")
+    
+    # 获取环境变量
+    email_username = os.getenv("EMAIL_163_USERNAME", "").strip()
+    email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
+    webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
+    supabase_url = os.getenv("SUPABASE_URL", "").strip()
+    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    deepseek_api_key = os.getenv("DEEPSEEK_API_KEY", "").strip()
+    
+    if not all([email_username, email_password, supabase_url, supabase_key, deepseek_api_key]):
+        print("❌ 环境变量未配置完整")
+        return False
+    
+    try:
+        # 数据库客户端（整个运行共享一个连接池）
+        client = SupabaseClient(supabase_url, supabase_key)
+        
+        # 读取邮箱游标
+        cursor = MailboxCursor(email_username, client)
+        cursor_loaded = cursor.load()
+        use_cursor = cursor_loaded and cursor.has_state
+        
+        # 连接到 POP3 服务器
+        print("连接到 163 邮箱...")
+        pop_server = poplib.POP3_SSL("pop.163.com", 995)
+        pop_server.user(email_username)
+        pop_server.pass_(email_password)
+        
+        # 获取邮件数量
+        num_messages = len(pop_server.list()[1])
+        print(f"邮箱中共有 {num_messages} 封邮件")
+        
+        if num_messages == 0:
+            print("没有新邮件")
+            pop_server.quit()
+            return True
         
-        # 同时发送反馈邮件
         try:
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            
-            print("\n发送反馈邮件...")
-            
-            msg = MIMEMultipart()
-            msg['From'] = email_username
-            msg['To'] = email_username
-            msg['Subject'] = "📊 任务更新反馈"
-            
-            msg.attach(MIMEText(feedback_content, 'plain', 'utf-8'))
-            
-            server = smtplib.SMTP_SSL("smtp.163.com", 465)
-            server.login(email_username, email_password)
-            server.send_message(msg)
-            server.quit()
+            message_uids = list_message_uids(pop_server)
+        except Exception as e:
+            print(f"⚠️ 获取邮件 UIDL 失败，本次不使用邮箱游标: {e}")
+            message_uids = None
+        
+        uid_by_index = dict(message_uids or [])
+        
+        if use_cursor and message_uids is not None:
+            # 只检查游标之后新到的邮件，检查量与新邮件数成正比
+            new_indices = [i for i, uid in reversed(message_uids) if cursor.is_new(uid)]
+            print(f"新邮件 {len(new_indices)} 封")
+            candidates, failed = find_reply_candidates(pop_server, new_indices, use_window=False)
+        else:
+            # 没有游标：只检查最近的邮件（最多检查最新的10封）
+            check_count = min(10, num_messages)
+            new_indices = list(range(num_messages, num_messages - check_count, -1))
+            candidates, failed = find_reply_candidates(pop_server, new_indices)
+        
+        # 第一步已经只取邮件头（TOP n 0）筛选过标题和时间
+        # 第二步：只下载候选邮件的正文，按时间从旧到新处理
+        replies = []
+        for email_date, i, message_key in candidates:
+            content = download_reply_content(pop_server, i)
+            if content:
+                replies.append((email_date, i, message_key, content))
+                if not use_cursor:
+                    # 没有游标时只处理最新的一封
+                    break
+        replies.reverse()
+        
+        pop_server.quit()
+        
+        # 本次检查过的邮件（含要处理的回复、首次运行时检查范围之外的旧邮件）都记为已检查，读取失败的留到下次。
+        # 先记录再处理：处理中途失败时任务可能已经修改，重复处理会重复结算奖励。
+        # 游标整个运行只保存这一次（每封回复保存一次会把完整的 UID 集合重写 N 遍）
+        if cursor_loaded:
+            cursor.mark_seen(uid for i, uid in uid_by_index.items() if i not in failed)
+            if message_uids is not None:
+                # 只保留邮箱中仍然存在的邮件
+                cursor.prune(uid for _, uid in message_uids)
+            cursor.save()
+        else:
+            # 读取失败时本次只处理了最新一封，其余回复记为已检查就再也不会处理；保留原来的游标
+            print("⚠️ 邮箱游标读取失败，本次不更新游标")
+        
+        # 如果没有找到符合条件的回复
+        if not replies:
+            print("\n没有找到符合标题要求的回复邮件")
+            send_no_reply_reminder(client, email_username, email_password, webhook_url)
+        
+        # 按 Message-ID 登记，IMAP 监听已经处理过的回复跳过（两者共用 processed_replies 表）
+        replies = [reply for reply in replies
+                   if claim_reply(client, email_username, reply[2], 'pop3')]
+        
+        # 多封回复一次请求批量解析
+        parsed = {}
+        if len(replies) > 1:
+            parsed = parse_task_operations_batch({i: content for _, i, _, content in replies}, deepseek_api_key)
+        
+        all_success = True
+        for email_date, i, _, content in replies:
+            print(f"\n✅ 找到回复 #{i}（{email_date}）")
+            print(f"内容预览: {content[:100]}...")
             
-            print("✅ 反馈邮件发送成功")
+            # 批量解析结果为 None 表示 AI 已经调用过两次（批量 + 逐封）都失败了
+            operations = parsed.get(i)
+            if i in parsed and operations is None:
+                operations = PARSE_ALREADY_FAILED
             
-        except Exception as e:
-            print(f"❌ 反馈邮件发送失败: {e}")
+            if not process_reply(client, content, email_username, email_password, webhook_url, deepseek_api_key,
+                                 operations=operations):
+                all_success = False
         
-        print("\n✅ 邮件回复处理完成")
-        return True
+        print(get_llm_cache().format_stats())
+        print(get_llm_client(deepseek_api_key).format_stats())
+        return all_success
         
     except Exception as e:
         print(f"❌ 处理失败: {e}")
@@ -473,6 +568,7 @@ def check_and_process_email_reply():
         return False
 
 
+
 def format_operation_feedback_v4_minimalist(operation_results):
     """
     v4.1：格式化任务操作反馈消息（极简风格）
@@ -566,5 +662,10 @@ def format_operation_feedback_v4_minimalist(operation_results):
 
 
 if __name__ == "__main__":
-    success = check_and_process_email_reply()
+    if "--listen" in sys.argv[1:]:
+        # 常驻模式：IMAP IDLE 监听新回复
+        from imap_listener import listen_for_replies
+        success = listen_for_replies()
+    else:
+        success = check_and_process_email_reply()
     sys.exit(0 if success else 1)
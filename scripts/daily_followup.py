@@ -4,37 +4,50 @@
 """
 import os
 import sys
-import requests
 from datetime import datetime
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def send_daily_followup():
-    """发送每日跟进提醒"""
+from supabase_client import SupabaseClient, build_query
+from task_models import TASK_LIST_COLUMNS
+from outbox import send_notification
+
+def send_daily_followup(user_email=None, client=None):
+    """
+    发送每日跟进提醒
+    
+    参数:
+        user_email: 收件用户邮箱，默认为 EMAIL_163_USERNAME（单用户部署）
+        client: 可选，共享的 SupabaseClient（fanout.py 多用户批量运行时传入）
+    """
     print(f"[{datetime.now()}] 开始发送每日跟进提醒")
     
     # 获取环境变量
     webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    user_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
     email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    user_email = user_email or sender_email
+    
+    # 飞书 Webhook 属于部署者本人，批量运行时只推送部署者自己的消息
+    if user_email != sender_email:
+        webhook_url = ""
     
-    if not all([webhook_url, user_email, email_password, supabase_url, supabase_key]):
+    if not all([sender_email, email_password, supabase_url, supabase_key]):
         print("❌ 环境变量未配置完整")
         return False
     
     try:
         # 查询数据库获取任务清单
-        headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if client is None:
+            client = SupabaseClient(supabase_url, supabase_key)
         
-        query_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.active&select=*"
-        db_response = requests.get(query_url, headers=headers, timeout=30)
+        db_response = client.get(
+            "tasks",
+            params=build_query(TASK_LIST_COLUMNS, user_email=user_email, status="active")
+        )
         
         if db_response.status_code != 200:
             print(f"❌ 数据库查询失败: {db_response.status_code}")
@@ -69,54 +82,19 @@ def send_daily_followup():
         
         content += "\n\n💬 请回复复盘邮件更新你的任务进度！"
         
-        # 发送到飞书
-        message = {
-            "msg_type": "text",
-            "content": {
-                "text": f"📊 每日跟进提醒\n\n{content}"
-            }
-        }
+        # 飞书和邮件并发发送
+        print("发送跟进提醒...")
         
-        feishu_success = False
-        response = requests.post(webhook_url, json=message, timeout=30)
+        email_body = f"{content}\n\n---\n请直接回复此邮件或回复复盘邮件更新任务进度"
         
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("StatusCode") == 0:
-                print("✅ 飞书消息发送成功")
-                feishu_success = True
-            else:
-                print(f"❌ 飞书返回错误: {result}")
-        else:
-            print(f"❌ 飞书HTTP请求失败: {response.status_code}")
-        
-        # 发送邮件
-        try:
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            
-            print("发送跟进邮件...")
-            
-            msg = MIMEMultipart()
-            msg['From'] = user_email
-            msg['To'] = user_email
-            msg['Subject'] = "📊 每日跟进提醒"
-            
-            email_body = f"{content}\n\n---\n请直接回复此邮件或回复复盘邮件更新任务进度"
-            msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
-            
-            server = smtplib.SMTP_SSL("smtp.163.com", 465)
-            server.login(user_email, email_password)
-            server.send_message(msg)
-            server.quit()
-            
-            print("✅ 跟进邮件发送成功")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 跟进邮件发送失败: {e}")
-            return feishu_success
+        # 写入发件箱后发送；同一周期重复运行时不会重复发送
+        results = send_notification(
+            client, user_email, "daily_followup", "📊 每日跟进提醒", email_body,
+            feishu_text=f"📊 每日跟进提醒\n\n{content}" if webhook_url else None,
+            dedupe_key=f"daily_followup:{user_email}:{datetime.now().strftime('%Y-%m-%d')}",
+            sender_email=sender_email, email_password=email_password, webhook_url=webhook_url
+        )
+        return results['success']
             
     except Exception as e:
         print(f"❌ 发送失败: {e}")
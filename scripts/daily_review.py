@@ -4,9 +4,9 @@ v3.0 - 添加游戏化系统（等级、经验值、金币）
 """
 import os
 import sys
-import requests
 from datetime import datetime, date, timedelta
 import json
+import threading
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -20,14 +20,21 @@ from gamification_utils import (
     format_punishment_message,
     get_user_inventory_summary,
     # v4.0 任务编号系统函数
-    get_paused_tasks_to_remind
+    is_sparse_numbering,
+    get_task_display_position,
+    build_task_number_index,
+    filter_paused_tasks_to_remind,
+    mark_paused_tasks_reminded
 )
+from supabase_client import SupabaseClient, in_filter, build_query
+from task_models import TaskSet, DAILY_REVIEW_COLUMNS
+from outbox import send_notification
 
-def get_user_reply_status(supabase_url, headers, user_email):
+def get_user_reply_status(client, user_email):
     """获取用户回复状态"""
     try:
-        query_url = f"{supabase_url}/rest/v1/user_reply_tracking?user_email=eq.{user_email}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+        query_url = f"user_reply_tracking?user_email=eq.{user_email}&select=*"
+        response = client.get(query_url)
         
         if response.status_code == 200:
             data = response.json()
@@ -35,14 +42,14 @@ def get_user_reply_status(supabase_url, headers, user_email):
                 return data[0]
         
         # 如果没有记录，创建一个
-        create_url = f"{supabase_url}/rest/v1/user_reply_tracking"
+        create_url = "user_reply_tracking"
         create_data = {
             "user_email": user_email,
             "last_reply_date": None,
             "consecutive_no_reply_days": 0,
             "total_replies": 0
         }
-        response = requests.post(create_url, headers=headers, json=create_data, timeout=30)
+        response = client.post(create_url, json=create_data)
         
         if response.status_code in [200, 201]:
             return create_data
@@ -52,7 +59,111 @@ def get_user_reply_status(supabase_url, headers, user_email):
         print(f"获取用户回复状态失败: {e}")
         return None
 
-def update_no_reply_days(supabase_url, headers, user_email, reply_status):
+class PausedReminderBatch:
+    """
+    收集一批用户本次提醒过的暂缓任务id，由 flush_daily_review_writes() 批量写回（mark_paused_tasks_reminded 按 id 分块 PATCH）
+    
+    fanout.py 的多个线程会同时调用 add()，因此加锁
+    """
+    
+    def __init__(self):
+        self.task_ids = []
+        self.lock = threading.Lock()
+    
+    def add(self, task_ids):
+        with self.lock:
+            self.task_ids.extend(task_ids)
+    
+    def flush(self, client):
+        with self.lock:
+            task_ids, self.task_ids = self.task_ids, []
+        
+        if not task_ids:
+            return True
+        
+        if mark_paused_tasks_reminded(client, task_ids):
+            print(f"✅ 批量更新了 {len(task_ids)} 个暂缓任务的提醒日期")
+            return True
+        
+        return False
+
+def prefetch_daily_review_data(client, user_emails):
+    """
+    批量预取一批用户的每日复盘数据（fanout.py 调用）
+    
+    任务、游戏化数据、回复追踪、背包每张表一次分页查询（user_email=in.(...)），再按用户分组。
+    
+    返回:
+        {user_email: {'tasks': TaskSet, 'gamification': ..., 'reply_status': ..., 'inventory': [...],
+                      'reminder_batch': PausedReminderBatch}}
+        某张表查询失败时对应字段为 None，send_daily_review 会回退到逐用户查询；
+        reminder_batch 为整批共享，渲染完成后由 flush_daily_review_writes() 统一写回
+    """
+    reminder_batch = PausedReminderBatch()
+    prefetched = {
+        user_email: {
+            'tasks': None,
+            'gamification': None,
+            'reply_status': None,
+            'inventory': None,
+            'reminder_batch': reminder_batch
+        }
+        for user_email in user_emails
+    }
+    
+    if not user_emails:
+        return prefetched
+    
+    email_filter = in_filter(user_emails)
+    
+    # 活跃 + 暂缓任务
+    tasks = client.get_all("tasks", params=build_query(
+        DAILY_REVIEW_COLUMNS,
+        order="user_email.asc,quadrant.asc,task_order.asc,id.asc",
+        user_email=user_emails,
+        status=["active", "paused"],
+        is_deleted=False
+    ))
+    if tasks is not None:
+        task_sets = TaskSet.group_by_user(tasks)
+        for user_email, user_data in prefetched.items():
+            user_data['tasks'] = task_sets.get(user_email) or TaskSet([])
+    
+    # 背包
+    inventory = client.get_all("user_inventory", params={
+        "user_email": email_filter,
+        "select": "*",
+        "order": "user_email.asc,item_code.asc"
+    })
+    if inventory is not None:
+        for user_data in prefetched.values():
+            user_data['inventory'] = []
+        for item in inventory:
+            prefetched[item['user_email']]['inventory'].append(item)
+    
+    # 每个用户一行的表：游戏化数据、回复追踪
+    for table, key in [("user_gamification", 'gamification'), ("user_reply_tracking", 'reply_status')]:
+        rows = client.get_all(table, params={
+            "user_email": email_filter,
+            "select": "*",
+            "order": "user_email.asc"
+        })
+        for row in rows or []:
+            prefetched[row['user_email']][key] = row
+    
+    return prefetched
+
+def flush_daily_review_writes(client, prefetched):
+    """写回一批用户延后的数据库修改（fanout.py 在每批处理完后调用）"""
+    batches = {id(user_data['reminder_batch']): user_data['reminder_batch']
+               for user_data in prefetched.values() if user_data.get('reminder_batch')}
+    
+    success = True
+    for batch in batches.values():
+        success = batch.flush(client) and success
+    return success
+
+def update_no_reply_days(client, user_email, reply_status):
     """更新连续未回复天数"""
     try:
         last_reply_date = reply_status.get('last_reply_date')
@@ -71,13 +182,13 @@ def update_no_reply_days(supabase_url, headers, user_email, reply_status):
             consecutive_days += 1
         
         # 更新数据库
-        update_url = f"{supabase_url}/rest/v1/user_reply_tracking?user_email=eq.{user_email}"
+        update_url = f"user_reply_tracking?user_email=eq.{user_email}"
         update_data = {
             "consecutive_no_reply_days": consecutive_days,
             "updated_at": datetime.now().isoformat()
         }
         
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+        response = client.patch(update_url, json=update_data)
         
         if response.status_code in [200, 204]:
             print(f"✅ 更新连续未回复天数: {consecutive_days}")
@@ -160,55 +271,87 @@ def generate_personalized_greeting(consecutive_no_reply_days, is_weekend):
     
     return "🌙 晚上好！"
 
-def send_daily_review():
-    """发送每日复盘提醒"""
+def send_daily_review(user_email=None, client=None, prefetched=None):
+    """
+    发送每日复盘提醒
+    
+    参数:
+        user_email: 收件用户邮箱，默认为 EMAIL_163_USERNAME（单用户部署）
+        client: 可选，共享的 SupabaseClient（fanout.py 多用户批量运行时传入）
+        prefetched: 可选，prefetch_daily_review_data() 中该用户的数据，已有的部分不再查询
+    """
     print(f"[{datetime.now()}] 开始发送每日复盘提醒")
     
     # 获取环境变量
     webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    user_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    user_email = user_email or sender_email
+    
+    # 飞书 Webhook 属于部署者本人，批量运行时只推送部署者自己的消息
+    if user_email != sender_email:
+        webhook_url = ""
     
-    if not all([webhook_url, user_email, supabase_url, supabase_key]):
+    if not all([sender_email, supabase_url, supabase_key]):
         print("❌ 环境变量未配置完整")
         return False
     
     try:
-        headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if client is None:
+            client = SupabaseClient(supabase_url, supabase_key)
+        
+        prefetched = prefetched or {}
         
         # 获取用户回复状态
-        reply_status = get_user_reply_status(supabase_url, headers, user_email)
+        reply_status = prefetched.get('reply_status') or get_user_reply_status(client, user_email)
         consecutive_no_reply_days = 0
         
         if reply_status:
-            consecutive_no_reply_days = update_no_reply_days(supabase_url, headers, user_email, reply_status)
+            consecutive_no_reply_days = update_no_reply_days(client, user_email, reply_status)
         
-        # 检查并执行未回复惩罚
-        punishment_result = check_and_apply_no_reply_punishment(supabase_url, headers, user_email)
+        # 检查并执行未回复惩罚（批量预取时直接使用刚算出的天数和预取的游戏化数据）
+        if prefetched and reply_status:
+            punishment_result = check_and_apply_no_reply_punishment(
+                client, user_email, consecutive_no_reply_days, prefetched.get('gamification')
+            )
+        else:
+            punishment_result = check_and_apply_no_reply_punishment(client, user_email)
         
         # 判断是否是周末
         is_weekend = datetime.now().weekday() >= 5
         
-        # 获取用户游戏化数据
-        user_game_data = get_user_gamification_data(supabase_url, headers, user_email)
+        # 获取用户游戏化数据（执行了惩罚时重新读取最新值）
+        user_game_data = None if punishment_result else prefetched.get('gamification')
+        if not user_game_data:
+            user_game_data = get_user_gamification_data(client, user_email)
         
-        # 获取活跃任务（v4.0：添加is_deleted过滤和排序）
-        query_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.active&is_deleted=eq.false&order=quadrant.asc,task_order.asc&select=*"
-        db_response = requests.get(query_url, headers=headers, timeout=30)
-        
-        if db_response.status_code != 200:
-            print(f"❌ 数据库查询失败: {db_response.status_code}")
-            return False
-        
-        tasks = db_response.json()
+        if prefetched.get('tasks') is not None:
+            # 批量预取：直接使用预取的任务集合
+            task_set = prefetched['tasks']
+        else:
+            # 一次查询活跃 + 暂缓任务，任务清单和需要提醒的暂缓任务都从中筛选
+            db_response = client.get(
+                "tasks",
+                params=build_query(
+                    DAILY_REVIEW_COLUMNS,
+                    order="quadrant.asc,task_order.asc",
+                    user_email=user_email,
+                    status=["active", "paused"],
+                    is_deleted=False
+                )
+            )
+            
+            if db_response.status_code != 200:
+                print(f"❌ 数据库查询失败: {db_response.status_code}")
+                return False
+            
+            task_set = TaskSet.from_rows(db_response.json())
         
-        # 获取需要提醒的暂缓任务（v4.0）
-        paused_tasks = get_paused_tasks_to_remind(supabase_url, headers, user_email)
+        # sparse 编号模式：展示的编号按位置计算
+        task_index = build_task_number_index(list(task_set)) if is_sparse_numbering() else None
+        tasks = task_set.with_status('active')
+        paused_tasks = filter_paused_tasks_to_remind(task_set.with_status('paused'))
         
         # 生成个性化问候语
         greeting = generate_personalized_greeting(consecutive_no_reply_days, is_weekend)
@@ -220,12 +363,6 @@ def send_daily_review():
         
         # v4.1：按象限分组显示任务（极简风格）
         if tasks:
-            # 按象限分组
-            tasks_by_quadrant = {1: [], 2: [], 3: [], 4: []}
-            for task in tasks:
-                q = task.get('quadrant', 1)
-                tasks_by_quadrant[q].append(task)
-            
             # 象限名称和经验值倍率
             quadrant_info = {
                 1: ("Q1 🔴 重要且紧急", "EXP x2.0"),
@@ -239,9 +376,10 @@ def send_daily_review():
                 q_name, exp_rate = quadrant_info[q]
                 content += f"{q_name} ({exp_rate})\n"
                 
-                if tasks_by_quadrant[q]:
-                    for task in tasks_by_quadrant[q]:
-                        task_order = task.get('task_order', 0)
+                quadrant_tasks = task_set.in_quadrant(q)
+                if quadrant_tasks:
+                    for task in quadrant_tasks:
+                        task_order = get_task_display_position(task, task_index)
                         task_name = task.get('task_name', '未命名任务')
                         progress = task.get('progress_percentage', 0)
                         
@@ -263,20 +401,20 @@ def send_daily_review():
             content += "⏸️ 暂缓待办池\n"
             
             for task in paused_tasks:
-                task_order = task.get('task_order', 0)
+                task_order = get_task_display_position(task, task_index)
                 task_name = task.get('task_name', '未命名任务')
                 content += f"{task_order}. {task_name}\n"
             
             content += "\n"
             
-            # 更新last_reminded_date为今天
-            today = date.today().isoformat()
-            for task in paused_tasks:
-                task_id = task['id']
-                update_url = f"{supabase_url}/rest/v1/tasks?id=eq.{task_id}"
-                requests.patch(update_url, headers=headers, json={"last_reminded_date": today}, timeout=30)
+            # 更新last_reminded_date为今天（一次 PATCH；批量运行时整批合并写回）
+            task_ids = [task['id'] for task in paused_tasks]
+            reminder_batch = prefetched.get('reminder_batch')
             
-            print(f"✅ 更新了 {len(paused_tasks)} 个暂缓任务的提醒日期")
+            if reminder_batch is not None:
+                reminder_batch.add(task_ids)
+            elif mark_paused_tasks_reminded(client, task_ids):
+                print(f"✅ 更新了 {len(paused_tasks)} 个暂缓任务的提醒日期")
         
         # 根据连续未回复天数调整提示语
         if consecutive_no_reply_days >= 3:
@@ -308,63 +446,25 @@ def send_daily_review():
             content += generate_smart_tips(level)
             
             # 显示背包
-            inventory_summary = get_user_inventory_summary(supabase_url, headers, user_email)
+            inventory_summary = get_user_inventory_summary(client, user_email, prefetched.get('inventory'))
             if inventory_summary:
                 content += inventory_summary
         
-        # 发送到飞书
-        message = {
-            "msg_type": "text",
-            "content": {
-                "text": f"📊 每日复盘\n\n{content}"
-            }
-        }
-        
-        feishu_success = False
-        response = requests.post(webhook_url, json=message, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("StatusCode") == 0:
-                print("✅ 飞书消息发送成功")
-                feishu_success = True
-            else:
-                print(f"❌ 飞书返回错误: {result}")
-        else:
-            print(f"❌ 飞书HTTP请求失败: {response.status_code}")
-        
-        # 发送邮件
+        # 飞书和邮件并发发送（没有配置邮箱授权码时只发飞书）
         email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
         
-        if email_password:
-            try:
-                import smtplib
-                from email.mime.text import MIMEText
-                from email.mime.multipart import MIMEMultipart
-                
-                print("发送邮件...")
-                
-                msg = MIMEMultipart()
-                msg['From'] = user_email
-                msg['To'] = user_email
-                msg['Subject'] = "📊 每日复盘提醒"
-                
-                email_body = f"每日复盘\n\n{content}\n\n---\n请直接回复此邮件更新任务进度"
-                msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
-                
-                server = smtplib.SMTP_SSL("smtp.163.com", 465)
-                server.login(user_email, email_password)
-                server.send_message(msg)
-                server.quit()
-                
-                print("✅ 邮件发送成功")
-                return True
-                
-            except Exception as e:
-                print(f"❌ 邮件发送失败: {e}")
-                return feishu_success
+        print("发送每日复盘...")
+        
+        email_body = f"每日复盘\n\n{content}\n\n---\n请直接回复此邮件更新任务进度"
         
-        return feishu_success
+        # 写入发件箱后发送；同一周期重复运行时不会重复发送
+        results = send_notification(
+            client, user_email, "daily_review", "📊 每日复盘提醒", email_body if email_password else None,
+            feishu_text=f"📊 每日复盘\n\n{content}" if webhook_url else None,
+            dedupe_key=f"daily_review:{user_email}:{datetime.now().strftime('%Y-%m-%d')}",
+            sender_email=sender_email, email_password=email_password, webhook_url=webhook_url
+        )
+        return results['success']
             
     except Exception as e:
         print(f"❌ 发送失败: {e}")
@@ -0,0 +1,247 @@
+"""
+多用户批量运行脚本 - GitHub Actions
+从 user_configs / user_gamification 枚举用户，在有界线程池中为每个用户执行定时任务
+
+用法:
+    python scripts/fanout.py daily_review
+    python scripts/fanout.py weekly_report monthly_report --workers 16
+    python scripts/fanout.py daily_followup --source user_configs
+    python scripts/fanout.py daily_review --users a@163.com,b@163.com
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import SupabaseClient
+from outbox import set_deferred_delivery, drain_outbox
+
+# 任务名 → (模块, 函数, 批量预取函数, 批量写回函数)
+#   函数签名为 fn(user_email=None, client=None[, prefetched=None]) -> bool
+#   预取函数签名为 prefetch(client, user_emails) -> {user_email: 该用户的数据}
+#   写回函数签名为 flush(client, prefetched) -> bool，每批用户处理完后调用
+JOBS = {
+    'daily_review': ('daily_review', 'send_daily_review', 'prefetch_daily_review_data', 'flush_daily_review_writes'),
+    'daily_followup': ('daily_followup', 'send_daily_followup', None, None),
+    'weekly_report': ('weekly_report', 'send_weekly_report', None, None),
+    'monthly_report': ('monthly_report', 'send_monthly_report', None, None),
+    'weekly_paused_tasks': ('weekly_paused_tasks', 'send_weekly_paused_tasks_reminder', None, None)
+}
+
+# 用户来源表
+USER_SOURCES = ('user_gamification', 'user_configs')
+
+DEFAULT_WORKERS = int(os.getenv("FANOUT_WORKERS", "8"))
+DEFAULT_USER_SOURCE = os.getenv("FANOUT_USER_SOURCE", "user_gamification").strip()
+# 批量预取时每批用户数（受 URL 长度限制）
+DEFAULT_COHORT_SIZE = int(os.getenv("FANOUT_COHORT_SIZE", "100"))
+
+
+def list_user_emails(client, source=DEFAULT_USER_SOURCE):
+    """
+    分页读取用户邮箱列表（去重，按邮箱排序）
+
+    参数:
+        client: SupabaseClient
+        source: 用户来源表（user_gamification / user_configs）
+
+    返回:
+        用户邮箱列表，查询失败返回 None
+    """
+    if source not in USER_SOURCES:
+        print(f"❌ 不支持的用户来源: {source}")
+        return None
+
+    rows = client.get_all(source, params={"select": "user_email", "order": "user_email.asc"})
+
+    if rows is None:
+        print("❌ 查询用户列表失败")
+        return None
+
+    return sorted({row['user_email'] for row in rows if row.get('user_email')})
+
+
+def load_job(job_name):
+    """按任务名导入任务函数、批量预取函数和批量写回函数（没有时为 None）"""
+    module_name, function_name, prefetch_name, flush_name = JOBS[job_name]
+    module = importlib.import_module(module_name)
+    prefetch = getattr(module, prefetch_name) if prefetch_name else None
+    flush = getattr(module, flush_name) if flush_name else None
+    return getattr(module, function_name), prefetch, flush
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_job_for_users(job_name, user_emails, client, workers=DEFAULT_WORKERS, cohort_size=DEFAULT_COHORT_SIZE,
+                      drain=None):
+    """
+    在有界线程池中为每个用户执行一个任务，单个用户失败不影响其他用户
+
+    任务有批量预取函数时，按 cohort_size 分批：每批先一次性预取数据，再把每个用户的部分交给任务函数，
+    整批处理完后调用批量写回函数。
+
+    传入 drain 时，每批处理完后调用 drain(client) 统一发送这一批写入发件箱的通知。
+
+    参数:
+        job_name: 任务名（JOBS 的键）
+        user_emails: 用户邮箱列表
+        client: 共享的 SupabaseClient
+        workers: 最大并发数
+        cohort_size: 每批预取的用户数
+        drain: 可选，每批处理完后调用的发件箱发送函数
+
+    返回:
+        {
+            'job': ..., 'total': ..., 'succeeded': ..., 'failed': ...,
+            'failed_users': [...], 'elapsed': 秒, 'throughput': 用户/秒,
+            'latency_p50': 秒, 'latency_p95': 秒, 'latency_max': 秒
+        }
+    """
+    job, prefetch, flush = load_job(job_name)
+    latencies = []
+    failed_users = []
+
+    def run_one(user_email, prefetched):
+        started = time.monotonic()
+        try:
+            if prefetch is not None:
+                success = job(user_email=user_email, client=client, prefetched=prefetched)
+            else:
+                success = job(user_email=user_email, client=client)
+        except Exception as e:
+            print(f"❌ [{job_name}] {user_email} 执行异常: {e}")
+            success = False
+        return user_email, success, time.monotonic() - started
+
+    if prefetch is not None:
+        cohorts = [user_emails[i:i + cohort_size] for i in range(0, len(user_emails), max(1, cohort_size))]
+    else:
+        cohorts = [user_emails]
+
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for cohort in cohorts:
+            cohort_data = {}
+            if prefetch is not None:
+                try:
+                    cohort_data = prefetch(client, cohort)
+                except Exception as e:
+                    # 预取失败时逐用户查询
+                    print(f"⚠️ [{job_name}] 批量预取失败，改为逐用户查询: {e}")
+
+            futures = [executor.submit(run_one, user_email, cohort_data.get(user_email)) for user_email in cohort]
+
+            for future in as_completed(futures):
+                user_email, success, latency = future.result()
+                latencies.append(latency)
+                if not success:
+                    failed_users.append(user_email)
+
+            if flush is not None and cohort_data:
+                try:
+                    if not flush(client, cohort_data):
+                        print(f"⚠️ [{job_name}] 批量写回失败")
+                except Exception as e:
+                    print(f"⚠️ [{job_name}] 批量写回异常: {e}")
+
+            if drain is not None:
+                try:
+                    drain(client)
+                except Exception as e:
+                    print(f"⚠️ [{job_name}] 发送通知异常: {e}")
+
+    elapsed = time.monotonic() - started
+    latencies.sort()
+
+    return {
+        'job': job_name,
+        'total': len(user_emails),
+        'succeeded': len(user_emails) - len(failed_users),
+        'failed': len(failed_users),
+        'failed_users': sorted(failed_users),
+        'elapsed': elapsed,
+        'throughput': len(user_emails) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p95': _percentile(latencies, 95),
+        'latency_max': latencies[-1] if latencies else 0.0
+    }
+
+
+def format_job_stats(stats):
+    """格式化任务统计信息"""
+    text = f"📊 [{stats['job']}] 用户 {stats['total']} 个：成功 {stats['succeeded']}，失败 {stats['failed']}\n"
+    text += f"   总耗时 {stats['elapsed']:.1f}s，吞吐 {stats['throughput']:.2f} 用户/秒\n"
+    text += f"   单用户耗时 p50 {stats['latency_p50']:.2f}s / p95 {stats['latency_p95']:.2f}s / max {stats['latency_max']:.2f}s"
+
+    if stats['failed_users']:
+        text += f"\n   失败用户: {', '.join(stats['failed_users'])}"
+
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为所有用户批量执行定时任务")
+    parser.add_argument("jobs", nargs="+", choices=sorted(JOBS), help="要执行的任务")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="最大并发数")
+    parser.add_argument("--source", default=DEFAULT_USER_SOURCE, choices=USER_SOURCES, help="用户来源表")
+    parser.add_argument("--users", default="", help="逗号分隔的用户邮箱（指定时不查询用户表）")
+    parser.add_argument("--cohort-size", type=int, default=DEFAULT_COHORT_SIZE, help="每批预取的用户数")
+    args = parser.parse_args()
+
+    print(f"[{datetime.now()}] 开始批量执行: {', '.join(args.jobs)}")
+
+    supabase_url = os.getenv("SUPABASE_URL", "").strip()
+    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+
+    if not all([supabase_url, supabase_key]):
+        print("❌ 环境变量未配置完整")
+        return False
+
+    # 生成和发送分开：任务只把通知写入发件箱，每批用户处理完后统一并发发送
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
+    webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
+
+    def drain(client):
+        stats = drain_outbox(client, sender_email, email_password, webhook_url)
+        print(f"📮 发送通知：成功 {stats['sent']}，等待重试 {stats['retry']}，放弃 {stats['failed']}")
+
+    set_deferred_delivery(True)
+
+    # 连接池至少覆盖并发数，避免线程等待连接
+    with SupabaseClient(supabase_url, supabase_key, pool_size=max(args.workers, 10)) as client:
+        if args.users:
+            user_emails = sorted({email.strip() for email in args.users.split(",") if email.strip()})
+        else:
+            user_emails = list_user_emails(client, args.source)
+
+        if user_emails is None:
+            return False
+
+        print(f"✅ 共 {len(user_emails)} 个用户，并发 {args.workers}")
+
+        all_success = True
+        for job_name in args.jobs:
+            stats = run_job_for_users(job_name, user_emails, client, args.workers, args.cohort_size, drain)
+            print("\n" + format_job_stats(stats))
+            if stats['failed']:
+                all_success = False
+
+    return all_success
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -2,8 +2,15 @@
 游戏化系统辅助函数
 包含等级、经验值、金币计算等功能
 """
-import requests
+import os
+import re
+import json
+import time
+import threading
 from datetime import datetime, date
+from supabase_client import in_filter
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
 
 # 象限权重配置
 QUADRANT_WEIGHTS = {
@@ -21,6 +28,14 @@ LEVEL_EXP_REQUIRED = {
     16: 1600, 17: 1700, 18: 1800, 19: 1900, 20: 2000
 }
 
+# 任务编号模式
+#   dense：task_order 始终保持连续（1, 2, 3...），完成/暂缓后重排整个象限
+#   sparse：task_order 为带间隔的排序键，连续的显示编号在渲染时计算，完成/暂缓只写一行
+TASK_NUMBERING_MODE = os.getenv("TASK_NUMBERING_MODE", "dense").strip().lower()
+
+# sparse 模式下新任务追加到末尾时使用的排序键间隔
+TASK_ORDER_GAP = 1024
+
 # AI性格配置
 AI_PERSONALITIES = {
     'friendly': {
@@ -83,49 +98,239 @@ def calculate_coins_gain(completion_rate):
     else:
         return 5  # 保底
 
-def get_user_gamification_data(supabase_url, headers, user_email):
-    """获取用户游戏化数据"""
+def _fetch_user_gamification_data(client, user_email):
+    """从数据库读取用户游戏化数据，没有记录时创建一条"""
+    query_url = f"user_gamification?user_email=eq.{user_email}&select=*"
+    response = client.get(query_url)
+    
+    if response.status_code == 200:
+        data = response.json()
+        if data:
+            return data[0]
+    
+    # 如果没有记录，创建一个
+    create_url = "user_gamification"
+    create_data = {
+        "user_email": user_email,
+        "level": 1,
+        "current_exp": 0,
+        "total_exp": 0,
+        "coins": 200,
+        "ai_personality": "friendly",
+        "consecutive_q1_days": 0
+    }
+    
+    response = client.post(create_url, json=create_data)
+    
+    if response.status_code in [200, 201]:
+        return create_data
+    
+    return None
+
+
+class UserGamificationCache:
+    """
+    单次运行内的用户游戏化数据缓存（按 user_email）
+    
+    每个用户的记录只读取一次；EXP、金币、连击、性格等修改先写入内存，
+    运行结束时调用 flush()，每个用户只发送一次 PATCH。
+    
+    使用方式：
+        client.gamification_cache = UserGamificationCache(client)
+        ...
+        client.gamification_cache.flush()
+    """
+    
+    def __init__(self, client):
+        self.client = client
+        self.rows = {}
+        self.dirty = {}
+    
+    def get(self, user_email):
+        """返回用户数据副本，首次访问时从数据库加载"""
+        if user_email not in self.rows:
+            row = _fetch_user_gamification_data(self.client, user_email)
+            if not row:
+                return None
+            self.rows[user_email] = row
+        return dict(self.rows[user_email])
+    
+    def seed(self, user_email, row):
+        """用已查询到的记录填充缓存（不会覆盖未写回的修改）"""
+        if user_email not in self.dirty:
+            self.rows[user_email] = dict(row)
+    
+    def update(self, user_email, update_data):
+        """在内存中应用修改，等待 flush() 写回"""
+        if user_email not in self.rows and self.get(user_email) is None:
+            return False
+        self.rows[user_email].update(update_data)
+        self.dirty.setdefault(user_email, {}).update(update_data)
+        return True
+    
+    def refresh(self, user_email, state):
+        """用数据库返回的最新值覆盖缓存（这些字段已由数据库写入，不再需要写回）"""
+        if user_email not in self.rows:
+            return
+        self.rows[user_email].update(state)
+        pending = self.dirty.get(user_email)
+        if pending:
+            for key in state:
+                pending.pop(key, None)
+            if not pending:
+                del self.dirty[user_email]
+    
+    def flush(self):
+        """把所有未写回的修改写入数据库，每个用户一次 PATCH"""
+        success = True
+        for user_email in list(self.dirty):
+            update_data = self.dirty[user_email]
+            try:
+                response = self.client.patch(
+                    "user_gamification",
+                    params={"user_email": f"eq.{user_email}"},
+                    json=update_data
+                )
+                if response.status_code in [200, 204]:
+                    del self.dirty[user_email]
+                else:
+                    print(f"❌ 写回用户游戏化数据失败: {response.status_code} - {response.text}")
+                    success = False
+            except Exception as e:
+                print(f"❌ 写回用户游戏化数据异常: {e}")
+                success = False
+        return success
+
+
+def get_user_gamification_data(client, user_email):
+    """获取用户游戏化数据（启用了 client.gamification_cache 时从缓存读取）"""
     try:
-        query_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                return data[0]
-        
-        # 如果没有记录，创建一个
-        create_url = f"{supabase_url}/rest/v1/user_gamification"
-        create_data = {
-            "user_email": user_email,
-            "level": 1,
-            "current_exp": 0,
-            "total_exp": 0,
-            "coins": 200,
-            "ai_personality": "friendly",
-            "consecutive_q1_days": 0
-        }
-        
-        response = requests.post(create_url, headers=headers, json=create_data, timeout=30)
-        
-        if response.status_code in [200, 201]:
-            return create_data
+        cache = getattr(client, 'gamification_cache', None)
+        if cache is not None:
+            return cache.get(user_email)
         
-        return None
+        return _fetch_user_gamification_data(client, user_email)
     except Exception as e:
         print(f"获取用户游戏化数据失败: {e}")
         return None
 
-def update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins_gain, reason=""):
+def save_user_gamification_data(client, user_email, update_data):
+    """
+    保存用户游戏化数据修改
+    
+    启用了 client.gamification_cache 时只修改内存，由 flush() 统一写回；
+    否则直接 PATCH。
+    
+    Returns:
+        bool: 是否成功
+    """
+    cache = getattr(client, 'gamification_cache', None)
+    if cache is not None:
+        return cache.update(user_email, update_data)
+    
+    update_url = f"user_gamification?user_email=eq.{user_email}"
+    response = client.patch(update_url, json=update_data)
+    return response.status_code in [200, 204]
+
+# 已确认未部署的数据库函数（gamification_setup.sql），本进程内不再尝试
+_MISSING_GAMIFICATION_RPCS = set()
+
+# call_gamification_rpc() 调用失败时的返回值（与函数未部署时的 None 区分）
+RPC_FAILED = object()
+
+def call_gamification_rpc(client, function_name, payload):
+    """
+    调用 gamification_setup.sql 中的原子更新函数
+    
+    只有函数未部署（404）时调用方才能回退到读-改-写；其他失败（例如网关 502/504、超时）
+    时事务可能已经提交，回退会把同一笔增量再写一次，调用方应按失败处理。
+    
+    Returns:
+        dict: 函数返回的最新状态；函数未部署返回 None；调用失败返回 RPC_FAILED
+    """
+    if function_name in _MISSING_GAMIFICATION_RPCS:
+        return None
+    
+    try:
+        response = client.post(f"rpc/{function_name}", json=payload)
+    except Exception as e:
+        print(f"❌ 调用数据库函数 {function_name} 异常: {e}")
+        return RPC_FAILED
+    
+    if response.status_code == 404:
+        print(f"ℹ️ 数据库函数 {function_name} 未部署，使用读-改-写方式更新")
+        _MISSING_GAMIFICATION_RPCS.add(function_name)
+        return None
+    
+    if response.status_code != 200:
+        print(f"❌ 调用数据库函数 {function_name} 失败: {response.status_code} - {response.text}")
+        return RPC_FAILED
+    
+    return response.json()
+
+def refresh_cached_gamification(client, user_email, state):
+    """数据库函数返回最新状态后同步到 client.gamification_cache"""
+    cache = getattr(client, 'gamification_cache', None)
+    if cache is not None:
+        cache.refresh(user_email, state)
+
+def update_user_exp_and_coins(client, user_email, exp_gain, coins_gain, reason=""):
     """
     更新用户经验值和金币
     
+    Returns:
+        dict: 包含是否升级、新等级等信息
+    """
+    history_rows = [{
+        "user_email": user_email,
+        "exp_gained": exp_gain,
+        "coins_gained": coins_gain,
+        "reason": reason
+    }]
+    return _apply_exp_and_coins(client, user_email, exp_gain, coins_gain, history_rows)
+
+def _apply_exp_and_coins(client, user_email, exp_gain, coins_gain, history_rows):
+    """
+    一次性结算经验值和金币：读取一次、计算升级、写回一次、批量记录经验值历史
+    
+    已部署 apply_exp_and_coins 数据库函数时，增量和升级计算在数据库内原子完成（一次调用）。
+    
     Returns:
         dict: 包含是否升级、新等级等信息
     """
     try:
+        state = call_gamification_rpc(client, "apply_exp_and_coins", {
+            "p_user_email": user_email,
+            "p_exp_delta": exp_gain,
+            "p_coins_delta": coins_gain
+        })
+        
+        if state is RPC_FAILED:
+            return None
+        
+        if state is not None:
+            refresh_cached_gamification(client, user_email, {
+                "level": state['level'],
+                "current_exp": state['current_exp'],
+                "total_exp": state['total_exp'],
+                "coins": state['coins']
+            })
+            log_exp_history_rows(client, history_rows)
+            
+            return {
+                'success': True,
+                'level_up': state['level'] > state['old_level'],
+                'old_level': state['old_level'],
+                'new_level': state['level'],
+                'exp_gain': exp_gain,
+                'coins_gain': coins_gain,
+                'current_exp': state['current_exp'],
+                'total_exp': state['total_exp'],
+                'coins': state['coins']
+            }
+        
         # 获取当前数据
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         if not user_data:
             return None
@@ -155,7 +360,6 @@ def update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins
                 break
         
         # 更新数据库
-        update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
         update_data = {
             "level": new_level,
             "current_exp": new_current_exp,
@@ -164,11 +368,9 @@ def update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins
             "updated_at": datetime.now().isoformat()
         }
         
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
-        
-        if response.status_code in [200, 204]:
+        if save_user_gamification_data(client, user_email, update_data):
             # 记录经验值历史
-            log_exp_history(supabase_url, headers, user_email, exp_gain, coins_gain, reason)
+            log_exp_history_rows(client, history_rows)
             
             return {
                 'success': True,
@@ -187,21 +389,75 @@ def update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins
         print(f"更新用户经验值和金币失败: {e}")
         return None
 
-def log_exp_history(supabase_url, headers, user_email, exp_gained, coins_gained, reason):
+def log_exp_history(client, user_email, exp_gained, coins_gained, reason):
     """记录经验值历史"""
+    log_exp_history_rows(client, [{
+        "user_email": user_email,
+        "exp_gained": exp_gained,
+        "coins_gained": coins_gained,
+        "reason": reason
+    }])
+
+def log_exp_history_rows(client, rows):
+    """批量记录经验值历史（一次 POST 插入多行）"""
+    if not rows:
+        return
+    
     try:
-        create_url = f"{supabase_url}/rest/v1/exp_history"
-        create_data = {
-            "user_email": user_email,
-            "exp_gained": exp_gained,
-            "coins_gained": coins_gained,
-            "reason": reason
-        }
-        
-        requests.post(create_url, headers=headers, json=create_data, timeout=30)
+        create_url = "exp_history"
+        client.post(create_url, json=rows if len(rows) > 1 else rows[0])
     except Exception as e:
         print(f"记录经验值历史失败: {e}")
 
+
+class RewardAccumulator:
+    """
+    累计一次回复中各任务操作的经验值和金币奖励
+    
+    任务操作只调用 add() 记账，全部处理完后 apply() 统一结算：
+    升级只判断一次，经验值历史一次批量写入。
+    """
+    
+    def __init__(self):
+        self.entries = []
+    
+    def add(self, exp_gain, coins_gain, reason=""):
+        """记录一笔奖励"""
+        if exp_gain or coins_gain:
+            self.entries.append((exp_gain, coins_gain, reason))
+    
+    @property
+    def total_exp(self):
+        return sum(entry[0] for entry in self.entries)
+    
+    @property
+    def total_coins(self):
+        return sum(entry[1] for entry in self.entries)
+    
+    def apply(self, client, user_email):
+        """
+        结算累计的奖励
+        
+        Returns:
+            dict: 与 update_user_exp_and_coins() 相同；没有奖励时返回 None
+        """
+        if not self.entries:
+            return None
+        
+        history_rows = [
+            {
+                "user_email": user_email,
+                "exp_gained": exp_gain,
+                "coins_gained": coins_gain,
+                "reason": reason
+            }
+            for exp_gain, coins_gain, reason in self.entries
+        ]
+        result = _apply_exp_and_coins(client, user_email, self.total_exp, self.total_coins, history_rows)
+        if result:
+            self.entries = []
+        return result
+
 def get_available_personalities(level):
     """获取当前等级可用的性格列表"""
     available = []
@@ -288,10 +544,10 @@ def format_level_up_message(old_level, new_level):
     
     return message
 
-def check_and_update_q1_streak(supabase_url, headers, user_email, has_q1_task, q1_completed):
+def check_and_update_q1_streak(client, user_email, has_q1_task, q1_completed):
     """检查并更新Q1连击"""
     try:
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         if not user_data:
             return 0
@@ -321,14 +577,13 @@ def check_and_update_q1_streak(supabase_url, headers, user_email, has_q1_task, q
                 consecutive_days = 1
             
             # 更新数据库
-            update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
             update_data = {
                 "consecutive_q1_days": consecutive_days,
                 "last_q1_complete_date": today.isoformat(),
                 "updated_at": datetime.now().isoformat()
             }
             
-            requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+            save_user_gamification_data(client, user_email, update_data)
             
             return consecutive_days
         
@@ -441,16 +696,59 @@ def calculate_progress_decline_punishment(progress_decline, user_level):
             'exp': int(80 * multiplier)
         }
 
-def apply_punishment(supabase_url, headers, user_email, coins_deduct, exp_deduct, punishment_type, reason=""):
+def apply_punishment(client, user_email, coins_deduct, exp_deduct, punishment_type, reason=""):
     """
     执行惩罚（扣除金币和经验值）
     
+    已部署 apply_punishment_delta 数据库函数时，扣除和降级计算在数据库内原子完成。
+    
     Returns:
         dict: 包含是否降级、新等级等信息
     """
     try:
+        state = call_gamification_rpc(client, "apply_punishment_delta", {
+            "p_user_email": user_email,
+            "p_coins_deduct": coins_deduct,
+            "p_exp_deduct": exp_deduct,
+            "p_clear_q1_streak": punishment_type == 'no_reply'
+        })
+        
+        if state is RPC_FAILED:
+            return None
+        
+        if state is not None:
+            current_level = state['old_level']
+            new_level = state['level']
+            
+            cached_state = {
+                "level": new_level,
+                "current_exp": state['current_exp'],
+                "coins": state['coins']
+            }
+            if punishment_type == 'no_reply':
+                cached_state["consecutive_q1_days"] = 0
+            refresh_cached_gamification(client, user_email, cached_state)
+            
+            log_punishment_history(
+                client, user_email,
+                punishment_type, coins_deduct, exp_deduct,
+                current_level, new_level, reason,
+                current_level <= 3
+            )
+            
+            return {
+                'success': True,
+                'downgraded': new_level < current_level,
+                'old_level': current_level,
+                'new_level': new_level,
+                'coins_deducted': coins_deduct,
+                'exp_deducted': exp_deduct,
+                'new_coins': state['coins'],
+                'new_current_exp': state['current_exp']
+            }
+        
         # 获取当前数据
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         if not user_data:
             return None
@@ -485,7 +783,6 @@ def apply_punishment(supabase_url, headers, user_email, coins_deduct, exp_deduct
             new_current_exp = max(0, new_current_exp)
         
         # 更新数据库
-        update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
         update_data = {
             "level": new_level,
             "current_exp": new_current_exp,
@@ -499,12 +796,10 @@ def apply_punishment(supabase_url, headers, user_email, coins_deduct, exp_deduct
         if punishment_type == 'no_reply':
             update_data["consecutive_q1_days"] = 0
         
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
-        
-        if response.status_code in [200, 204]:
+        if save_user_gamification_data(client, user_email, update_data):
             # 记录惩罚历史
             log_punishment_history(
-                supabase_url, headers, user_email,
+                client, user_email,
                 punishment_type, coins_deduct, exp_deduct,
                 current_level, new_level, reason,
                 current_level <= 3
@@ -526,12 +821,12 @@ def apply_punishment(supabase_url, headers, user_email, coins_deduct, exp_deduct
         print(f"执行惩罚失败: {e}")
         return None
 
-def log_punishment_history(supabase_url, headers, user_email, punishment_type, 
+def log_punishment_history(client, user_email, punishment_type, 
                           coins_deducted, exp_deducted, level_before, level_after, 
                           reason, is_newbie_protected):
     """记录惩罚历史"""
     try:
-        create_url = f"{supabase_url}/rest/v1/punishment_history"
+        create_url = "punishment_history"
         create_data = {
             "user_email": user_email,
             "punishment_type": punishment_type,
@@ -543,33 +838,39 @@ def log_punishment_history(supabase_url, headers, user_email, punishment_type,
             "is_newbie_protected": is_newbie_protected
         }
         
-        requests.post(create_url, headers=headers, json=create_data, timeout=30)
+        client.post(create_url, json=create_data)
     except Exception as e:
         print(f"记录惩罚历史失败: {e}")
 
-def check_and_apply_no_reply_punishment(supabase_url, headers, user_email):
+def check_and_apply_no_reply_punishment(client, user_email, consecutive_no_reply_days=None, user_data=None):
     """
     检查并执行未回复惩罚
     
+    Args:
+        consecutive_no_reply_days: 可选，已知的连续未回复天数（提供时不再查询回复追踪表）
+        user_data: 可选，已查询到的用户游戏化数据
+    
     Returns:
         dict: 惩罚结果，如果无需惩罚则返回None
     """
     try:
-        # 获取用户回复追踪数据
-        query_url = f"{supabase_url}/rest/v1/user_reply_tracking?user_email=eq.{user_email}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            return None
-        
-        data = response.json()
-        if not data:
-            return None
-        
-        consecutive_no_reply_days = data[0].get('consecutive_no_reply_days', 0)
+        if consecutive_no_reply_days is None:
+            # 获取用户回复追踪数据
+            query_url = f"user_reply_tracking?user_email=eq.{user_email}&select=*"
+            response = client.get(query_url)
+            
+            if response.status_code != 200:
+                return None
+            
+            data = response.json()
+            if not data:
+                return None
+            
+            consecutive_no_reply_days = data[0].get('consecutive_no_reply_days', 0)
         
         # 获取用户等级
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        if user_data is None:
+            user_data = get_user_gamification_data(client, user_email)
         if not user_data:
             return None
         
@@ -583,7 +884,7 @@ def check_and_apply_no_reply_punishment(supabase_url, headers, user_email):
         
         # 执行惩罚
         result = apply_punishment(
-            supabase_url, headers, user_email,
+            client, user_email,
             punishment['coins'], punishment['exp'],
             'no_reply',
             f"连续{consecutive_no_reply_days}天未回复"
@@ -631,7 +932,7 @@ def format_punishment_message(punishment_result):
     
     return message
 
-def update_consecutive_reply_days(supabase_url, headers, user_email):
+def update_consecutive_reply_days(client, user_email):
     """
     更新连续回复天数
     
@@ -639,7 +940,7 @@ def update_consecutive_reply_days(supabase_url, headers, user_email):
         int: 当前连续回复天数
     """
     try:
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         if not user_data:
             return 0
@@ -668,7 +969,6 @@ def update_consecutive_reply_days(supabase_url, headers, user_email):
             consecutive_days = 1
         
         # 更新数据库
-        update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
         update_data = {
             "consecutive_reply_days": consecutive_days,
             "last_reply_date": today.isoformat(),
@@ -676,14 +976,14 @@ def update_consecutive_reply_days(supabase_url, headers, user_email):
             "updated_at": datetime.now().isoformat()
         }
         
-        requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+        save_user_gamification_data(client, user_email, update_data)
         
         return consecutive_days
     except Exception as e:
         print(f"更新连续回复天数失败: {e}")
         return 0
 
-def check_persistence_milestone(supabase_url, headers, user_email, consecutive_days):
+def check_persistence_milestone(client, user_email, consecutive_days):
     """
     检查是否达到坚持里程碑
     
@@ -705,8 +1005,8 @@ def check_persistence_milestone(supabase_url, headers, user_email, consecutive_d
     
     try:
         # 检查是否已经领取过这个里程碑奖励
-        query_url = f"{supabase_url}/rest/v1/persistence_rewards?user_email=eq.{user_email}&milestone_days=eq.{consecutive_days}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+        query_url = f"persistence_rewards?user_email=eq.{user_email}&milestone_days=eq.{consecutive_days}&select=*"
+        response = client.get(query_url)
         
         if response.status_code == 200:
             data = response.json()
@@ -718,14 +1018,14 @@ def check_persistence_milestone(supabase_url, headers, user_email, consecutive_d
         
         # 发放奖励
         reward_result = update_user_exp_and_coins(
-            supabase_url, headers, user_email,
+            client, user_email,
             milestone['exp'], milestone['coins'],
             f"坚持{consecutive_days}天奖励"
         )
         
         if reward_result:
             # 记录奖励历史
-            create_url = f"{supabase_url}/rest/v1/persistence_rewards"
+            create_url = "persistence_rewards"
             create_data = {
                 "user_email": user_email,
                 "milestone_days": consecutive_days,
@@ -734,7 +1034,7 @@ def check_persistence_milestone(supabase_url, headers, user_email, consecutive_d
                 "achievement_name": milestone['name']
             }
             
-            requests.post(create_url, headers=headers, json=create_data, timeout=30)
+            client.post(create_url, json=create_data)
             
             return {
                 'milestone_days': consecutive_days,
@@ -814,7 +1114,7 @@ def parse_personality_switch_command(user_message):
     
     return None
 
-def switch_ai_personality(supabase_url, headers, user_email, new_personality):
+def switch_ai_personality(client, user_email, new_personality):
     """
     切换AI性格
     
@@ -826,7 +1126,7 @@ def switch_ai_personality(supabase_url, headers, user_email, new_personality):
     """
     try:
         # 获取用户数据
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         if not user_data:
             return {'success': False, 'reason': '用户数据不存在'}
@@ -858,15 +1158,12 @@ def switch_ai_personality(supabase_url, headers, user_email, new_personality):
             }
         
         # 更新性格
-        update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
         update_data = {
             "ai_personality": new_personality,
             "updated_at": datetime.now().isoformat()
         }
         
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
-        
-        if response.status_code in [200, 204]:
+        if save_user_gamification_data(client, user_email, update_data):
             return {
                 'success': True,
                 'old_personality': current_personality,
@@ -1011,29 +1308,9 @@ def generate_personality_feedback(tasks_data, progress_changes, personality_code
 
 只返回反馈内容，不要其他说明。"""
         
-        headers = {
-            "Authorization": f"Bearer {deepseek_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.8
-        }
-        
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        feedback = get_llm_client(deepseek_api_key).complete(prompt, temperature=0.8)
         
-        if response.status_code == 200:
-            result = response.json()
-            feedback = result['choices'][0]['message']['content'].strip()
+        if feedback:
             return feedback
         else:
             # 降级到默认反馈
@@ -1073,39 +1350,93 @@ def parse_purchase_command(user_message):
     
     return None
 
-def get_shop_item_by_name(supabase_url, headers, item_name):
+# 商店道具目录缓存有效期（秒），道具表很少变化
+SHOP_CATALOG_TTL = int(os.getenv("SHOP_CATALOG_TTL", "600"))
+
+def normalize_item_name(name):
+    """去掉 emoji 和标点，用于道具名称模糊匹配"""
+    return re.sub(r'[^\w\s]', '', name or '')
+
+
+class ShopCatalog:
     """
-    根据道具名称获取道具信息
+    进程内共享的商店道具目录
     
-    Returns:
-        dict: 道具信息，如果不存在则返回None
+    一次请求加载整个 shop_items 表，建立按 item_code、item_name 和规范化名称的索引；
+    超过 TTL 后下次访问时重新加载，也可以调用 invalidate() 立即失效。
     """
-    try:
-        # 先尝试精确匹配道具名称
-        query_url = f"{supabase_url}/rest/v1/shop_items?item_name=eq.{item_name}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+    
+    def __init__(self, ttl=SHOP_CATALOG_TTL):
+        self.ttl = ttl
+        self.items = []
+        self.by_code = {}
+        self.by_name = {}
+        self.normalized_names = []
+        self.loaded_at = None
+        self.lock = threading.Lock()
+    
+    def is_fresh(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+    
+    def invalidate(self):
+        """清空缓存，下次访问时重新加载"""
+        with self.lock:
+            self.loaded_at = None
+    
+    def ensure_loaded(self, client):
+        """缓存过期或未加载时从数据库加载，返回是否可用"""
+        if self.is_fresh():
+            return True
         
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                return data[0]
+        with self.lock:
+            if self.is_fresh():
+                return True
+            
+            response = client.get("shop_items?select=*")
+            if response.status_code != 200:
+                print(f"❌ 加载商店道具失败: {response.status_code}")
+                return self.loaded_at is not None
+            
+            items = response.json()
+            self.items = items
+            self.by_code = {item.get('item_code'): item for item in items}
+            self.by_name = {item.get('item_name'): item for item in items}
+            self.normalized_names = [(normalize_item_name(item.get('item_name')), item) for item in items]
+            self.loaded_at = time.monotonic()
+            return True
+    
+    def get_by_code(self, client, item_code):
+        if not self.ensure_loaded(client):
+            return None
+        return self.by_code.get(item_code)
+    
+    def get_by_name(self, client, item_name):
+        """先精确匹配道具名称，再按规范化名称（去掉emoji）模糊匹配"""
+        if not self.ensure_loaded(client):
+            return None
         
-        # 如果精确匹配失败，尝试模糊匹配（去掉emoji）
-        query_url = f"{supabase_url}/rest/v1/shop_items?select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+        if item_name in self.by_name:
+            return self.by_name[item_name]
         
-        if response.status_code == 200:
-            all_items = response.json()
-            
-            # 去掉emoji后匹配
-            for item in all_items:
-                clean_name = re.sub(r'[^\w\s]', '', item['item_name'])
-                clean_input = re.sub(r'[^\w\s]', '', item_name)
-                
-                if clean_input in clean_name or clean_name in clean_input:
-                    return item
+        clean_input = normalize_item_name(item_name)
+        for clean_name, item in self.normalized_names:
+            if clean_input in clean_name or clean_name in clean_input:
+                return item
         
         return None
+
+
+SHOP_CATALOG = ShopCatalog()
+
+def get_shop_item_by_name(client, item_name):
+    """
+    根据道具名称获取道具信息（使用进程内的道具目录缓存）
+    
+    Returns:
+        dict: 道具信息，如果不存在则返回None
+    """
+    try:
+        return SHOP_CATALOG.get_by_name(client, item_name)
     except Exception as e:
         print(f"获取道具信息失败: {e}")
         return None
@@ -1143,7 +1474,7 @@ def check_purchase_eligibility(user_data, item_data):
     
     return {'eligible': True}
 
-def check_usage_limit(supabase_url, headers, user_email, item_code, item_data):
+def check_usage_limit(client, user_email, item_code, item_data):
     """
     检查道具使用限制
     
@@ -1158,8 +1489,8 @@ def check_usage_limit(supabase_url, headers, user_email, item_code, item_data):
             return {'within_limit': True}
         
         # 查询用户库存
-        query_url = f"{supabase_url}/rest/v1/user_inventory?user_email=eq.{user_email}&item_code=eq.{item_code}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+        query_url = f"user_inventory?user_email=eq.{user_email}&item_code=eq.{item_code}&select=*"
+        response = client.get(query_url)
         
         if response.status_code != 200:
             return {'within_limit': True}  # 查询失败，允许购买
@@ -1193,7 +1524,7 @@ def check_usage_limit(supabase_url, headers, user_email, item_code, item_data):
         print(f"检查使用限制失败: {e}")
         return {'within_limit': True}  # 出错时允许购买
 
-def purchase_item(supabase_url, headers, user_email, item_code, item_data):
+def purchase_item(client, user_email, item_code, item_data):
     """
     购买道具
     
@@ -1204,28 +1535,46 @@ def purchase_item(supabase_url, headers, user_email, item_code, item_data):
         price = item_data.get('price', 0)
         item_name = item_data.get('item_name', '')
         
-        # 扣除金币
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
-        if not user_data:
-            return {'success': False, 'reason': '用户数据不存在'}
-        
-        current_coins = user_data.get('coins', 0)
-        new_coins = current_coins - price
-        
-        # 更新金币
-        update_url = f"{supabase_url}/rest/v1/user_gamification?user_email=eq.{user_email}"
-        update_data = {
-            "coins": new_coins,
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        response = requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+        # 扣除金币（已部署 spend_coins 数据库函数时原子扣除，余额不足不扣）
+        state = call_gamification_rpc(client, "spend_coins", {
+            "p_user_email": user_email,
+            "p_amount": price
+        })
         
-        if response.status_code not in [200, 204]:
+        if state is RPC_FAILED:
             return {'success': False, 'reason': '扣除金币失败'}
         
+        if state is not None:
+            if not state.get('success'):
+                return {'success': False, 'reason': '金币不足'}
+            new_coins = state['coins']
+            refresh_cached_gamification(client, user_email, {"coins": new_coins})
+        else:
+            user_data = get_user_gamification_data(client, user_email)
+            if not user_data:
+                return {'success': False, 'reason': '用户数据不存在'}
+            
+            current_coins = user_data.get('coins', 0)
+            new_coins = current_coins - price
+            
+            # 更新金币：道具会立即写入背包，扣款也必须立即写入数据库，
+            # 不能只改 client.gamification_cache（flush() 失败时会出现道具已到账、金币未扣除）
+            update_data = {
+                "coins": new_coins,
+                "updated_at": datetime.now().isoformat()
+            }
+
+            response = client.patch(
+                "user_gamification",
+                params={"user_email": f"eq.{user_email}"},
+                json=update_data
+            )
+            if response.status_code not in [200, 204]:
+                return {'success': False, 'reason': '扣除金币失败'}
+            refresh_cached_gamification(client, user_email, update_data)
+        
         # 添加到库存
-        add_to_inventory(supabase_url, headers, user_email, item_code)
+        add_to_inventory(client, user_email, item_code)
         
         return {
             'success': True,
@@ -1237,12 +1586,12 @@ def purchase_item(supabase_url, headers, user_email, item_code, item_data):
         print(f"购买道具失败: {e}")
         return {'success': False, 'reason': str(e)}
 
-def add_to_inventory(supabase_url, headers, user_email, item_code):
+def add_to_inventory(client, user_email, item_code):
     """添加道具到库存"""
     try:
         # 查询是否已存在
-        query_url = f"{supabase_url}/rest/v1/user_inventory?user_email=eq.{user_email}&item_code=eq.{item_code}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
+        query_url = f"user_inventory?user_email=eq.{user_email}&item_code=eq.{item_code}&select=*"
+        response = client.get(query_url)
         
         if response.status_code == 200:
             data = response.json()
@@ -1252,23 +1601,23 @@ def add_to_inventory(supabase_url, headers, user_email, item_code):
                 inventory_id = data[0]['id']
                 current_quantity = data[0].get('quantity', 0)
                 
-                update_url = f"{supabase_url}/rest/v1/user_inventory?id=eq.{inventory_id}"
+                update_url = f"user_inventory?id=eq.{inventory_id}"
                 update_data = {
                     "quantity": current_quantity + 1,
                     "updated_at": datetime.now().isoformat()
                 }
                 
-                requests.patch(update_url, headers=headers, json=update_data, timeout=30)
+                client.patch(update_url, json=update_data)
             else:
                 # 不存在，创建新记录
-                create_url = f"{supabase_url}/rest/v1/user_inventory"
+                create_url = "user_inventory"
                 create_data = {
                     "user_email": user_email,
                     "item_code": item_code,
                     "quantity": 1
                 }
                 
-                requests.post(create_url, headers=headers, json=create_data, timeout=30)
+                client.post(create_url, json=create_data)
         
         print(f"✅ 道具已添加到库存: {item_code}")
     except Exception as e:
@@ -1346,21 +1695,25 @@ def format_purchase_error_message(error_type, error_data):
     else:
         return f"\n⚠️ 购买失败：{error_type}"
 
-def get_user_inventory_summary(supabase_url, headers, user_email):
+def get_user_inventory_summary(client, user_email, inventory=None):
     """
     获取用户背包摘要
     
+    Args:
+        inventory: 可选，已查询到的 user_inventory 行（批量预取时传入，不再查询）
+    
     Returns:
         str: 背包摘要文本
     """
     try:
-        query_url = f"{supabase_url}/rest/v1/user_inventory?user_email=eq.{user_email}&select=*"
-        response = requests.get(query_url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            return ""
-        
-        inventory = response.json()
+        if inventory is None:
+            query_url = f"user_inventory?user_email=eq.{user_email}&select=*"
+            response = client.get(query_url)
+            
+            if response.status_code != 200:
+                return ""
+            
+            inventory = response.json()
         
         if not inventory:
             return "\n💼 背包：空"
@@ -1373,15 +1726,12 @@ def get_user_inventory_summary(supabase_url, headers, user_email):
             quantity = item.get('quantity', 0)
             
             if quantity > 0:
-                # 获取道具名称
-                item_query_url = f"{supabase_url}/rest/v1/shop_items?item_code=eq.{item_code}&select=item_name"
-                item_response = requests.get(item_query_url, headers=headers, timeout=30)
+                # 获取道具名称（来自道具目录缓存，无额外请求）
+                item_data = SHOP_CATALOG.get_by_code(client, item_code)
                 
-                if item_response.status_code == 200:
-                    item_data = item_response.json()
-                    if item_data:
-                        item_name = item_data[0].get('item_name', item_code)
-                        summary += f"   {item_name} x{quantity}\n"
+                if item_data:
+                    item_name = item_data.get('item_name', item_code)
+                    summary += f"   {item_name} x{quantity}\n"
         
         return summary
     except Exception as e:
@@ -1548,25 +1898,29 @@ def format_current_unlocks(user_level):
 # v4.0 任务编号系统函数
 # ============================================
 
-def find_task(supabase_url, headers, user_email, quadrant, task_number):
+def find_task(client, user_email, quadrant, task_number, task_index=None):
     """
     根据用户邮箱、象限和任务编号查找任务
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         quadrant: 象限 (1-4)
         task_number: 任务编号 (1, 2, 3...)
+        task_index: 可选，load_task_number_index() 的结果；提供时直接从内存映射解析
     
     返回:
         任务对象（字典）或 None
     """
+    if task_index is None and is_sparse_numbering():
+        task_index = load_task_number_index(client, user_email)
+    if task_index is not None:
+        return task_index['active'].get((quadrant, task_number))
+    
     try:
         # 查询条件：user_email + quadrant + task_order + is_deleted=FALSE
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
                 "quadrant": f"eq.{quadrant}",
@@ -1591,25 +1945,27 @@ def find_task(supabase_url, headers, user_email, quadrant, task_number):
         return None
 
 
-def get_max_task_order(supabase_url, headers, user_email, quadrant):
+def get_max_task_order(client, user_email, quadrant, task_index=None):
     """
     获取指定象限的最大任务编号
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         quadrant: 象限 (1-4)
+        task_index: 可选，load_task_number_index() 的结果
     
     返回:
         最大编号（整数），如果无任务返回 0
     """
+    if task_index is not None:
+        return task_index['max_order'].get(quadrant, 0)
+    
     try:
         # 查询条件：user_email + quadrant + status='active' + is_deleted=FALSE
         # 按 task_order 降序排序，取第一个
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
                 "quadrant": f"eq.{quadrant}",
@@ -1636,24 +1992,28 @@ def get_max_task_order(supabase_url, headers, user_email, quadrant):
         return 0
 
 
-def find_paused_task(supabase_url, headers, user_email, task_number):
+def find_paused_task(client, user_email, task_number, task_index=None):
     """
     根据用户邮箱和任务编号查找暂缓任务
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         task_number: 暂缓任务编号 (1, 2, 3...)
+        task_index: 可选，load_task_number_index() 的结果；提供时直接从内存映射解析
     
     返回:
         任务对象（字典）或 None
     """
+    if task_index is None and is_sparse_numbering():
+        task_index = load_task_number_index(client, user_email)
+    if task_index is not None:
+        return task_index['paused'].get(task_number)
+    
     try:
         # 查询条件：user_email + task_order + status='paused' + is_deleted=FALSE
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
                 "task_order": f"eq.{task_number}",
@@ -1678,13 +2038,12 @@ def find_paused_task(supabase_url, headers, user_email, task_number):
         return None
 
 
-def get_paused_tasks_to_remind(supabase_url, headers, user_email):
+def get_paused_tasks_to_remind(client, user_email):
     """
     获取需要提醒的暂缓任务（last_reminded_date 为 NULL 或距今超过2天）
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
     
     返回:
@@ -1698,9 +2057,8 @@ def get_paused_tasks_to_remind(supabase_url, headers, user_email):
         
         # 查询条件：status='paused' + is_deleted=FALSE + 
         # (last_reminded_date IS NULL OR last_reminded_date <= two_days_ago)
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
                 "status": "eq.paused",
@@ -1722,66 +2080,270 @@ def get_paused_tasks_to_remind(supabase_url, headers, user_email):
         return []
 
 
+# 每次 PATCH 的 id 数量上限：36 字符的 UUID 拼进 id=in.(...) 后，150 个约 5.6KB，
+# 低于网关常见的 8KB URL 限制
+MARK_REMINDED_CHUNK_SIZE = 150
 
-def reorder_tasks(supabase_url, headers, user_email, quadrant):
+def mark_paused_tasks_reminded(client, task_ids, reminded_date=None):
     """
-    重新排序指定象限的所有活跃任务，确保编号连续（1, 2, 3...）
+    把一批暂缓任务的 last_reminded_date 更新为今天（id=in.(...)，每 MARK_REMINDED_CHUNK_SIZE 个一次 PATCH）
+    
+    参数:
+        client: SupabaseClient
+        task_ids: 任务id列表（可以属于不同用户）
+        reminded_date: 可选，提醒日期（默认今天）
+    
+    返回:
+        全部成功返回 True，任一批失败返回 False（其他批照常写入，重复写同一日期无副作用）
+    """
+    if not task_ids:
+        return True
+    
+    payload = {"last_reminded_date": reminded_date or date.today().isoformat()}
+    success = True
+    
+    for start in range(0, len(task_ids), MARK_REMINDED_CHUNK_SIZE):
+        chunk = task_ids[start:start + MARK_REMINDED_CHUNK_SIZE]
+        try:
+            response = client.patch("tasks", params={"id": in_filter(chunk)}, json=payload)
+            
+            if response.status_code not in [200, 204]:
+                print(f"❌ 更新暂缓任务提醒日期失败: {response.status_code} - {response.text}")
+                success = False
+                
+        except Exception as e:
+            print(f"❌ 更新暂缓任务提醒日期异常: {str(e)}")
+            success = False
+    
+    return success
+
+
+def filter_paused_tasks_to_remind(paused_tasks):
+    """
+    从已查询到的暂缓任务中筛选需要提醒的任务（条件同 get_paused_tasks_to_remind()）
+    
+    返回:
+        任务列表（按 task_order 升序）
+    """
+    from datetime import datetime, timedelta
+    
+    two_days_ago = (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')
+    
+    to_remind = [
+        task for task in paused_tasks
+        if not task.get('is_deleted')
+        and (not task.get('last_reminded_date') or str(task['last_reminded_date'])[:10] <= two_days_ago)
+    ]
+    return sorted(to_remind, key=lambda task: task.get('task_order') or 0)
+
+
+
+def is_sparse_numbering():
+    """是否启用 sparse 编号模式"""
+    return TASK_NUMBERING_MODE == "sparse"
+
+
+def load_task_number_index(client, user_email):
+    """
+    一次查询加载用户所有未删除的活跃/暂缓任务，建立显示编号 → 任务的内存映射
+    
+    显示编号按 task_order 排序后的位置计算（1, 2, 3...），与每日复盘邮件中展示的编号一致；
+    dense 模式下位置与 task_order 相同，sparse 模式下 task_order 只是排序键。
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
-        quadrant: 象限 (1-4)
     
     返回:
-        成功返回 True，失败返回 False
+        {
+            'active': {(quadrant, 显示编号): 任务},
+            'paused': {显示编号: 任务},
+            'position_by_id': {任务id: 显示编号},
+            'by_id': {任务id: 任务},
+            'max_order': {1: ..., 2: ..., 3: ..., 4: ..., 'paused': ...},  # 存储的最大 task_order
+            'count': {1: ..., 2: ..., 3: ..., 4: ..., 'paused': ...}       # 当前任务数
+        }
+        失败返回 None
     """
     try:
-        # 1. 获取该象限所有活跃任务（按 task_order 排序）
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
-                "quadrant": f"eq.{quadrant}",
-                "status": "eq.active",
+                "status": "in.(active,paused)",
                 "is_deleted": "eq.false",
-                "select": "id,task_order",
-                "order": "task_order.asc"
+                "select": "*",
+                "order": "quadrant.asc,task_order.asc"
             }
         )
         
         if response.status_code != 200:
-            print(f"❌ 获取任务列表失败: {response.status_code} - {response.text}")
-            return False
-        
-        tasks = response.json()
+            print(f"❌ 加载任务编号索引失败: {response.status_code} - {response.text}")
+            return None
         
-        if not tasks:
-            # 没有任务，无需重排序
-            return True
+        return build_task_number_index(response.json())
         
-        # 2. 重新分配编号（从1开始）
-        for index, task in enumerate(tasks, start=1):
-            new_order = index
-            new_display_number = f"Q{quadrant}-{new_order}"
-            
-            # 更新任务
-            update_response = requests.patch(
-                f"{supabase_url}/rest/v1/tasks",
-                headers=headers,
-                params={"id": f"eq.{task['id']}"},
-                json={
-                    "task_order": new_order,
-                    "display_number": new_display_number
-                }
-            )
-            
-            if update_response.status_code not in [200, 204]:
-                print(f"❌ 更新任务编号失败: {update_response.status_code} - {update_response.text}")
-                return False
+    except Exception as e:
+        print(f"❌ 加载任务编号索引异常: {str(e)}")
+        return None
+
+
+def build_task_number_index(tasks):
+    """
+    用已查询到的活跃/暂缓任务建立编号索引（格式同 load_task_number_index()）
+    
+    参数:
+        tasks: 同一用户未删除的活跃/暂缓任务列表（顺序不限）
+    """
+    index = {
+        'active': {},
+        'paused': {},
+        'position_by_id': {},
+        'by_id': {task['id']: task for task in tasks},
+        'max_order': {1: 0, 2: 0, 3: 0, 4: 0, 'paused': 0},
+        'count': {1: 0, 2: 0, 3: 0, 4: 0, 'paused': 0}
+    }
+    
+    active_tasks = sorted(
+        [task for task in tasks if task.get('status') == 'active'],
+        key=lambda task: (task.get('quadrant', 1), task.get('task_order') or 0)
+    )
+    paused_tasks = sorted(
+        [task for task in tasks if task.get('status') == 'paused'],
+        key=lambda task: task.get('task_order') or 0
+    )
+    
+    for task in active_tasks:
+        quadrant = task.get('quadrant', 1)
+        index['count'][quadrant] += 1
+        position = index['count'][quadrant]
+        index['active'][(quadrant, position)] = task
+        index['position_by_id'][task['id']] = position
+        index['max_order'][quadrant] = max(index['max_order'][quadrant], task.get('task_order') or 0)
+    
+    for position, task in enumerate(paused_tasks, start=1):
+        index['paused'][position] = task
+        index['position_by_id'][task['id']] = position
+        index['max_order']['paused'] = max(index['max_order']['paused'], task.get('task_order') or 0)
+    index['count']['paused'] = len(paused_tasks)
+    
+    return index
+
+
+def get_index_active_tasks(task_index):
+    """按象限和显示编号顺序返回索引中的活跃任务列表"""
+    return [task_index['active'][key] for key in sorted(task_index['active'])]
+
+
+def get_task_display_position(task, task_index=None):
+    """返回任务在清单中展示的编号：有索引时取位置，否则取 task_order"""
+    if task_index is not None and task.get('id') in task_index['position_by_id']:
+        return task_index['position_by_id'][task['id']]
+    return task.get('task_order', 0)
+
+
+def bulk_update_task_numbers(client, rows):
+    """
+    批量写回任务编号：一次 PostgREST upsert（on_conflict=id）更新多行
+    
+    参数:
+        client: SupabaseClient
+        rows: 需要更新的行列表，每行包含 id、user_email、task_name、task_order、display_number
+              （user_email / task_name 是 NOT NULL 列，upsert 的插入分支要求携带，
+               因为 id 已存在，实际只会走更新分支）；
+              也可以带上其他列（例如 execute_task_plan() 写回整行），但所有行的键必须一致
+    
+    返回:
+        成功返回 True，失败返回 False
+    """
+    if not rows:
+        return True
+    
+    response = client.post(
+        "tasks",
+        params={"on_conflict": "id"},
+        headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+        json=rows
+    )
+    
+    if response.status_code not in [200, 201, 204]:
+        print(f"❌ 批量更新任务编号失败: {response.status_code} - {response.text}")
+        return False
+    
+    return True
+
+
+def _renumber_rows(tasks, display_prefix):
+    """
+    计算连续编号（1, 2, 3...），只返回编号实际发生变化的行
+    
+    参数:
+        tasks: 按 task_order 升序排列的任务列表
+        display_prefix: 显示编号前缀，如 "Q1-"、"暂缓-"
+    """
+    changed = []
+    
+    for index, task in enumerate(tasks, start=1):
+        new_display_number = f"{display_prefix}{index}"
         
-        print(f"✓ Q{quadrant} 重排序完成，共 {len(tasks)} 个任务")
+        if task.get('task_order') == index and task.get('display_number') == new_display_number:
+            continue
+        
+        changed.append({
+            "id": task['id'],
+            "user_email": task['user_email'],
+            "task_name": task['task_name'],
+            "task_order": index,
+            "display_number": new_display_number
+        })
+    
+    return changed
+
+
+def reorder_tasks(client, user_email, quadrant):
+    """
+    重新排序指定象限的所有活跃任务，确保编号连续（1, 2, 3...）
+    只有编号变化的行会被写回，且合并为一次批量 upsert
+    
+    参数:
+        client: SupabaseClient
+        user_email: 用户邮箱
+        quadrant: 象限 (1-4)
+    
+    返回:
+        成功返回 True，失败返回 False
+    """
+    try:
+        # 1. 获取该象限所有活跃任务（按 task_order 排序）
+        response = client.get(
+            "tasks",
+            params={
+                "user_email": f"eq.{user_email}",
+                "quadrant": f"eq.{quadrant}",
+                "status": "eq.active",
+                "is_deleted": "eq.false",
+                "select": "id,user_email,task_name,task_order,display_number",
+                "order": "task_order.asc"
+            }
+        )
+        
+        if response.status_code != 200:
+            print(f"❌ 获取任务列表失败: {response.status_code} - {response.text}")
+            return False
+        
+        tasks = response.json()
+        
+        if not tasks:
+            # 没有任务，无需重排序
+            return True
+        
+        # 2. 重新分配编号（从1开始），一次写回所有变化的行
+        changed = _renumber_rows(tasks, f"Q{quadrant}-")
+        
+        if not bulk_update_task_numbers(client, changed):
+            return False
+        
+        print(f"✓ Q{quadrant} 重排序完成，共 {len(tasks)} 个任务，更新 {len(changed)} 个编号")
         return True
         
     except Exception as e:
@@ -1789,13 +2351,13 @@ def reorder_tasks(supabase_url, headers, user_email, quadrant):
         return False
 
 
-def reorder_paused_tasks(supabase_url, headers, user_email):
+def reorder_paused_tasks(client, user_email):
     """
     重新排序所有暂缓任务，确保编号连续（1, 2, 3...）
+    只有编号变化的行会被写回，且合并为一次批量 upsert
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
     
     返回:
@@ -1803,14 +2365,13 @@ def reorder_paused_tasks(supabase_url, headers, user_email):
     """
     try:
         # 1. 获取所有暂缓任务（按 task_order 排序）
-        response = requests.get(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        response = client.get(
+            "tasks",
             params={
                 "user_email": f"eq.{user_email}",
                 "status": "eq.paused",
                 "is_deleted": "eq.false",
-                "select": "id,task_order",
+                "select": "id,user_email,task_name,task_order,display_number",
                 "order": "task_order.asc"
             }
         )
@@ -1825,27 +2386,13 @@ def reorder_paused_tasks(supabase_url, headers, user_email):
             # 没有暂缓任务，无需重排序
             return True
         
-        # 2. 重新分配编号（从1开始）
-        for index, task in enumerate(tasks, start=1):
-            new_order = index
-            new_display_number = f"暂缓-{new_order}"
-            
-            # 更新任务
-            update_response = requests.patch(
-                f"{supabase_url}/rest/v1/tasks",
-                headers=headers,
-                params={"id": f"eq.{task['id']}"},
-                json={
-                    "task_order": new_order,
-                    "display_number": new_display_number
-                }
-            )
-            
-            if update_response.status_code not in [200, 204]:
-                print(f"❌ 更新暂缓任务编号失败: {update_response.status_code} - {update_response.text}")
-                return False
+        # 2. 重新分配编号（从1开始），一次写回所有变化的行
+        changed = _renumber_rows(tasks, "暂缓-")
         
-        print(f"✓ 暂缓任务重排序完成，共 {len(tasks)} 个任务")
+        if not bulk_update_task_numbers(client, changed):
+            return False
+        
+        print(f"✓ 暂缓任务重排序完成，共 {len(tasks)} 个任务，更新 {len(changed)} 个编号")
         return True
         
     except Exception as e:
@@ -1854,16 +2401,16 @@ def reorder_paused_tasks(supabase_url, headers, user_email):
 
 
 
-def complete_task(supabase_url, headers, user_email, quadrant, task_number):
+def complete_task(client, user_email, quadrant, task_number, rewards=None):
     """
     完成任务：软删除 + 重排序 + 奖励计算
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         quadrant: 象限 (1-4)
         task_number: 任务编号
+        rewards: 可选，RewardAccumulator；提供时只记账，由调用方统一结算
     
     返回:
         成功返回 {'success': True, 'task_name': ..., 'exp_gain': ..., 'coins_gain': ...}
@@ -1873,7 +2420,7 @@ def complete_task(supabase_url, headers, user_email, quadrant, task_number):
         from datetime import datetime
         
         # 1. 查找任务
-        task = find_task(supabase_url, headers, user_email, quadrant, task_number)
+        task = find_task(client, user_email, quadrant, task_number)
         if not task:
             return {'success': False, 'error': f'任务不存在：Q{quadrant}任务{task_number}'}
         
@@ -1886,29 +2433,33 @@ def complete_task(supabase_url, headers, user_email, quadrant, task_number):
         coins_gain = calculate_coins_gain(100)  # 完成任务给金币
         
         # 3. 软删除任务
-        update_response = requests.patch(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        update_data = {
+            "is_deleted": True,
+            "deleted_at": datetime.now().isoformat(),
+            "status": "completed",
+            "progress_percentage": 100
+        }
+        update_response = client.patch(
+            "tasks",
             params={"id": f"eq.{task['id']}"},
-            json={
-                "is_deleted": True,
-                "deleted_at": datetime.now().isoformat(),
-                "status": "completed",
-                "progress_percentage": 100
-            }
+            json=update_data
         )
         
         if update_response.status_code not in [200, 204]:
             return {'success': False, 'error': f'软删除失败: {update_response.text}'}
         
-        # 4. 重新排序该象限
-        reorder_success = reorder_tasks(supabase_url, headers, user_email, quadrant)
-        if not reorder_success:
-            print(f"⚠️ 重排序失败，但任务已完成")
+        # 4. 重新排序该象限（sparse 模式下显示编号在渲染时计算，无需重排）
+        if not is_sparse_numbering():
+            reorder_success = reorder_tasks(client, user_email, quadrant)
+            if not reorder_success:
+                print(f"⚠️ 重排序失败，但任务已完成")
         
         # 5. 发放奖励
-        update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins_gain, 
-                                   reason=f"完成任务：{task_name}")
+        if rewards is not None:
+            rewards.add(exp_gain, coins_gain, f"完成任务：{task_name}")
+        else:
+            update_user_exp_and_coins(client, user_email, exp_gain, coins_gain, 
+                                       reason=f"完成任务：{task_name}")
         
         return {
             'success': True,
@@ -1923,17 +2474,17 @@ def complete_task(supabase_url, headers, user_email, quadrant, task_number):
         return {'success': False, 'error': f'完成任务异常: {str(e)}'}
 
 
-def update_task_progress(supabase_url, headers, user_email, quadrant, task_number, new_progress):
+def update_task_progress(client, user_email, quadrant, task_number, new_progress, rewards=None):
     """
     更新任务进度：计算增量EXP + 自动完成（如果100%）
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         quadrant: 象限 (1-4)
         task_number: 任务编号
         new_progress: 新进度（0-100）
+        rewards: 可选，RewardAccumulator；提供时只记账，由调用方统一结算
     
     返回:
         成功返回 {'success': True, 'task_name': ..., 'old_progress': ..., 'new_progress': ..., 'exp_gain': ...}
@@ -1943,7 +2494,7 @@ def update_task_progress(supabase_url, headers, user_email, quadrant, task_numbe
         from datetime import datetime
         
         # 1. 查找任务
-        task = find_task(supabase_url, headers, user_email, quadrant, task_number)
+        task = find_task(client, user_email, quadrant, task_number)
         if not task:
             return {'success': False, 'error': f'任务不存在：Q{quadrant}任务{task_number}'}
         
@@ -1952,7 +2503,7 @@ def update_task_progress(supabase_url, headers, user_email, quadrant, task_numbe
         
         # 2. 如果新进度 = 100%，自动调用 complete_task()
         if new_progress >= 100:
-            return complete_task(supabase_url, headers, user_email, quadrant, task_number)
+            return complete_task(client, user_email, quadrant, task_number, rewards)
         
         # 3. 计算进度变化量
         progress_change = new_progress - old_progress
@@ -1965,9 +2516,8 @@ def update_task_progress(supabase_url, headers, user_email, quadrant, task_numbe
             coins_gain = calculate_coins_gain(new_progress)
         
         # 5. 更新任务进度
-        update_response = requests.patch(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        update_response = client.patch(
+            "tasks",
             params={"id": f"eq.{task['id']}"},
             json={
                 "progress_percentage": new_progress,
@@ -1981,8 +2531,11 @@ def update_task_progress(supabase_url, headers, user_email, quadrant, task_numbe
         
         # 6. 发放奖励（如果有）
         if exp_gain > 0:
-            update_user_exp_and_coins(supabase_url, headers, user_email, exp_gain, coins_gain,
-                                       reason=f"更新任务进度：{task_name} ({old_progress}% → {new_progress}%)")
+            reason = f"更新任务进度：{task_name} ({old_progress}% → {new_progress}%)"
+            if rewards is not None:
+                rewards.add(exp_gain, coins_gain, reason)
+            else:
+                update_user_exp_and_coins(client, user_email, exp_gain, coins_gain, reason=reason)
         
         return {
             'success': True,
@@ -1999,13 +2552,12 @@ def update_task_progress(supabase_url, headers, user_email, quadrant, task_numbe
         return {'success': False, 'error': f'更新进度异常: {str(e)}'}
 
 
-def create_task(supabase_url, headers, user_email, task_name, quadrant):
+def create_task(client, user_email, task_name, quadrant):
     """
     新增任务：分配编号 + 创建任务
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         task_name: 任务名称
         quadrant: 象限 (1-4)
@@ -2017,17 +2569,25 @@ def create_task(supabase_url, headers, user_email, task_name, quadrant):
     try:
         from datetime import datetime
         
+        task_index = load_task_number_index(client, user_email) if is_sparse_numbering() else None
+        if is_sparse_numbering() and task_index is None:
+            return {'success': False, 'error': '加载任务清单失败，无法解析任务编号'}
+        
         # 1. 获取该象限最大编号
-        max_order = get_max_task_order(supabase_url, headers, user_email, quadrant)
-        new_order = max_order + 1
+        max_order = get_max_task_order(client, user_email, quadrant, task_index)
         
-        # 2. 生成显示编号
-        display_number = f"Q{quadrant}-{new_order}"
+        # 2. 生成排序键和显示编号
+        if is_sparse_numbering():
+            new_order = max_order + TASK_ORDER_GAP
+            display_position = task_index['count'][quadrant] + 1
+        else:
+            new_order = max_order + 1
+            display_position = new_order
+        display_number = f"Q{quadrant}-{display_position}"
         
         # 3. 创建任务
-        create_response = requests.post(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        create_response = client.post(
+            "tasks",
             json={
                 "user_email": user_email,
                 "task_name": task_name,
@@ -2050,20 +2610,19 @@ def create_task(supabase_url, headers, user_email, task_name, quadrant):
             'task_name': task_name,
             'display_number': display_number,
             'quadrant': quadrant,
-            'task_number': new_order
+            'task_number': display_position
         }
         
     except Exception as e:
         return {'success': False, 'error': f'创建任务异常: {str(e)}'}
 
 
-def pause_task(supabase_url, headers, user_email, quadrant, task_number):
+def pause_task(client, user_email, quadrant, task_number):
     """
-    暂缓任务：修改状态 + 双重重排序
+    暂缓任务：修改状态 + 双重重排序（sparse 模式下只写一行）
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         quadrant: 象限 (1-4)
         task_number: 任务编号
@@ -2075,32 +2634,40 @@ def pause_task(supabase_url, headers, user_email, quadrant, task_number):
     try:
         from datetime import datetime
         
+        task_index = load_task_number_index(client, user_email) if is_sparse_numbering() else None
+        if is_sparse_numbering() and task_index is None:
+            return {'success': False, 'error': '加载任务清单失败，无法解析任务编号'}
+        
         # 1. 查找任务
-        task = find_task(supabase_url, headers, user_email, quadrant, task_number)
+        task = find_task(client, user_email, quadrant, task_number, task_index)
         if not task:
             return {'success': False, 'error': f'任务不存在：Q{quadrant}任务{task_number}'}
         
         task_name = task['task_name']
         
-        # 2. 修改状态为 paused
-        update_response = requests.patch(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        # 2. 修改状态为 paused（sparse 模式下追加到暂缓池末尾）
+        update_data = {
+            "status": "paused",
+            "last_reminded_date": datetime.now().date().isoformat()
+        }
+        if is_sparse_numbering():
+            update_data["task_order"] = task_index['max_order']['paused'] + TASK_ORDER_GAP
+        
+        update_response = client.patch(
+            "tasks",
             params={"id": f"eq.{task['id']}"},
-            json={
-                "status": "paused",
-                "last_reminded_date": datetime.now().date().isoformat()
-            }
+            json=update_data
         )
         
         if update_response.status_code not in [200, 204]:
             return {'success': False, 'error': f'暂缓任务失败: {update_response.text}'}
         
-        # 3. 重新排序原象限
-        reorder_tasks(supabase_url, headers, user_email, quadrant)
-        
-        # 4. 重新排序暂缓池
-        reorder_paused_tasks(supabase_url, headers, user_email)
+        if not is_sparse_numbering():
+            # 3. 重新排序原象限
+            reorder_tasks(client, user_email, quadrant)
+            
+            # 4. 重新排序暂缓池
+            reorder_paused_tasks(client, user_email)
         
         return {
             'success': True,
@@ -2113,13 +2680,12 @@ def pause_task(supabase_url, headers, user_email, quadrant, task_number):
         return {'success': False, 'error': f'暂缓任务异常: {str(e)}'}
 
 
-def resume_paused_task(supabase_url, headers, user_email, paused_task_number, target_quadrant):
+def resume_paused_task(client, user_email, paused_task_number, target_quadrant):
     """
     恢复暂缓任务：修改状态 + 重新编号
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
+        client: SupabaseClient
         user_email: 用户邮箱
         paused_task_number: 暂缓任务编号
         target_quadrant: 目标象限 (1-4)
@@ -2129,45 +2695,55 @@ def resume_paused_task(supabase_url, headers, user_email, paused_task_number, ta
         失败返回 {'success': False, 'error': ...}
     """
     try:
+        task_index = load_task_number_index(client, user_email) if is_sparse_numbering() else None
+        if is_sparse_numbering() and task_index is None:
+            return {'success': False, 'error': '加载任务清单失败，无法解析任务编号'}
+        
         # 1. 查找暂缓任务
-        task = find_paused_task(supabase_url, headers, user_email, paused_task_number)
+        task = find_paused_task(client, user_email, paused_task_number, task_index)
         if not task:
             return {'success': False, 'error': f'暂缓任务不存在：暂缓任务{paused_task_number}'}
         
         task_name = task['task_name']
         
         # 2. 获取目标象限最大编号
-        max_order = get_max_task_order(supabase_url, headers, user_email, target_quadrant)
-        new_order = max_order + 1
+        max_order = get_max_task_order(client, user_email, target_quadrant, task_index)
         
-        # 3. 生成新的显示编号
-        new_display_number = f"Q{target_quadrant}-{new_order}"
+        # 3. 生成新的排序键和显示编号
+        if is_sparse_numbering():
+            new_order = max_order + TASK_ORDER_GAP
+            new_position = task_index['count'][target_quadrant] + 1
+        else:
+            new_order = max_order + 1
+            new_position = new_order
+        new_display_number = f"Q{target_quadrant}-{new_position}"
         
         # 4. 恢复任务
-        update_response = requests.patch(
-            f"{supabase_url}/rest/v1/tasks",
-            headers=headers,
+        update_data = {
+            "status": "active",
+            "quadrant": target_quadrant,
+            "task_order": new_order,
+            "display_number": new_display_number
+        }
+        update_response = client.patch(
+            "tasks",
             params={"id": f"eq.{task['id']}"},
-            json={
-                "status": "active",
-                "quadrant": target_quadrant,
-                "task_order": new_order,
-                "display_number": new_display_number
-            }
+            json=update_data
         )
         
         if update_response.status_code not in [200, 204]:
             return {'success': False, 'error': f'恢复任务失败: {update_response.text}'}
         
-        # 5. 重新排序暂缓池
-        reorder_paused_tasks(supabase_url, headers, user_email)
+        # 5. 重新排序暂缓池（sparse 模式下无需重排）
+        if not is_sparse_numbering():
+            reorder_paused_tasks(client, user_email)
         
         return {
             'success': True,
             'task_name': task_name,
             'new_display_number': new_display_number,
             'target_quadrant': target_quadrant,
-            'new_task_number': new_order
+            'new_task_number': new_position
         }
         
     except Exception as e:
@@ -2175,28 +2751,515 @@ def resume_paused_task(supabase_url, headers, user_email, paused_task_number, ta
 
 
 
-def parse_task_operations_v4(user_reply, deepseek_api_key):
+# ============================================
+# 任务操作执行计划
+# ============================================
+
+# 计划写回的列（批量 upsert 要求每行的键一致，所以每行都带上全部列）
+TASK_PLAN_COLUMNS = (
+    "id", "user_email", "task_name", "quadrant", "status", "task_order", "display_number",
+    "progress_percentage", "is_deleted", "deleted_at", "updated_at", "last_progress_update",
+    "last_reminded_date"
+)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_task_plan(user_email, operations, task_index, sparse=None):
     """
-    v4.0：使用AI解析用户回复，提取任务操作（支持任务编号）
+    把解析出的任务操作编译成一次执行的计划
+    
+    所有编号都按同一份快照（task_index）解析，与用户看到的清单一致，前面的完成 / 暂缓不会让后面的编号错位；
+    同一任务的多次操作合并：多次更新进度只保留最后一次，完成 / 暂缓之后的操作忽略，更新到 100% 视为完成。
+    需要重新编号的象限在内存中计算好，和任务修改合并成一批写回。
     
     参数:
-        user_reply: 用户回复内容
-        deepseek_api_key: DeepSeek API密钥
+        user_email: 用户邮箱
+        operations: 操作列表（parse_task_operations_v4 的结果）
+        task_index: load_task_number_index() 的结果
+        sparse: 是否 sparse 编号模式，默认按 TASK_NUMBERING_MODE
     
     返回:
-        成功返回操作列表，失败返回None
+        {
+            'entries': [{'operation': ..., 'result': ..., 'task_id': ...}],  # 按原顺序，result 格式同各单项操作函数；
+                                                                            # 新增任务的 entry 另带 'row'（inserts 中的行）
+            'updates': [...],   # 需要 upsert 的已有任务行
+            'inserts': [...],   # 新增任务行（按象限、新增顺序）
+            'rewards': [(entry, exp_gain, coins_gain, reason)],
+            'sparse': bool
+        }
     """
-    try:
-        import requests
-        import json
-        import re
+    if sparse is None:
+        sparse = is_sparse_numbering()
+    
+    now = datetime.now()
+    today = now.date().isoformat()
+    
+    entries = []
+    states = {}        # 任务id → 修改后的任务（快照的副本）
+    terminal = set()   # 已完成或暂缓的任务id
+    resumed = set()
+    progress_entries = {}  # 任务id → 更新进度的 entry
+    moved_in = {1: [], 2: [], 3: [], 4: []}   # 每个象限新恢复的任务id（按操作顺序）
+    newly_paused = []
+    created = {1: [], 2: [], 3: [], 4: []}    # 每个象限新增的任务行
+    
+    def state_of(task):
+        if task['id'] not in states:
+            states[task['id']] = dict(task)
+        return states[task['id']]
+    
+    def fail(op_type, error):
+        entries.append({'operation': op_type, 'result': {'success': False, 'error': error}, 'task_id': None})
+    
+    for op in operations:
+        op_type = (op.get('operation_type') or '').lower()
+        quadrant = _to_int(op.get('quadrant'))
+        task_number = _to_int(op.get('task_number'))
+        
+        if op_type == 'update' and (_to_int(op.get('progress')) or 0) >= 100:
+            op_type = 'complete'
+        
+        if op_type in ('complete', 'update', 'pause'):
+            task = task_index['active'].get((quadrant, task_number))
+            if not task:
+                fail(op_type, f'任务不存在：Q{quadrant}任务{task_number}')
+                continue
+            if task['id'] in terminal:
+                print(f"⏭️ Q{quadrant}任务{task_number} 已完成或暂缓，忽略后续操作")
+                continue
+            
+            state = state_of(task)
+            
+            if op_type == 'update':
+                progress = max(0, _to_int(op.get('progress')) or 0)
+                state['progress_percentage'] = progress
+                state['updated_at'] = now.isoformat()
+                state['last_progress_update'] = today
+                
+                entry = progress_entries.get(task['id'])
+                if entry is None:
+                    entry = {'operation': 'update', 'task_id': task['id'], 'result': {
+                        'success': True,
+                        'task_name': task['task_name'],
+                        'old_progress': task.get('progress_percentage', 0),
+                        'display_number': f"Q{quadrant}-{task_number}",
+                        'quadrant': quadrant,
+                        'task_number': task_number
+                    }}
+                    progress_entries[task['id']] = entry
+                    entries.append(entry)
+                # 同一任务多次更新只保留最后一次
+                entry['result']['new_progress'] = progress
+            
+            elif op_type == 'complete':
+                # 完成已包含之前的进度更新，奖励按快照中的进度计算
+                entry = progress_entries.pop(task['id'], None)
+                if entry is not None:
+                    entries.remove(entry)
+                
+                terminal.add(task['id'])
+                state.update({
+                    'is_deleted': True,
+                    'deleted_at': now.isoformat(),
+                    'status': 'completed',
+                    'progress_percentage': 100
+                })
+                entries.append({'operation': 'complete', 'task_id': task['id'], 'result': {
+                    'success': True,
+                    'task_name': task['task_name'],
+                    'display_number': f"Q{quadrant}-{task_number}",
+                    'quadrant': quadrant,
+                    'task_number': task_number
+                }})
+            
+            else:
+                terminal.add(task['id'])
+                newly_paused.append(task['id'])
+                state.update({'status': 'paused', 'last_reminded_date': today})
+                entries.append({'operation': 'pause', 'task_id': task['id'], 'result': {
+                    'success': True,
+                    'task_name': task['task_name'],
+                    'old_display_number': f"Q{quadrant}-{task_number}",
+                    'quadrant': quadrant,
+                    'task_number': task_number
+                }})
         
-        prompt = f"""请解析用户的任务更新回复，提取任务操作信息。
+        elif op_type == 'resume':
+            task = task_index['paused'].get(task_number)
+            if not task:
+                fail(op_type, f'暂缓任务不存在：暂缓任务{task_number}')
+                continue
+            if quadrant not in moved_in:
+                fail(op_type, f'目标象限无效：{op.get("quadrant")}')
+                continue
+            if task['id'] in resumed:
+                print(f"⏭️ 暂缓任务{task_number} 已恢复，忽略重复操作")
+                continue
+            
+            resumed.add(task['id'])
+            moved_in[quadrant].append(task['id'])
+            state_of(task).update({'status': 'active', 'quadrant': quadrant})
+            entries.append({'operation': 'resume', 'task_id': task['id'], 'result': {
+                'success': True,
+                'task_name': task['task_name'],
+                'target_quadrant': quadrant
+            }})
+        
+        elif op_type == 'create':
+            task_name = (op.get('task_name') or '').strip()
+            if not task_name:
+                fail(op_type, '新增任务缺少任务名称')
+                continue
+            if quadrant not in created:
+                fail(op_type, f'象限无效：{op.get("quadrant")}')
+                continue
+            if any(row['task_name'] == task_name for row in created[quadrant]):
+                print(f"⏭️ 新增任务「{task_name}」重复，忽略")
+                continue
+            # 任务名称在用户内唯一（UNIQUE(user_email, task_name)），其他象限已新增同名任务时这一条失败
+            if any(row['task_name'] == task_name for rows in created.values() for row in rows):
+                fail(op_type, f'任务名称已存在：{task_name}')
+                continue
+            
+            row = {
+                "user_email": user_email,
+                "task_name": task_name,
+                "quadrant": quadrant,
+                "progress_percentage": 0,
+                "status": "active",
+                "is_deleted": False,
+                "created_at": now.isoformat(),
+                "updated_at": now.isoformat()
+            }
+            created[quadrant].append(row)
+            entries.append({'operation': 'create', 'task_id': None, 'row': row, 'result': {
+                'success': True,
+                'task_name': task_name,
+                'quadrant': quadrant
+            }})
+    
+    snapshot = task_index['by_id']
+    
+    # 计算编号：每个受影响的象限 = 剩下的任务 + 恢复的任务 + 新增的任务
+    active_by_quadrant = {1: [], 2: [], 3: [], 4: []}
+    for key in sorted(task_index['active']):
+        task = task_index['active'][key]
+        if task['id'] not in terminal:
+            active_by_quadrant[key[0]].append(task)
+    
+    touched = {snapshot[task_id]['quadrant'] for task_id in terminal}
+    touched |= {quadrant for quadrant in moved_in if moved_in[quadrant] or created[quadrant]}
+    
+    for quadrant in sorted(touched):
+        remaining = active_by_quadrant[quadrant]
+        moved = [states[task_id] for task_id in moved_in[quadrant]]
+        next_order = task_index['max_order'].get(quadrant, 0)
+        
+        for position, task in enumerate(remaining + moved + created[quadrant], start=1):
+            row = task if task.get('id') is None else state_of(task)
+            is_new = task.get('id') is None or task['id'] in resumed
+            
+            if sparse:
+                # sparse 模式只给新加入象限的任务分配排序键，已有任务的编号在展示时计算
+                if not is_new:
+                    continue
+                next_order += TASK_ORDER_GAP
+                row['task_order'] = next_order
+            else:
+                row['task_order'] = position
+            row['display_number'] = f"Q{quadrant}-{position}"
+    
+    # 暂缓池：剩下的暂缓任务 + 新暂缓的任务
+    if newly_paused or resumed:
+        remaining_paused = [task_index['paused'][n] for n in sorted(task_index['paused'])
+                            if task_index['paused'][n]['id'] not in resumed]
+        next_order = task_index['max_order'].get('paused', 0)
+        
+        for position, task in enumerate(remaining_paused + [states[task_id] for task_id in newly_paused], start=1):
+            if sparse:
+                if task['id'] not in newly_paused:
+                    continue
+                next_order += TASK_ORDER_GAP
+                state_of(task)['task_order'] = next_order
+            else:
+                state = state_of(task)
+                state['task_order'] = position
+                state['display_number'] = f"暂缓-{position}"
+    
+    # 只写回实际变化的行
+    updates = []
+    for task_id, state in states.items():
+        original = snapshot[task_id]
+        if any(state.get(column) != original.get(column) for column in TASK_PLAN_COLUMNS):
+            updates.append({column: state.get(column) for column in TASK_PLAN_COLUMNS})
+    
+    inserts = [row for quadrant in sorted(created) for row in created[quadrant]]
+    
+    # 补全结果中的编号，计算奖励
+    rewards = []
+    for entry in entries:
+        result = entry['result']
+        if not result['success']:
+            continue
+        
+        if entry['operation'] == 'create':
+            result['display_number'] = entry['row']['display_number']
+            result['task_number'] = int(entry['row']['display_number'].split('-')[1])
+            
+        elif entry['operation'] == 'resume':
+            state = states[entry['task_id']]
+            result['new_display_number'] = state['display_number']
+            result['new_task_number'] = int(state['display_number'].split('-')[1])
+            
+        elif entry['operation'] == 'complete':
+            task = snapshot[entry['task_id']]
+            result['exp_gain'] = calculate_exp_gain(100 - task.get('progress_percentage', 0), task['quadrant'])
+            result['coins_gain'] = calculate_coins_gain(100)
+            rewards.append((entry, result['exp_gain'], result['coins_gain'], f"完成任务：{task['task_name']}"))
+            
+        elif entry['operation'] == 'update':
+            task = snapshot[entry['task_id']]
+            progress_change = result['new_progress'] - result['old_progress']
+            result['exp_gain'] = 0
+            result['coins_gain'] = 0
+            if progress_change > 0:
+                result['exp_gain'] = calculate_exp_gain(progress_change, task['quadrant'])
+                result['coins_gain'] = calculate_coins_gain(result['new_progress'])
+                reason = f"更新任务进度：{task['task_name']} ({result['old_progress']}% → {result['new_progress']}%)"
+                rewards.append((entry, result['exp_gain'], result['coins_gain'], reason))
+    
+    return {'entries': entries, 'updates': updates, 'inserts': inserts, 'rewards': rewards, 'sparse': sparse}
 
-用户回复：
-{user_reply}
 
-解析规则：
+def bulk_insert_tasks(client, rows):
+    """
+    一次请求插入多个任务
+    
+    返回:
+        成功返回 True，失败返回 False
+    """
+    if not rows:
+        return True
+    
+    response = client.post("tasks", json=rows, headers={"Prefer": "return=minimal"})
+    
+    if response.status_code not in [200, 201, 204]:
+        print(f"❌ 批量新增任务失败: {response.status_code} - {response.text}")
+        return False
+    
+    return True
+
+
+def _insert_tasks_one_by_one(client, rows, sparse):
+    """
+    批量插入失败后逐条插入：一条违反约束（例如与已完成的同名任务冲突 UNIQUE(user_email, task_name)）
+    只让这一条失败。同一象限后面的新任务编号前移，不留空号（与 apply_task_operations 数据库函数一致）。
+    
+    参数:
+        rows: compile_task_plan() 的 inserts（按象限、新增顺序），编号会就地修改
+        sparse: 是否 sparse 编号模式
+    
+    返回:
+        {id(行): 错误信息}，只包含插入失败的行
+    """
+    errors = {}
+    skipped = {}   # 象限 → 前面失败的行数
+    
+    for row in rows:
+        quadrant = row['quadrant']
+        if skipped.get(quadrant):
+            position = int(row['display_number'].split('-')[1]) - skipped[quadrant]
+            row['display_number'] = f"Q{quadrant}-{position}"
+            # sparse 模式下新任务的排序键按 TASK_ORDER_GAP 递增，同样前移
+            row['task_order'] -= skipped[quadrant] * TASK_ORDER_GAP if sparse else skipped[quadrant]
+        
+        try:
+            response = client.post("tasks", json=row, headers={"Prefer": "return=minimal"})
+            status_code = response.status_code
+        except Exception as e:
+            print(f"❌ 新增任务异常: {e}")
+            status_code = None
+        
+        if status_code not in [200, 201, 204]:
+            if status_code == 409:
+                errors[id(row)] = f"任务名称已存在：{row['task_name']}"
+            else:
+                errors[id(row)] = f"写入任务失败：{row['task_name']}"
+            skipped[quadrant] = skipped.get(quadrant, 0) + 1
+    
+    return errors
+
+
+def execute_task_plan(client, plan, rewards=None):
+    """
+    执行 compile_task_plan() 的计划：一次 upsert 写回所有修改和重新编号，一次请求插入所有新任务
+    
+    批量插入失败时逐条重试（_insert_tasks_one_by_one），只有出错的那条新增任务失败。
+    
+    参数:
+        client: SupabaseClient
+        plan: compile_task_plan() 的结果
+        rewards: 可选，RewardAccumulator；写入成功的操作在这里记账
+    
+    返回:
+        [{'operation': ..., 'result': ...}]，格式同 process_task_operations_v4 的 results
+    """
+    updated = bulk_update_task_numbers(client, plan['updates'])
+    insert_errors = {}
+    if not updated:
+        # 修改失败时新增任务的编号也不可靠，一起放弃
+        insert_errors = {id(row): f"写入任务失败：{row['task_name']}" for row in plan['inserts']}
+    elif not bulk_insert_tasks(client, plan['inserts']):
+        print("⚠️ 批量新增任务失败，逐条重试")
+        insert_errors = _insert_tasks_one_by_one(client, plan['inserts'], plan['sparse'])
+    
+    for entry in plan['entries']:
+        if not entry['result']['success']:
+            continue
+        
+        if entry['operation'] == 'create':
+            row = entry['row']
+            if id(row) in insert_errors:
+                entry['result'] = {'success': False, 'error': insert_errors[id(row)]}
+            else:
+                # 逐条重试时编号可能前移
+                entry['result']['display_number'] = row['display_number']
+                entry['result']['task_number'] = int(row['display_number'].split('-')[1])
+        elif not updated:
+            entry['result'] = {'success': False, 'error': f"写入任务失败：{entry['result']['task_name']}"}
+    
+    if rewards is not None:
+        for entry, exp_gain, coins_gain, reason in plan['rewards']:
+            if entry['result']['success']:
+                rewards.add(exp_gain, coins_gain, reason)
+    
+    return [{'operation': entry['operation'], 'result': entry['result']} for entry in plan['entries']]
+
+
+# ============================================
+# 回复格式本地解析（用户手册「回复格式指南」中的写法）
+# ============================================
+
+# AI 解析提示词版本，修改提示词或返回格式时递增，使旧的缓存结果失效
+PARSE_PROMPT_VERSION = "v4.1"
+
+# 单个任务操作：编号 + 完成 / 进度50% / 空格 50% / 暂缓
+# 没有「进度」时编号和百分比之间必须有空白，否则「150%」会被回溯拆成任务15、进度0%
+_REPLY_ACTION = r'(\d+)(?:\s*(完成|done|finish(?:ed)?)|(?:\s*进度\s*|\s+)(\d{1,3})\s*[%％]|\s*(暂缓|pause))'
+# Q1: 1完成; 2进度50%（编号前可带「任务」）
+_REPLY_QUADRANT_LINE = re.compile(r'^Q([1-4])\s*[:：]\s*(.+)$', re.IGNORECASE)
+_REPLY_ITEM = re.compile(r'\s*(?:任务)?\s*' + _REPLY_ACTION + r'\s*(?:[;；,，、]|$)', re.IGNORECASE)
+# Q1-1完成 / Q1任务2进度50%
+_REPLY_SINGLE_LINE = re.compile(r'^Q([1-4])\s*(?:-|任务)\s*' + _REPLY_ACTION + r'$', re.IGNORECASE)
+# 新增：写论文 Q1
+_REPLY_CREATE_LINE = re.compile(r'^(?:新增|添加)(?:任务)?\s*[:：]?\s*(.+?)\s*[（(]?\s*Q([1-4])\s*[）)]?$', re.IGNORECASE)
+# 暂缓任务1恢复到Q1
+_REPLY_RESUME_LINE = re.compile(r'^暂缓(?:任务)?\s*(\d+)\s*恢复(?:到)?\s*Q([1-4])$', re.IGNORECASE)
+# 由其他解析函数处理的命令（性格切换、购买）
+_REPLY_COMMAND_LINE = re.compile(r'^(?:切换性格|切换|性格|购买|买|兑换)\s*[:：]')
+# 引用的原邮件从这些行开始
+_REPLY_QUOTE_START = re.compile(
+    r'^(?:-{2,}\s*(?:原始邮件|Original Message)|在.{0,80}写道[：:]|On .{0,120}wrote:|发件人[：:]|From:)',
+    re.IGNORECASE
+)
+# 邮件客户端自动添加的签名
+_REPLY_SIGNATURE_LINE = re.compile(r'^(?:发自|Sent from|获取\s*Outlook)', re.IGNORECASE)
+
+
+def _parse_reply_action(quadrant, groups):
+    """把 _REPLY_ACTION 的匹配分组（编号, 完成, 进度, 暂缓）转换成操作字典"""
+    task_number, complete_word, progress, pause_word = groups
+    task_number = int(task_number)
+
+    if complete_word or (progress is not None and int(progress) >= 100):
+        return {'operation_type': 'complete', 'quadrant': quadrant, 'task_number': task_number}
+    if pause_word:
+        return {'operation_type': 'pause', 'quadrant': quadrant, 'task_number': task_number}
+    return {'operation_type': 'update', 'quadrant': quadrant, 'task_number': task_number, 'progress': int(progress)}
+
+
+def strip_quoted_reply(user_reply):
+    """去掉回复中引用的原邮件（「> 」开头的行和「原始邮件」分隔线之后的内容）"""
+    lines = []
+    for line in (user_reply or '').splitlines():
+        stripped = line.strip()
+        if _REPLY_QUOTE_START.match(stripped):
+            break
+        if stripped.startswith('>'):
+            continue
+        lines.append(stripped)
+    return lines
+
+
+def parse_task_operations_local(user_reply):
+    """
+    按文档中的回复格式在本地解析任务操作（不调用 AI）
+
+    参数:
+        user_reply: 用户回复内容
+
+    返回:
+        操作列表（格式与 parse_task_operations_v4 相同）；有无法识别的内容时返回 None，交给 AI 解析。
+        去掉引用的原邮件、命令行（购买 / 切换性格）和签名后没有任何内容时返回 []：
+        这样的回复里没有任务操作，不调用 AI，由调用方按「未检测到任务操作」回复格式示例
+    """
+    operations = []
+
+    for line in strip_quoted_reply(user_reply):
+        if not line or _REPLY_COMMAND_LINE.match(line) or _REPLY_SIGNATURE_LINE.match(line):
+            continue
+
+        match = _REPLY_QUADRANT_LINE.match(line)
+        if match:
+            quadrant = int(match.group(1))
+            items = match.group(2).strip()
+            position = 0
+            line_operations = []
+            while position < len(items):
+                item_match = _REPLY_ITEM.match(items, position)
+                if not item_match or item_match.end() == position:
+                    return None
+                line_operations.append(_parse_reply_action(quadrant, item_match.groups()))
+                position = item_match.end()
+            operations.extend(line_operations)
+            continue
+
+        match = _REPLY_SINGLE_LINE.match(line)
+        if match:
+            operations.append(_parse_reply_action(int(match.group(1)), match.groups()[1:]))
+            continue
+
+        match = _REPLY_CREATE_LINE.match(line)
+        if match:
+            operations.append({
+                'operation_type': 'create',
+                'quadrant': int(match.group(2)),
+                'task_name': match.group(1).strip()
+            })
+            continue
+
+        match = _REPLY_RESUME_LINE.match(line)
+        if match:
+            operations.append({
+                'operation_type': 'resume',
+                'quadrant': int(match.group(2)),
+                'task_number': int(match.group(1))
+            })
+            continue
+
+        return None
+
+    return operations
+
+
+# AI 解析规则（单封和批量解析共用）
+TASK_OPERATION_RULES = """解析规则：
 1. 任务引用方式：
    - 编号引用：Q1任务1、Q1-1、Q2任务2、Q2-2
    - 暂缓任务引用：暂缓任务1、暂缓1
@@ -2210,57 +3273,56 @@ def parse_task_operations_v4(user_reply, deepseek_api_key):
    - 新增：包含"新增"或直接写任务名 → operation_type="create"
 
 3. 返回JSON格式：
-{{
+{
   "operation_type": "complete|update|pause|resume|create",
   "quadrant": 1,  // 象限数字 1-4
   "task_number": 1,  // 任务编号（1, 2, 3...）
   "task_name": "任务名称",  // 仅新增任务时需要
   "progress": 60  // 仅更新进度时需要
-}}
+}
+"""
+
+# 批量解析时每个请求最多包含的回复数
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+
+
+def _load_ai_json(ai_response):
+    """去掉 markdown 代码块后解析 AI 返回的 JSON，格式错误时抛出 ValueError"""
+    ai_response = re.sub(r'```json\s*', '', ai_response)
+    ai_response = re.sub(r'```\s*', '', ai_response)
+    return json.loads(ai_response.strip())
+
+
+def _parse_task_operations_ai(user_reply, deepseek_api_key):
+    """使用 AI 解析单封回复，成功后写入缓存；失败返回 None"""
+    try:
+        started = time.monotonic()
+        prompt = f"""请解析用户的任务更新回复，提取任务操作信息。
 
+用户回复：
+{user_reply}
+
+{TASK_OPERATION_RULES}
 如果有多个操作，返回JSON数组。
 只返回JSON，不要其他内容。
 """
         
-        headers = {
-            "Authorization": f"Bearer {deepseek_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
+        ai_response = get_llm_client(deepseek_api_key).complete(prompt, temperature=0.7)
         
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"❌ AI解析失败: {response.status_code}")
+        if ai_response is None:
+            print("❌ AI解析失败")
             return None
         
-        result = response.json()
-        ai_response = result['choices'][0]['message']['content'].strip()
-        
-        # 清理markdown代码块
-        ai_response = re.sub(r'```json\s*', '', ai_response)
-        ai_response = re.sub(r'```\s*', '', ai_response)
-        ai_response = ai_response.strip()
-        
         print(f"AI解析结果: {ai_response}")
         
         # 解析JSON
-        operations = json.loads(ai_response)
+        operations = _load_ai_json(ai_response)
         if not isinstance(operations, list):
             operations = [operations]
         
+        get_llm_cache().put('task_operations_v4', PARSE_PROMPT_VERSION, user_reply, operations,
+                            time.monotonic() - started)
+        
         return operations
         
     except Exception as e:
@@ -2268,22 +3330,218 @@ def parse_task_operations_v4(user_reply, deepseek_api_key):
         return None
 
 
-def process_task_operations_v4(supabase_url, headers, user_email, operations):
+def parse_task_operations_v4(user_reply, deepseek_api_key):
     """
-    v4.0：处理任务操作列表
+    v4.0：解析用户回复，提取任务操作（支持任务编号）
+    
+    先按文档格式本地解析（parse_task_operations_local），无法识别时再使用AI解析
     
     参数:
-        supabase_url: Supabase URL
-        headers: 请求头
-        user_email: 用户邮箱
-        operations: 操作列表
+        user_reply: 用户回复内容
+        deepseek_api_key: DeepSeek API密钥
+    
+    返回:
+        成功返回操作列表，失败返回None
+    """
+    # 按文档格式书写的回复直接在本地解析，只有无法识别的自由文本才调用 AI
+    operations = parse_task_operations_local(user_reply)
+    if operations is not None:
+        print(f"本地解析结果: {operations}")
+        return operations
+    
+    # 同一封回复重复处理（workflow 重跑等）时直接使用上次的 AI 解析结果
+    operations = get_llm_cache().get('task_operations_v4', PARSE_PROMPT_VERSION, user_reply)
+    if operations is not None:
+        print(f"AI解析结果（缓存）: {operations}")
+        return operations
+    
+    return _parse_task_operations_ai(user_reply, deepseek_api_key)
+
+
+def _build_batch_prompt(user_replies):
+    """把多封回复（按顺序编号为 r1、r2...）和一份解析规则组成一个提示词"""
+    blocks = []
+    for n, user_reply in enumerate(user_replies, 1):
+        # 回复中出现结束标记时会打乱分隔，改写掉
+        content = user_reply.replace('</reply>', '</ reply>')
+        blocks.append(f'<reply id="r{n}">\n{content}\n</reply>')
+    replies_text = '\n\n'.join(blocks)
+    
+    return f"""请解析以下 {len(user_replies)} 封用户的任务更新回复，分别提取每封回复中的任务操作信息。
+
+每封回复用 <reply id="..."> 和 </reply> 包围：
+
+{replies_text}
+
+{TASK_OPERATION_RULES}
+每封回复的操作按上面的格式组成JSON数组（没有操作时为空数组）。
+返回一个JSON对象，键为回复的 id，值为该回复的操作数组，例如 {{"r1": [...], "r2": [...]}}，必须包含所有 id。
+只返回JSON，不要其他内容。
+"""
+
+
+def _parse_batch_response(ai_response, count):
+    """
+    解析批量请求的返回
+
+    返回:
+        长度为 count 的列表，第 n 项为 r{n+1} 的操作列表，缺失或格式错误时为 None
+    """
+    if ai_response is None:
+        return [None] * count
+    
+    try:
+        data = _load_ai_json(ai_response)
+    except ValueError as e:
+        print(f"⚠️ 批量解析结果不是有效的JSON: {e}")
+        return [None] * count
+    
+    if not isinstance(data, dict):
+        print("⚠️ 批量解析结果不是JSON对象")
+        return [None] * count
+    
+    results = []
+    for n in range(1, count + 1):
+        operations = data.get(f"r{n}")
+        if isinstance(operations, dict):
+            operations = [operations]
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            operations = None
+        results.append(operations)
+    return results
+
+
+def parse_task_operations_batch(replies, deepseek_api_key, batch_size=LLM_BATCH_SIZE):
+    """
+    批量解析多封回复（例如一次检查到的多封回复）
+    
+    本地解析和缓存命中的回复不调用 AI；其余回复每 batch_size 封合成一个请求（只带一份解析规则），
+    多个请求并发发送。返回格式错误或缺少某封回复时，这些回复再逐封单独解析。
+    
+    参数:
+        replies: {回复标识: 回复内容}
+        deepseek_api_key: DeepSeek API密钥
+        batch_size: 每个请求最多包含的回复数
     
     返回:
-        处理结果列表
+        {回复标识: 操作列表，解析失败为 None}
+    """
+    llm_cache = get_llm_cache()
+    results = {}
+    pending = []
+    
+    for key, user_reply in replies.items():
+        operations = parse_task_operations_local(user_reply)
+        if operations is None:
+            operations = llm_cache.get('task_operations_v4', PARSE_PROMPT_VERSION, user_reply)
+        if operations is not None:
+            results[key] = operations
+        else:
+            pending.append(key)
+    
+    if len(pending) <= 1:
+        for key in pending:
+            results[key] = _parse_task_operations_ai(replies[key], deepseek_api_key)
+        return results
+    
+    batch_size = max(1, batch_size)
+    chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    print(f"批量AI解析 {len(pending)} 封回复（{len(chunks)} 个请求）...")
+    
+    started = time.monotonic()
+    prompts = [_build_batch_prompt([replies[key] for key in chunk]) for chunk in chunks]
+    responses = get_llm_client(deepseek_api_key).complete_many(prompts, temperature=0.7)
+    elapsed = time.monotonic() - started
+    
+    fallback = []
+    for chunk, ai_response in zip(chunks, responses):
+        for key, operations in zip(chunk, _parse_batch_response(ai_response, len(chunk))):
+            if operations is None:
+                fallback.append(key)
+                continue
+            results[key] = operations
+            llm_cache.put('task_operations_v4', PARSE_PROMPT_VERSION, replies[key], operations,
+                          elapsed / len(chunk))
+    
+    if fallback:
+        print(f"⚠️ {len(fallback)} 封回复的批量解析结果无效，逐封重新解析")
+        for key in fallback:
+            results[key] = _parse_task_operations_ai(replies[key], deepseek_api_key)
+    
+    return results
+
+
+def _normalize_operation(op):
+    """规范化一条操作（数据库函数要求数字字段为整数，无法转换时为 null）"""
+    return {
+        "operation_type": (op.get('operation_type') or '').lower(),
+        "quadrant": _to_int(op.get('quadrant')),
+        "task_number": _to_int(op.get('task_number')),
+        "progress": _to_int(op.get('progress')),
+        "task_name": op.get('task_name') or ''
+    }
+
+
+def _apply_task_operations_rpc(client, user_email, operations):
+    """
+    已部署 apply_task_operations 数据库函数时，整封回复的查找、修改、重新编号、奖励和经验值历史
+    在数据库内一个事务中完成（一次调用）
+    
+    返回:
+        格式同 process_task_operations_v4；函数未部署时返回 None（调用方回退到 compile_task_plan）；
+        调用失败时返回 RPC_FAILED（事务可能已经提交，调用方不能回退重放）
+    """
+    state = call_gamification_rpc(client, "apply_task_operations", {
+        "p_user_email": user_email,
+        "p_ops": [_normalize_operation(op) for op in operations],
+        "p_sparse": is_sparse_numbering()
+    })
+    
+    if state is None or state is RPC_FAILED:
+        return state
+    
+    reward_result = None
+    reward = state.get('reward')
+    if reward:
+        refresh_cached_gamification(client, user_email, {
+            "level": reward['level'],
+            "current_exp": reward['current_exp'],
+            "total_exp": reward['total_exp'],
+            "coins": reward['coins']
+        })
+        reward_result = {
+            'success': True,
+            'level_up': reward['level'] > reward['old_level'],
+            'old_level': reward['old_level'],
+            'new_level': reward['level'],
+            'exp_gain': state['total_exp_gain'],
+            'coins_gain': state['total_coins_gain'],
+            'current_exp': reward['current_exp'],
+            'total_exp': reward['total_exp'],
+            'coins': reward['coins']
+        }
+    
+    return {
+        'results': state['results'],
+        'total_exp_gain': state['total_exp_gain'],
+        'total_coins_gain': state['total_coins_gain'],
+        'reward_result': reward_result
+    }
+
+
+def _process_task_operations_one_by_one(client, user_email, operations, rewards):
+    """
+    逐条执行任务操作（无法加载任务快照时使用），返回 results 列表
+    
+    dense 模式下按 task_order 直接查询编号；sparse 模式下显示编号只能从任务快照计算，
+    快照刚加载失败，不再为每条操作重复加载，全部标记为失败
     """
+    if is_sparse_numbering():
+        error = '加载任务清单失败，无法解析任务编号，请稍后重新回复'
+        return [{'operation': (op.get('operation_type') or '').lower(),
+                 'result': {'success': False, 'error': error}} for op in operations]
+    
     results = []
-    total_exp_gain = 0
-    total_coins_gain = 0
     
     for op in operations:
         op_type = op.get('operation_type', '').lower()
@@ -2294,42 +3552,90 @@ def process_task_operations_v4(supabase_url, headers, user_email, operations):
         
         if op_type == 'complete':
             # 完成任务
-            result = complete_task(supabase_url, headers, user_email, quadrant, task_number)
+            result = complete_task(client, user_email, quadrant, task_number, rewards=rewards)
             
         elif op_type == 'update':
             # 更新进度
             progress = op.get('progress', 0)
-            result = update_task_progress(supabase_url, headers, user_email, quadrant, task_number, progress)
+            result = update_task_progress(client, user_email, quadrant, task_number, progress, rewards=rewards)
             
         elif op_type == 'create':
             # 新增任务
             task_name = op.get('task_name', '')
-            result = create_task(supabase_url, headers, user_email, task_name, quadrant)
+            result = create_task(client, user_email, task_name, quadrant)
             
         elif op_type == 'pause':
             # 暂缓任务
-            result = pause_task(supabase_url, headers, user_email, quadrant, task_number)
+            result = pause_task(client, user_email, quadrant, task_number)
             
         elif op_type == 'resume':
             # 恢复暂缓任务
             target_quadrant = quadrant
-            result = resume_paused_task(supabase_url, headers, user_email, task_number, target_quadrant)
+            result = resume_paused_task(client, user_email, task_number, target_quadrant)
         
         if result:
             results.append({
                 'operation': op_type,
                 'result': result
             })
-            
-            # 累计经验值和金币
-            if result.get('success'):
-                total_exp_gain += result.get('exp_gain', 0)
-                total_coins_gain += result.get('coins_gain', 0)
+    
+    return results
+
+
+def process_task_operations_v4(client, user_email, operations):
+    """
+    v4.0：处理任务操作列表
+    
+    参数:
+        client: SupabaseClient
+        user_email: 用户邮箱
+        operations: 操作列表
+    
+    返回:
+        {'results': [...], 'total_exp_gain': ..., 'total_coins_gain': ..., 'reward_result': ..., 'failed': bool}
+        reward_result 为奖励结算结果（格式同 update_user_exp_and_coins()），无奖励时为 None；
+        failed 为 True 表示数据库函数调用失败、结果未确认，每条操作都标记为失败
+    """
+    # 已部署数据库函数时一次调用、一个事务完成
+    outcome = _apply_task_operations_rpc(client, user_email, operations)
+    if outcome is RPC_FAILED:
+        # 网关超时等情况下事务可能已经提交，用 Python 再执行一遍会重复修改任务、重复结算奖励
+        error = '数据库暂时不可用，本次任务操作结果未确认，请以下一次的任务清单为准'
+        return {
+            'results': [{'operation': (op.get('operation_type') or '').lower(),
+                         'result': {'success': False, 'error': error}} for op in operations],
+            'total_exp_gain': 0,
+            'total_coins_gain': 0,
+            'reward_result': None,
+            'failed': True
+        }
+    if outcome is not None:
+        outcome['failed'] = False
+        return outcome
+    
+    rewards = RewardAccumulator()
+    
+    # 整封回复基于同一份编号快照解析（与用户看到的清单一致），编译成一批写入
+    task_index = load_task_number_index(client, user_email)
+    
+    if task_index is not None:
+        plan = compile_task_plan(user_email, operations, task_index)
+        results = execute_task_plan(client, plan, rewards)
+    else:
+        print("⚠️ 加载任务快照失败，逐条执行任务操作")
+        results = _process_task_operations_one_by_one(client, user_email, operations, rewards)
+    
+    # 统一结算奖励：一次升级判断 + 一次写回 + 一次批量写入经验值历史
+    total_exp_gain = rewards.total_exp
+    total_coins_gain = rewards.total_coins
+    reward_result = rewards.apply(client, user_email)
     
     return {
         'results': results,
         'total_exp_gain': total_exp_gain,
-        'total_coins_gain': total_coins_gain
+        'total_coins_gain': total_coins_gain,
+        'reward_result': reward_result,
+        'failed': False
     }
 
 
@@ -0,0 +1,341 @@
+"""
+IMAP IDLE 回复监听 - 常驻运行
+保持一个 IMAP IDLE 连接，新邮件到达后几秒内处理回复，作为每日定时 POP3 检查的替代方式
+
+用法:
+    python scripts/check_email_reply.py --listen
+    python scripts/imap_listener.py
+
+连接参数（环境变量）:
+    IMAP_HOST / IMAP_PORT / IMAP_SSL: 默认 imap.163.com:993（SSL），本地测试时可指向不加密的 IMAP 服务
+    IMAP_IDLE_TIMEOUT: 单次 IDLE 的最长秒数，到期后重新发起（服务器一般在30分钟后断开空闲连接）
+"""
+import os
+import sys
+import time
+import ssl
+import email
+import select
+import imaplib
+import threading
+import traceback
+from datetime import datetime
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import SupabaseClient
+from mailbox_cursor import MailboxCursor, reply_message_key, claim_reply
+from check_email_reply import TARGET_SUBJECTS, decode_str, parse_email_content, process_reply
+
+IMAP_HOST = os.getenv("IMAP_HOST", "imap.163.com").strip()
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "true").strip().lower() not in ("0", "false", "no")
+IMAP_IDLE_TIMEOUT = int(os.getenv("IMAP_IDLE_TIMEOUT", "1500"))
+
+# 断线重连的等待秒数（指数退避）
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 300
+
+# 163 邮箱要求登录后发送 ID 命令，否则 SELECT 会被拒绝（Unsafe Login）
+imaplib.Commands.setdefault('ID', ('AUTH', 'SELECTED'))
+IMAP_CLIENT_ID = '("name" "ai-email-coach" "version" "4.1" "vendor" "ai-email-coach")'
+
+
+def connect_imap(username, password, host=IMAP_HOST, port=IMAP_PORT, use_ssl=IMAP_SSL):
+    """
+    连接 IMAP 服务器、登录并选中收件箱
+
+    返回:
+        (imap 连接, UIDVALIDITY)
+    """
+    imap = imaplib.IMAP4_SSL(host, port) if use_ssl else imaplib.IMAP4(host, port)
+    imap.login(username, password)
+
+    try:
+        imap.xatom('ID', IMAP_CLIENT_ID)
+    except imaplib.IMAP4.error:
+        # 不支持 ID 命令的服务器直接忽略
+        pass
+
+    typ, data = imap.select('INBOX')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"SELECT INBOX 失败: {data}")
+
+    typ, data = imap.response('UIDVALIDITY')
+    uidvalidity = data[0].decode() if data and data[0] else '0'
+    return imap, uidvalidity
+
+
+def _has_buffered_response(imap):
+    """
+    imap.readline() 经过 imaplib 带缓冲的 imap.file 读取，服务器一次发来的多行
+    （例如「+ idling」和 EXISTS）会一起读入缓冲区，select 看不到；这里以非阻塞方式查看缓冲区
+    """
+    timeout = imap.sock.gettimeout()
+    imap.sock.setblocking(False)
+    try:
+        return bool(imap.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+        return False
+    finally:
+        imap.sock.settimeout(timeout)
+
+
+def wait_for_new_mail(imap, timeout=IMAP_IDLE_TIMEOUT, stop_event=None):
+    """
+    发起一次 IDLE，直到有新邮件、超时或需要停止
+
+    返回:
+        bool: 是否收到新邮件通知（EXISTS）
+    """
+    tag = imap._new_tag()
+    imap.send(tag + b' IDLE\r\n')
+
+    line = imap.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"服务器不支持 IDLE: {line!r}")
+
+    deadline = time.monotonic() + timeout
+    has_new_mail = False
+
+    # select 短超时轮询，便于及时响应 stop_event（带超时的 readline 会让连接不可再读）
+    while time.monotonic() < deadline and not (stop_event and stop_event.is_set()):
+        if not _has_buffered_response(imap) and not select.select([imap.sock], [], [], 1)[0]:
+            continue
+
+        line = imap.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("IDLE 期间连接被关闭")
+        if line.startswith(b'*') and b'EXISTS' in line:
+            has_new_mail = True
+            break
+        if line.startswith(b'* BYE'):
+            raise imaplib.IMAP4.abort("服务器结束了连接")
+
+    # 结束 IDLE，读取到对应的完成响应为止（期间到达的通知也要算上）
+    imap.send(b'DONE\r\n')
+    while True:
+        line = imap.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("结束 IDLE 时连接被关闭")
+        if line.startswith(b'*') and b'EXISTS' in line:
+            has_new_mail = True
+        if line.startswith(tag):
+            break
+
+    return has_new_mail
+
+
+def fetch_new_replies(imap, last_uid):
+    """
+    读取 UID 大于 last_uid 的邮件，只下载标题匹配的回复正文
+
+    返回:
+        [(uid, 回复内容或 None, 去重键)]，按 UID 升序；内容为 None 表示不是需要处理的回复
+    """
+    typ, data = imap.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID SEARCH 失败: {data}")
+
+    # "n:*" 在没有新邮件时也会返回最后一封，需要再过滤
+    uids = sorted(int(uid) for uid in (data[0] or b'').split() if int(uid) > last_uid)
+    messages = []
+
+    for uid in uids:
+        typ, data = imap.uid('FETCH', str(uid), '(BODY.PEEK[HEADER.FIELDS (SUBJECT DATE FROM MESSAGE-ID)])')
+        if typ != 'OK' or not data or not isinstance(data[0], tuple):
+            print(f"⚠️ 读取邮件 UID {uid} 的邮件头失败")
+            messages.append((uid, None, None))
+            continue
+
+        headers = email.message_from_bytes(data[0][1])
+        message_key = reply_message_key(headers)
+        subject = decode_str(headers.get("Subject", ""))
+        print(f"\n新邮件 UID {uid}: {subject}")
+
+        if not any(target in subject for target in TARGET_SUBJECTS):
+            print("  → 标题不匹配，跳过")
+            messages.append((uid, None, message_key))
+            continue
+
+        typ, data = imap.uid('FETCH', str(uid), '(BODY.PEEK[])')
+        if typ != 'OK' or not data or not isinstance(data[0], tuple):
+            print(f"⚠️ 读取邮件 UID {uid} 失败")
+            messages.append((uid, None, message_key))
+            continue
+
+        content = parse_email_content(email.message_from_bytes(data[0][1]))
+        if not content or len(content) <= 10:
+            print("  → 内容过短，跳过")
+            content = None
+
+        messages.append((uid, content, message_key))
+
+    return messages
+
+
+class ReplyListener:
+    """
+    常驻的回复监听器
+
+    用 MailboxCursor 保存已处理到的 IMAP UID（按 UIDVALIDITY 区分），重启后从上次位置继续；
+    第一次运行时只处理启动之后到达的邮件。
+    每封回复处理前用 claim_reply() 按 Message-ID 登记，与 POP3 定时检查共用已处理记录，
+    两者同时运行时同一封回复只处理一次。
+
+    参数:
+        client: SupabaseClient
+        email_username / email_password: 邮箱账号和授权码
+        webhook_url: 飞书 Webhook（可选）
+        deepseek_api_key: DeepSeek API Key
+        host / port / use_ssl: IMAP 服务器
+        stop_event: threading.Event，设置后监听循环退出
+    """
+
+    def __init__(self, client, email_username, email_password, webhook_url, deepseek_api_key,
+                 host=IMAP_HOST, port=IMAP_PORT, use_ssl=IMAP_SSL, idle_timeout=IMAP_IDLE_TIMEOUT,
+                 stop_event=None):
+        self.client = client
+        self.email_username = email_username
+        self.email_password = email_password
+        self.webhook_url = webhook_url
+        self.deepseek_api_key = deepseek_api_key
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout
+        self.stop_event = stop_event or threading.Event()
+        self.cursor = None
+        self.last_uid = 0
+        self.processed_count = 0
+
+    def _load_cursor(self, imap, uidvalidity):
+        """读取已处理到的 UID；UIDVALIDITY 变化或没有记录时从当前最新邮件开始"""
+        self.cursor = MailboxCursor(f"imap:{self.email_username}:{uidvalidity}", self.client)
+
+        if self.cursor.load() and self.cursor.has_state and self.cursor.seen_uids:
+            self.last_uid = max(int(uid) for uid in self.cursor.seen_uids)
+            print(f"✅ 从 UID {self.last_uid} 之后继续处理")
+            return
+
+        typ, data = imap.response('UIDNEXT')
+        if data and data[0]:
+            self.last_uid = int(data[0]) - 1
+        else:
+            typ, data = imap.uid('SEARCH', None, 'ALL')
+            uids = (data[0] or b'').split() if typ == 'OK' else []
+            self.last_uid = max((int(uid) for uid in uids), default=0)
+
+        print(f"✅ 首次监听，只处理 UID {self.last_uid} 之后的新邮件")
+        self._save_cursor()
+
+    def _save_cursor(self):
+        # 只需要保存最大的已处理 UID
+        self.cursor.seen_uids = {str(self.last_uid)}
+        self.cursor.save()
+
+    def process_new_mail(self, imap):
+        """处理 last_uid 之后的所有新邮件，返回处理的回复数"""
+        count = 0
+
+        for uid, content, message_key in fetch_new_replies(imap, self.last_uid):
+            # 先记录再处理，避免重启后重复结算奖励
+            self.last_uid = uid
+            self._save_cursor()
+
+            if content is None or not claim_reply(self.client, self.email_username, message_key, 'imap'):
+                continue
+
+            print(f"✅ 处理回复 UID {uid}（{len(content)}字符）")
+            # 单封回复处理异常不影响后续邮件，也不触发重连（游标已经前进，重连也不会再处理这一封）
+            try:
+                process_reply(self.client, content, self.email_username, self.email_password,
+                              self.webhook_url, self.deepseek_api_key)
+            except Exception as e:
+                print(f"❌ 处理回复 UID {uid} 异常: {e}")
+                traceback.print_exc()
+            count += 1
+
+        self.processed_count += count
+        return count
+
+    def run_once(self):
+        """连接一次并持续监听，直到连接断开或需要停止"""
+        imap, uidvalidity = connect_imap(self.email_username, self.email_password,
+                                         self.host, self.port, self.use_ssl)
+        print(f"✅ 已连接 {self.host}:{self.port}，开始监听")
+
+        try:
+            self._load_cursor(imap, uidvalidity)
+
+            # 连接期间错过的邮件先处理一遍
+            self.process_new_mail(imap)
+
+            while not self.stop_event.is_set():
+                # IDLE 超时后也检查一次（一次 UID SEARCH），防止漏掉通知
+                wait_for_new_mail(imap, self.idle_timeout, self.stop_event)
+                if not self.stop_event.is_set():
+                    self.process_new_mail(imap)
+        finally:
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+    def run(self):
+        """监听循环：断线后按指数退避重连，直到 stop_event 被设置"""
+        delay = RECONNECT_MIN_DELAY
+
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"⚠️ IMAP 连接中断: {e}")
+            except Exception as e:
+                # 其他异常（例如读写游标时的数据库错误）同样重连，常驻进程不退出
+                print(f"❌ 监听异常: {e}")
+                traceback.print_exc()
+
+            if self.stop_event.is_set():
+                break
+
+            # 连接保持过一段时间才断开的，重新从最短等待开始
+            if time.monotonic() - started > RECONNECT_MAX_DELAY:
+                delay = RECONNECT_MIN_DELAY
+
+            print(f"{delay} 秒后重连...")
+            self.stop_event.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+def listen_for_replies():
+    """从环境变量读取配置并启动监听（常驻运行）"""
+    print(f"[{datetime.now()}] 启动邮件回复监听")
+
+    email_username = os.getenv("EMAIL_163_USERNAME", "").strip()
+    email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
+    webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
+    supabase_url = os.getenv("SUPABASE_URL", "").strip()
+    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    deepseek_api_key = os.getenv("DEEPSEEK_API_KEY", "").strip()
+
+    if not all([email_username, email_password, supabase_url, supabase_key, deepseek_api_key]):
+        print("❌ 环境变量未配置完整")
+        return False
+
+    with SupabaseClient(supabase_url, supabase_key) as client:
+        listener = ReplyListener(client, email_username, email_password, webhook_url, deepseek_api_key)
+        try:
+            listener.run()
+        except KeyboardInterrupt:
+            listener.stop_event.set()
+            print(f"\n停止监听，共处理 {listener.processed_count} 封回复")
+
+    return True
+
+
+if __name__ == "__main__":
+    success = listen_for_replies()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,169 @@
+"""
+AI 解析结果缓存（SQLite）
+相同的回复内容（规范化后）+ 相同的提示词版本直接返回上次的解析结果，不再调用 DeepSeek
+
+    - 键为 sha256(命名空间 + 提示词版本 + 规范化文本)
+    - 超过 LLM_CACHE_TTL 秒的结果视为过期
+    - 超过 LLM_CACHE_MAX_ENTRIES 条时淘汰最久未使用的结果
+    - 记录命中率和节省的调用耗时
+
+GitHub Actions 中通过 actions/cache 保留缓存文件（见 check_email_reply.yml / process_reply.yml）
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "llm_parse_cache.sqlite3")
+).strip()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_text(text):
+    """规范化文本：全角转半角、去掉每行首尾空白和空行"""
+    text = unicodedata.normalize('NFKC', text or '')
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+class LLMParseCache:
+    """
+    解析结果缓存
+
+    参数:
+        path: SQLite 文件路径（为空时不缓存）
+        ttl: 过期秒数
+        max_entries: 最多保留的条数
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'saved_seconds': 0.0}
+
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_parse_cache (
+                        key TEXT PRIMARY KEY,
+                        namespace TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        latency REAL DEFAULT 0,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL
+                    )
+                """)
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_llm_parse_cache_last_used ON llm_parse_cache(last_used_at)"
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ AI 解析缓存不可用: {e}")
+                self._conn = None
+
+    @staticmethod
+    def make_key(namespace, prompt_version, text):
+        raw = f"{namespace}\n{prompt_version}\n{normalize_text(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, namespace, prompt_version, text):
+        """
+        读取缓存
+
+        返回:
+            缓存的解析结果，未命中或已过期返回 None
+        """
+        if self._conn is None:
+            return None
+
+        key = self.make_key(namespace, prompt_version, text)
+        now = time.time()
+
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, latency, created_at FROM llm_parse_cache WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row is None or now - row[2] > self.ttl:
+                    self.stats['misses'] += 1
+                    return None
+
+                self._conn.execute("UPDATE llm_parse_cache SET last_used_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ 读取 AI 解析缓存失败: {e}")
+                return None
+
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += row[1] or 0.0
+
+        return json.loads(row[0])
+
+    def put(self, namespace, prompt_version, text, value, latency=0.0):
+        """写入缓存（value 需可 JSON 序列化），latency 为这次 AI 调用的耗时"""
+        if self._conn is None:
+            return
+
+        key = self.make_key(namespace, prompt_version, text)
+        now = time.time()
+
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_parse_cache (key, namespace, value, latency, created_at, last_used_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, namespace, json.dumps(value, ensure_ascii=False), latency, now, now)
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ 写入 AI 解析缓存失败: {e}")
+
+    def _evict(self, now):
+        """删除过期条目，再按最近使用时间淘汰超出上限的条目"""
+        self._conn.execute("DELETE FROM llm_parse_cache WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute("""
+            DELETE FROM llm_parse_cache WHERE key IN (
+                SELECT key FROM llm_parse_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def format_stats(self):
+        """格式化命中统计"""
+        total = self.stats['hits'] + self.stats['misses']
+        if total == 0:
+            return "🗃️ AI 解析缓存：本次未使用"
+        hit_rate = self.stats['hits'] / total * 100
+        return (f"🗃️ AI 解析缓存：命中 {self.stats['hits']}/{total}（{hit_rate:.0f}%），"
+                f"节省调用耗时 {self.stats['saved_seconds']:.1f}s")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """进程内共享的缓存实例"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMParseCache()
+        return _cache
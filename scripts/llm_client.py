@@ -0,0 +1,262 @@
+"""
+DeepSeek 调用客户端
+所有 AI 调用共用一个 keep-alive 连接池，限制同时进行的请求数，429 / 5xx 时按带抖动的指数退避重试，
+并统计每次调用的耗时和 token 用量
+
+用法:
+    llm = get_llm_client(deepseek_api_key)
+    text = llm.complete(prompt, temperature=0.7)       # 失败返回 None
+    texts = llm.complete_many([prompt1, prompt2])       # 并发调用，结果顺序与输入一致
+    future = llm.submit(prompt)                         # 后台调用，future.result() 为 complete 的返回值
+    llm.complete(prompt, stream=True, on_chunk=print)  # 流式返回，每收到一段调用 on_chunk
+
+连接参数（环境变量）:
+    DEEPSEEK_BASE_URL: API 地址，默认 https://api.deepseek.com/v1，测试和压测时可指向本地模拟服务
+    DEEPSEEK_MODEL: 模型名称
+    LLM_MAX_CONCURRENCY: 同时进行的请求数上限
+    LLM_MAX_RETRIES: 429 / 5xx / 网络错误时的最大重试次数
+"""
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1").strip().rstrip('/')
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat").strip()
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_TIMEOUT = 30
+# 退避时间：第 n 次重试前随机等待 0 ~ min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2^n) 秒
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 20.0
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class DeepSeekClient:
+    """
+    DeepSeek Chat Completions 客户端（线程安全，一次运行共享一个实例）
+
+    参数:
+        api_key: DeepSeek API密钥
+        base_url: API 地址（不含 /chat/completions）
+        model: 模型名称
+        max_concurrency: 同时进行的请求数上限
+        max_retries: 最大重试次数
+        timeout: 单次请求超时（秒）
+    """
+
+    def __init__(self, api_key, base_url=DEEPSEEK_BASE_URL, model=DEEPSEEK_MODEL,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES, timeout=LLM_TIMEOUT):
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        # 重试由 _post 处理（POST 也需要按状态码重试），连接池只负责复用连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0, 'failed': 0, 'retries': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'latency': 0.0
+        }
+
+    def _backoff(self, attempt, response=None):
+        """计算第 attempt 次重试前的等待时间，429 时优先使用 Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), LLM_BACKOFF_MAX)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    def _post(self, payload, stream):
+        """
+        发送请求，429 / 5xx / 网络错误时重试
+
+        返回:
+            状态码为 200 的响应，失败返回 None
+        """
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUS_CODES:
+                    print(f"❌ AI 请求失败: {response.status_code} - {response.text[:200]}")
+                    return None
+                error = f"HTTP {response.status_code}"
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+
+            if attempt == self.max_retries:
+                print(f"❌ AI 请求失败（已重试 {self.max_retries} 次）: {error}")
+                return None
+
+            delay = self._backoff(attempt, response)
+            with self._lock:
+                self.stats['retries'] += 1
+            print(f"⚠️ AI 请求失败（{error}），{delay:.1f} 秒后重试")
+            time.sleep(delay)
+
+        return None
+
+    @staticmethod
+    def _read_stream(response, on_chunk):
+        """读取 SSE 流，返回 (完整内容, usage)"""
+        parts = []
+        usage = None
+        # text/event-stream 默认按 ISO-8859-1 解码，这里按 UTF-8 自行解码
+        for raw_line in response.iter_lines():
+            line = raw_line.decode('utf-8')
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            usage = chunk.get('usage') or usage
+            for choice in chunk.get('choices') or []:
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    parts.append(text)
+                    if on_chunk:
+                        on_chunk(text)
+        return ''.join(parts), usage
+
+    def chat(self, messages, temperature=0.7, stream=False, on_chunk=None, **options):
+        """
+        调用 Chat Completions
+
+        参数:
+            messages: 消息列表
+            temperature: 温度
+            stream: 是否流式返回
+            on_chunk: 流式返回时每收到一段内容的回调
+            options: 其他请求参数（如 max_tokens、response_format）
+
+        返回:
+            回复内容（已去掉首尾空白），失败返回 None
+        """
+        payload = {"model": self.model, "messages": messages, "temperature": temperature, **options}
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+
+        started = time.monotonic()
+        content = None
+        usage = None
+
+        with self._semaphore:
+            response = self._post(payload, stream)
+            if response is not None:
+                try:
+                    if stream:
+                        content, usage = self._read_stream(response, on_chunk)
+                    else:
+                        result = response.json()
+                        content = result['choices'][0]['message']['content']
+                        usage = result.get('usage')
+                except (ValueError, KeyError, IndexError, requests.RequestException) as e:
+                    print(f"❌ AI 返回内容无法解析: {e}")
+                    content = None
+                finally:
+                    response.close()
+
+        latency = time.monotonic() - started
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['latency'] += latency
+            if content is None:
+                self.stats['failed'] += 1
+            if usage:
+                self.stats['prompt_tokens'] += usage.get('prompt_tokens') or 0
+                self.stats['completion_tokens'] += usage.get('completion_tokens') or 0
+
+        if content is not None:
+            tokens = f"，{usage.get('total_tokens')} tokens" if usage else ""
+            print(f"🤖 AI 调用完成：{latency:.2f}s{tokens}")
+            return content.strip()
+        return None
+
+    def complete(self, prompt, temperature=0.7, **options):
+        """单轮对话：只发送一条用户消息，返回值同 chat"""
+        return self.chat([{"role": "user", "content": prompt}], temperature=temperature, **options)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+            return self._executor
+
+    def submit(self, prompt, temperature=0.7, **options):
+        """在后台线程调用 complete，返回 Future"""
+        return self._get_executor().submit(self.complete, prompt, temperature, **options)
+
+    def complete_many(self, prompts, temperature=0.7, **options):
+        """
+        并发调用多个提示词（同时进行的请求数不超过 max_concurrency）
+
+        返回:
+            与 prompts 顺序一致的结果列表，失败项为 None
+        """
+        futures = [self.submit(prompt, temperature, **options) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def format_stats(self):
+        """格式化调用统计"""
+        calls = self.stats['calls']
+        if calls == 0:
+            return "🤖 AI 调用：本次未调用"
+        return (f"🤖 AI 调用：{calls} 次（失败 {self.stats['failed']}，重试 {self.stats['retries']}），"
+                f"平均耗时 {self.stats['latency'] / calls:.2f}s，"
+                f"tokens {self.stats['prompt_tokens']} + {self.stats['completion_tokens']}")
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# 进程内共享的客户端（按 API 密钥区分）
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(api_key):
+    """获取进程内共享的 DeepSeek 客户端，所有调用复用同一个连接池和并发限制"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = DeepSeekClient(api_key)
+            _clients[api_key] = client
+        return client
@@ -0,0 +1,204 @@
+"""
+邮件发送通道
+整个进程复用一个已登录的 SMTP 连接，按频率限制发送，连接断开后自动重连
+
+用法:
+    transport = get_mail_transport(sender_email, email_password)
+    transport.send_text(user_email, "📊 每日复盘提醒", body)
+
+连接参数（环境变量）:
+    SMTP_HOST / SMTP_PORT / SMTP_SSL: 默认 smtp.163.com:465（SSL），本地测试时可指向不加密的调试 SMTP 服务
+    SMTP_RATE_LIMIT: 每分钟最多发送的邮件数（0 表示不限制）
+    SMTP_MAX_PER_CONNECTION: 单个连接最多发送的邮件数，达到后重新连接（0 表示不限制）
+"""
+import os
+import time
+import atexit
+import smtplib
+import threading
+from collections import deque
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.163.com").strip()
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "true").strip().lower() not in ("0", "false", "no")
+SMTP_RATE_LIMIT = int(os.getenv("SMTP_RATE_LIMIT", "20"))
+SMTP_MAX_PER_CONNECTION = int(os.getenv("SMTP_MAX_PER_CONNECTION", "50"))
+SMTP_TIMEOUT = 30
+
+
+def build_text_message(sender, recipient, subject, body):
+    """构造纯文本邮件"""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg
+
+
+class MailTransport:
+    """
+    复用连接的 SMTP 发送器（线程安全，多个线程共用时按顺序发送）
+
+    参数:
+        username / password: 邮箱账号和授权码（username 同时作为发件人）
+        host / port / use_ssl: SMTP 服务器
+        rate_limit: 每分钟最多发送的邮件数，0 表示不限制
+        max_per_connection: 单个连接最多发送的邮件数，0 表示不限制
+    """
+
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL,
+                 rate_limit=SMTP_RATE_LIMIT, max_per_connection=SMTP_MAX_PER_CONNECTION):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.rate_limit = rate_limit
+        self.max_per_connection = max_per_connection
+        self._server = None
+        self._sent_on_connection = 0
+        self._send_times = deque()
+        self._lock = threading.Lock()
+        self.stats = {'sent': 0, 'failed': 0, 'connections': 0}
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+
+        try:
+            # 本地调试服务不支持 AUTH 时跳过登录
+            server.ehlo_or_helo_if_needed()
+            if self.password and server.has_extn('auth'):
+                server.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError):
+            server.close()
+            raise
+
+        self._server = server
+        self._sent_on_connection = 0
+        self.stats['connections'] += 1
+
+    def _disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def _wait_for_rate_limit(self):
+        """滑动窗口限速：最近60秒内的发送数达到上限时等待"""
+        if self.rate_limit <= 0:
+            return
+
+        now = time.monotonic()
+        while self._send_times and now - self._send_times[0] >= 60:
+            self._send_times.popleft()
+
+        if len(self._send_times) >= self.rate_limit:
+            wait = 60 - (now - self._send_times[0])
+            print(f"⏳ 达到发送频率限制，等待 {wait:.1f} 秒")
+            time.sleep(wait)
+            self._send_times.popleft()
+
+        self._send_times.append(time.monotonic())
+
+    def send_message(self, msg):
+        """
+        发送一封邮件，连接失败或连接断开时重连后重试一次
+
+        失败时抛出 smtplib.SMTPException / OSError
+        """
+        with self._lock:
+            self._wait_for_rate_limit()
+
+            if self.max_per_connection and self._sent_on_connection >= self.max_per_connection:
+                self._disconnect()
+
+            for attempt in range(2):
+                try:
+                    if self._server is None:
+                        self._connect()
+                    self._server.send_message(msg)
+                    self._sent_on_connection += 1
+                    self.stats['sent'] += 1
+                    return
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+                    error = e
+                except smtplib.SMTPException:
+                    # 收件人被拒、登录失败等错误，重连也不会成功（SMTPException 是 OSError 的子类，需先判断）
+                    self.stats['failed'] += 1
+                    raise
+                except OSError as e:
+                    error = e
+
+                # 连接失败、服务器关闭了空闲连接或连接已失效，重新连接
+                self._server = None
+                if attempt == 1:
+                    self.stats['failed'] += 1
+                    raise error
+                print(f"⚠️ SMTP 连接异常，重新连接: {error}")
+
+    def send_text(self, recipient, subject, body):
+        """发送纯文本邮件（发件人为 username），失败时抛出异常"""
+        self.send_message(build_text_message(self.username, recipient, subject, body))
+
+    def send_many(self, messages):
+        """
+        批量发送，复用同一个连接，单封失败不影响其他邮件
+
+        参数:
+            messages: [(收件人, 标题, 正文)]
+
+        返回:
+            [{'recipient': ..., 'success': bool, 'error': 错误信息或 None}]
+        """
+        results = []
+        for recipient, subject, body in messages:
+            try:
+                self.send_text(recipient, subject, body)
+                results.append({'recipient': recipient, 'success': True, 'error': None})
+            except OSError as e:
+                print(f"❌ 发送给 {recipient} 失败: {e}")
+                results.append({'recipient': recipient, 'success': False, 'error': str(e)})
+        return results
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# 进程内共享的发送器（按发件账号区分）
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_mail_transport(username, password):
+    """获取进程内共享的发送器，同一账号的所有邮件复用一个连接"""
+    with _transports_lock:
+        transport = _transports.get(username)
+        if transport is None or transport.password != password:
+            transport = MailTransport(username, password)
+            _transports[username] = transport
+        return transport
+
+
+@atexit.register
+def close_mail_transports():
+    """进程退出时关闭所有连接"""
+    with _transports_lock:
+        for transport in _transports.values():
+            transport.close()
+        _transports.clear()
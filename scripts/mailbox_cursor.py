@@ -0,0 +1,200 @@
+"""
+邮箱增量游标
+用 POP3 UIDL 记录已经检查过的邮件，每次运行只检查新到的邮件
+
+状态保存位置：
+    - 设置了 MAILBOX_STATE_FILE 时保存到本地 JSON 文件
+    - 否则保存到 Supabase mailbox_state 表（见 database_setup.sql）
+
+POP3 的 UIDL 和 IMAP 的 UID 互不相通，定时检查和 IMAP 监听同时运行时，
+同一封回复由 claim_reply() 按 Message-ID 在 processed_replies 表中登记，只有先登记的一方处理
+"""
+import os
+import json
+import hashlib
+from datetime import datetime
+
+MAILBOX_STATE_FILE = os.getenv("MAILBOX_STATE_FILE", "").strip()
+
+
+def list_message_uids(pop_server):
+    """
+    获取邮箱中所有邮件的 UIDL
+
+    返回:
+        [(邮件序号, uid)]，按序号升序
+    """
+    response, lines, octets = pop_server.uidl()
+    uids = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('ascii', errors='ignore')
+        index, uid = line.split(None, 1)
+        uids.append((int(index), uid.strip()))
+    return sorted(uids)
+
+
+class MailboxCursor:
+    """
+    已检查邮件的 UID 集合
+
+    参数:
+        mailbox: 邮箱地址（状态按邮箱区分）
+        client: SupabaseClient，使用 mailbox_state 表保存状态时需要
+        state_file: 本地状态文件路径，为空时使用 Supabase
+    """
+
+    def __init__(self, mailbox, client=None, state_file=MAILBOX_STATE_FILE):
+        self.mailbox = mailbox
+        self.client = client
+        self.state_file = state_file
+        self.seen_uids = set()
+        # 是否读到了之前保存的状态（首次运行时为 False）
+        self.has_state = False
+        # 最近一次读取 / 保存的内容，没有变化时 save() 不写
+        self.saved_uids = None
+
+    def load(self):
+        """读取保存的状态，返回是否成功（没有状态也算成功）"""
+        try:
+            if self.state_file:
+                if os.path.exists(self.state_file):
+                    with open(self.state_file, 'r', encoding='utf-8') as f:
+                        state = json.load(f).get(self.mailbox)
+                    if state is not None:
+                        self.seen_uids = set(state.get('seen_uids', []))
+                        self.saved_uids = set(self.seen_uids)
+                        self.has_state = True
+                return True
+
+            response = self.client.get(
+                "mailbox_state",
+                params={"mailbox": f"eq.{self.mailbox}", "select": "seen_uids"}
+            )
+
+            if response.status_code != 200:
+                print(f"⚠️ 读取邮箱游标失败: {response.status_code} - {response.text}")
+                return False
+
+            rows = response.json()
+            if rows:
+                self.seen_uids = set(rows[0].get('seen_uids') or [])
+                self.saved_uids = set(self.seen_uids)
+                self.has_state = True
+            return True
+
+        except Exception as e:
+            print(f"⚠️ 读取邮箱游标异常: {e}")
+            return False
+
+    def is_new(self, uid):
+        return uid not in self.seen_uids
+
+    def mark_seen(self, uids):
+        self.seen_uids.update(uids)
+
+    def prune(self, current_uids):
+        """只保留邮箱中仍然存在的邮件，避免状态无限增长"""
+        self.seen_uids &= set(current_uids)
+
+    def save(self):
+        """保存状态（整个 UID 集合写一次，调用方每次运行只调用一次），返回是否成功；没有变化时不写"""
+        if self.has_state and self.seen_uids == self.saved_uids:
+            return True
+        
+        try:
+            if self.state_file:
+                states = {}
+                if os.path.exists(self.state_file):
+                    with open(self.state_file, 'r', encoding='utf-8') as f:
+                        states = json.load(f)
+                states[self.mailbox] = {
+                    'seen_uids': sorted(self.seen_uids),
+                    'updated_at': datetime.now().isoformat()
+                }
+                with open(self.state_file, 'w', encoding='utf-8') as f:
+                    json.dump(states, f, ensure_ascii=False)
+                self.saved_uids = set(self.seen_uids)
+                self.has_state = True
+                return True
+
+            response = self.client.post(
+                "mailbox_state",
+                params={"on_conflict": "mailbox"},
+                json={
+                    "mailbox": self.mailbox,
+                    "seen_uids": sorted(self.seen_uids),
+                    "updated_at": datetime.now().isoformat()
+                },
+                headers={"Prefer": "resolution=merge-duplicates,return=minimal"}
+            )
+
+            if response.status_code not in [200, 201, 204]:
+                print(f"⚠️ 保存邮箱游标失败: {response.status_code} - {response.text}")
+                return False
+
+            self.saved_uids = set(self.seen_uids)
+            self.has_state = True
+            return True
+
+        except Exception as e:
+            print(f"⚠️ 保存邮箱游标异常: {e}")
+            return False
+
+
+def reply_message_key(msg):
+    """
+    回复邮件的去重键：Message-ID；没有 Message-ID 时用 Date / From / Subject 的摘要
+
+    参数:
+        msg: email.message.Message（只需要邮件头）
+    """
+    message_id = (msg.get("Message-ID") or "").strip()
+    if message_id:
+        return message_id
+
+    headers = "\n".join(str(msg.get(name, "")) for name in ("Date", "From", "Subject"))
+    return "sha256:" + hashlib.sha256(headers.encode("utf-8")).hexdigest()
+
+
+def claim_reply(client, mailbox, message_key, source):
+    """
+    登记一封即将处理的回复（processed_replies 表，POP3 定时检查和 IMAP 监听共用）
+
+    参数:
+        client: SupabaseClient
+        mailbox: 邮箱地址
+        message_key: reply_message_key() 的结果
+        source: 'pop3' / 'imap'，只用于排查
+
+    返回:
+        True 表示本次登记成功、应该处理；已被登记过或登记失败时返回 False
+        （与游标一样先记录再处理：宁可漏处理，也不重复结算奖励）
+    """
+    try:
+        response = client.post(
+            "processed_replies",
+            params={"on_conflict": "mailbox,message_key"},
+            json={
+                "mailbox": mailbox,
+                "message_key": message_key,
+                "source": source,
+                "processed_at": datetime.now().isoformat()
+            },
+            headers={"Prefer": "resolution=ignore-duplicates,return=representation"}
+        )
+
+        if response.status_code not in [200, 201]:
+            print(f"⚠️ 登记回复失败，本次不处理: {response.status_code} - {response.text}")
+            return False
+
+        # ignore-duplicates 时已存在的行不会返回
+        if not response.json():
+            print(f"  → 回复 {message_key} 已处理过，跳过")
+            return False
+
+        return True
+
+    except Exception as e:
+        print(f"⚠️ 登记回复异常，本次不处理: {e}")
+        return False
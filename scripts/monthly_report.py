@@ -4,13 +4,15 @@ v2.0 - 故事叙述风格 + ASCII图表可视化
 """
 import os
 import sys
-import requests
 from datetime import datetime, timedelta
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from gamification_utils import get_user_gamification_data, LEVEL_EXP_REQUIRED
+from supabase_client import SupabaseClient, build_query, op_filter
+from task_models import TaskSet, REPORT_COLUMNS
+from outbox import send_notification
 
 def generate_ascii_bar_chart(data, max_width=25):
     """生成ASCII柱状图"""
@@ -150,59 +152,67 @@ def generate_monthly_story(stats, user_data, level_changes):
     
     return story
 
-def send_monthly_report():
-    """发送月报"""
+def send_monthly_report(user_email=None, client=None):
+    """
+    发送月报
+    
+    参数:
+        user_email: 收件用户邮箱，默认为 EMAIL_163_USERNAME（单用户部署）
+        client: 可选，共享的 SupabaseClient（fanout.py 多用户批量运行时传入）
+    """
     print(f"[{datetime.now()}] 开始生成月报")
     
     # 获取环境变量
     webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    user_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
     email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    user_email = user_email or sender_email
+    
+    # 飞书 Webhook 属于部署者本人，批量运行时只推送部署者自己的消息
+    if user_email != sender_email:
+        webhook_url = ""
     
     try:
-        headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if client is None:
+            client = SupabaseClient(supabase_url, supabase_key)
         
         # 获取本月数据（过去30天）
         month_ago = (datetime.now() - timedelta(days=30)).isoformat()
         
         # 查询本月完成的任务
-        completed_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.completed&is_deleted=eq.true&updated_at=gte.{month_ago}&select=*"
-        completed_response = requests.get(completed_url, headers=headers, timeout=30)
+        completed_response = client.get("tasks", params=build_query(
+            REPORT_COLUMNS, user_email=user_email, status="completed", is_deleted=True,
+            updated_at=op_filter("gte", month_ago)
+        ))
         
         # 查询所有任务
-        all_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&is_deleted=eq.false&select=*"
-        all_response = requests.get(all_url, headers=headers, timeout=30)
+        all_response = client.get("tasks", params=build_query(
+            REPORT_COLUMNS, user_email=user_email, is_deleted=False
+        ))
         
         if completed_response.status_code != 200 or all_response.status_code != 200:
             print(f"❌ 数据库查询失败")
             return False
         
-        completed_tasks = completed_response.json()
-        all_tasks = all_response.json()
+        completed_tasks = TaskSet.from_rows(completed_response.json())
+        all_tasks = TaskSet.from_rows(all_response.json())
         
         # 统计数据
-        total_completed = len(completed_tasks)
-        total_active = len([t for t in all_tasks if t['status'] == 'active'])
-        total_paused = len([t for t in all_tasks if t['status'] == 'paused'])
+        total_completed = completed_tasks.count('completed')
+        total_active = all_tasks.count('active')
+        total_paused = all_tasks.count('paused')
         
         # 按象限统计
-        quadrant_stats = {1: 0, 2: 0, 3: 0, 4: 0}
-        for task in completed_tasks:
-            q = task.get('quadrant', 1)
-            quadrant_stats[q] = quadrant_stats.get(q, 0) + 1
+        quadrant_stats = completed_tasks.quadrant_counts('completed')
         
         # 计算平均完成率
         total_tasks = total_completed + total_active
         avg_completion_rate = (total_completed / total_tasks * 100) if total_tasks > 0 else 0
         
         # 获取用户游戏化数据
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         # 计算等级变化（简化版，实际应该查询历史数据）
         level_changes = 0  # TODO: 从历史数据计算
@@ -219,58 +229,19 @@ def send_monthly_report():
         # 生成月度故事
         content = generate_monthly_story(stats, user_data, level_changes)
         
-        # 发送到飞书
-        feishu_success = False
-        if webhook_url:
-            message = {
-                "msg_type": "text",
-                "content": {
-                    "text": f"📊 每月报告\n\n{content}"
-                }
-            }
-            
-            response = requests.post(webhook_url, json=message, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("StatusCode") == 0:
-                    print("✅ 飞书月报发送成功")
-                    feishu_success = True
-                else:
-                    print(f"❌ 飞书返回错误: {result}")
-            else:
-                print(f"❌ 飞书HTTP请求失败: {response.status_code}")
+        # 飞书和邮件并发发送（没有配置邮箱授权码时只发飞书）
+        print("发送月报...")
         
-        # 发送邮件
-        if email_password:
-            try:
-                import smtplib
-                from email.mime.text import MIMEText
-                from email.mime.multipart import MIMEMultipart
-                
-                print("发送月报邮件...")
-                
-                msg = MIMEMultipart()
-                msg['From'] = user_email
-                msg['To'] = user_email
-                msg['Subject'] = "📊 每月成长史诗"
-                
-                email_body = f"每月报告\n\n{content}\n\n---\n本月报告由AI邮件教练自动生成"
-                msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
-                
-                server = smtplib.SMTP_SSL("smtp.163.com", 465)
-                server.login(user_email, email_password)
-                server.send_message(msg)
-                server.quit()
-                
-                print("✅ 月报邮件发送成功")
-                return True
-                
-            except Exception as e:
-                print(f"❌ 邮件发送失败: {e}")
-                return feishu_success
+        email_body = f"每月报告\n\n{content}\n\n---\n本月报告由AI邮件教练自动生成"
         
-        return feishu_success
+        # 写入发件箱后发送；同一周期重复运行时不会重复发送
+        results = send_notification(
+            client, user_email, "monthly_report", "📊 每月成长史诗", email_body if email_password else None,
+            feishu_text=f"📊 每月报告\n\n{content}" if webhook_url else None,
+            dedupe_key=f"monthly_report:{user_email}:{datetime.now().strftime('%Y-%m')}",
+            sender_email=sender_email, email_password=email_password, webhook_url=webhook_url
+        )
+        return results['success']
                 
     except Exception as e:
         print(f"❌ 生成月报失败: {e}")
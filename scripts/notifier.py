@@ -0,0 +1,142 @@
+"""
+通知分发
+同一条通知的飞书和邮件两个通道并发发送，分别返回结果，一个通道慢或失败不影响另一个
+
+用法:
+    results = dispatch_notification(sender_email, email_password, user_email, "📊 每日复盘提醒", email_body,
+                                    webhook_url=webhook_url, feishu_text=feishu_text)
+    results['success']   # 任一通道成功
+    results['feishu']    # {'success': bool, 'error': ...}，未发送飞书时为 None
+    results['email']     # {'success': bool, 'error': ...}，未发送邮件时为 None
+
+批量（多用户）:
+    dispatch_many([{...同上参数...}, ...])
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mail_transport import get_mail_transport
+
+# 通知线程池大小（所有脚本共享，限制同时进行的发送数）
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "8"))
+FEISHU_TIMEOUT = 30
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(2, NOTIFY_WORKERS), thread_name_prefix="notify")
+        return _executor
+
+
+def send_feishu(webhook_url, text):
+    """
+    发送飞书文本消息
+
+    返回:
+        {'success': bool, 'error': 错误信息或 None}
+    """
+    message = {
+        "msg_type": "text",
+        "content": {
+            "text": text
+        }
+    }
+
+    try:
+        response = requests.post(webhook_url, json=message, timeout=FEISHU_TIMEOUT)
+
+        if response.status_code != 200:
+            print(f"❌ 飞书HTTP请求失败: {response.status_code}")
+            return {'success': False, 'error': f"HTTP {response.status_code}"}
+
+        result = response.json()
+        if result.get("StatusCode") == 0 or result.get("code") == 0:
+            print("✅ 飞书消息发送成功")
+            return {'success': True, 'error': None}
+
+        print(f"❌ 飞书返回错误: {result}")
+        return {'success': False, 'error': str(result)}
+
+    except Exception as e:
+        print(f"❌ 飞书消息发送失败: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def send_email(sender_email, email_password, recipient, subject, body):
+    """
+    通过共享的 SMTP 连接发送邮件
+
+    返回:
+        {'success': bool, 'error': 错误信息或 None}
+    """
+    try:
+        get_mail_transport(sender_email, email_password).send_text(recipient, subject, body)
+        print(f"✅ 邮件发送成功: {subject}")
+        return {'success': True, 'error': None}
+    except Exception as e:
+        print(f"❌ 邮件发送失败: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def _submit_notification(executor, sender_email, email_password, recipient, subject, email_body,
+                         webhook_url=None, feishu_text=None):
+    """提交各通道的发送任务，返回 {通道: future}"""
+    futures = {}
+
+    if webhook_url and feishu_text:
+        futures['feishu'] = executor.submit(send_feishu, webhook_url, feishu_text)
+
+    if sender_email and email_password and recipient:
+        futures['email'] = executor.submit(send_email, sender_email, email_password, recipient, subject, email_body)
+
+    return futures
+
+
+def _collect_results(futures):
+    results = {'feishu': None, 'email': None}
+    for channel, future in futures.items():
+        results[channel] = future.result()
+    results['success'] = any(result and result['success'] for result in (results['feishu'], results['email']))
+    return results
+
+
+def dispatch_notification(sender_email, email_password, recipient, subject, email_body,
+                          webhook_url=None, feishu_text=None):
+    """
+    并发发送一条通知的所有通道，等待全部完成
+
+    参数:
+        sender_email / email_password: 发件邮箱和授权码（为空时不发邮件）
+        recipient: 收件人
+        subject / email_body: 邮件标题和正文
+        webhook_url / feishu_text: 飞书 Webhook 和消息文本（任一为空时不发飞书）
+
+    返回:
+        {'success': 任一通道成功, 'feishu': 结果或 None, 'email': 结果或 None}
+    """
+    futures = _submit_notification(_get_executor(), sender_email, email_password, recipient, subject,
+                                   email_body, webhook_url, feishu_text)
+    return _collect_results(futures)
+
+
+def dispatch_many(notifications):
+    """
+    批量发送多条通知（例如多个用户），所有通道在共享线程池中流水线发送，并发数受 NOTIFY_WORKERS 限制
+
+    参数:
+        notifications: [dict]，每项为 dispatch_notification 的关键字参数
+
+    返回:
+        与 notifications 顺序一致的结果列表
+    """
+    executor = _get_executor()
+    pending = [_submit_notification(executor, **notification) for notification in notifications]
+    return [_collect_results(futures) for futures in pending]
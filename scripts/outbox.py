@@ -0,0 +1,316 @@
+"""
+通知发件箱（email_logs 表）
+通知先写入 email_logs（status = pending），再由发送流程分批发送，失败按指数退避重试
+
+    - dedupe_key 相同的通知只会写入一次（例如 daily_review:用户:日期），workflow 重跑不会重复发送
+    - 每行分别记录邮件 / 飞书是否已发送，重试时只补发失败的通道
+    - 发送前先把行标记为 sending（带租约时间），多个进程同时发送时不会重复发送
+
+用法:
+    send_notification(client, user_email, "daily_review", subject, email_body, feishu_text=..., dedupe_key=...)
+    python scripts/outbox.py              # 发送所有到期的待发通知（定时任务）
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+# 添加父目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import SupabaseClient, in_filter
+from notifier import dispatch_notification, dispatch_many
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# 第 n 次失败后等待 OUTBOX_RETRY_BASE * 2^(n-1) 秒再重试，最长 OUTBOX_RETRY_MAX 秒
+OUTBOX_RETRY_BASE = int(os.getenv("OUTBOX_RETRY_BASE", "60"))
+OUTBOX_RETRY_MAX = 6 * 3600
+# 标记为 sending 后多久没有结果视为发送进程已退出，可以重新发送
+OUTBOX_LEASE_SECONDS = 300
+
+_deferred = False
+
+
+def set_deferred_delivery(deferred):
+    """
+    设置为 True 后，send_notification 只写入发件箱不立即发送，由调用方之后统一 drain_outbox
+    （多用户批量运行时用来把发送和生成分开）
+    """
+    global _deferred
+    _deferred = deferred
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue_notification(client, user_email, email_type, subject, email_body, feishu_text=None, dedupe_key=None):
+    """
+    写入一条待发送通知
+
+    参数:
+        email_body: 邮件正文，为 None 时不发邮件
+        feishu_text: 飞书消息，为 None 时不发飞书
+        dedupe_key: 去重键，已存在时不再写入
+
+    返回:
+        {'success': bool, 'row': 新写入的行（重复时为已有行）, 'duplicate': bool}
+    """
+    row = {
+        "user_email": user_email,
+        "email_type": email_type,
+        "subject": subject,
+        "content": email_body,
+        "feishu_text": feishu_text,
+        "status": "pending",
+        "dedupe_key": dedupe_key,
+        "attempts": 0,
+        "next_attempt_at": _now().isoformat()
+    }
+
+    response = client.post(
+        "email_logs",
+        params={"on_conflict": "dedupe_key"},
+        json=row,
+        headers={"Prefer": "resolution=ignore-duplicates,return=representation"}
+    )
+
+    if response.status_code not in [200, 201]:
+        print(f"❌ 写入发件箱失败: {response.status_code} - {response.text}")
+        return {'success': False, 'row': None, 'duplicate': False}
+
+    rows = response.json()
+    if rows:
+        return {'success': True, 'row': rows[0], 'duplicate': False}
+
+    # 去重键已存在
+    response = client.get("email_logs", params={"dedupe_key": f"eq.{dedupe_key}", "select": "*"})
+    existing = response.json() if response.status_code == 200 else []
+    return {'success': True, 'row': existing[0] if existing else None, 'duplicate': True}
+
+
+def claim_rows(client, ids=None, limit=OUTBOX_BATCH_SIZE):
+    """
+    领取到期的待发送行（标记为 sending 并设置租约），返回领取到的行
+
+    参数:
+        ids: 只领取这些行；为空时按 next_attempt_at 领取最早到期的 limit 行
+    """
+    now = _now()
+    params = {
+        "status": "in.(pending,sending)",
+        "next_attempt_at": f"lte.{now.isoformat()}"
+    }
+
+    if ids is None:
+        response = client.get("email_logs", params={
+            **params, "select": "id", "order": "next_attempt_at.asc", "limit": limit
+        })
+        if response.status_code != 200:
+            print(f"❌ 查询发件箱失败: {response.status_code} - {response.text}")
+            return []
+        ids = [row['id'] for row in response.json()]
+
+    if not ids:
+        return []
+
+    # 条件更新保证同一行只会被一个进程领取
+    response = client.patch(
+        "email_logs",
+        params={**params, "id": in_filter(ids)},
+        json={
+            "status": "sending",
+            "next_attempt_at": (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).isoformat()
+        },
+        headers={"Prefer": "return=representation"}
+    )
+
+    if response.status_code != 200:
+        print(f"❌ 领取发件箱失败: {response.status_code} - {response.text}")
+        return []
+
+    return response.json()
+
+
+def deliver_rows(client, rows, sender_email, email_password, webhook_url=None):
+    """
+    并发发送已领取的行，并写回每行的结果
+
+    返回:
+        {行 id: {'success': 任一通道已送达, 'status': sent / pending / failed}}
+    """
+    if not rows:
+        return {}
+
+    notifications = []
+    for row in rows:
+        send_email = row.get('content') is not None and not row.get('email_sent')
+        send_feishu = bool(webhook_url) and bool(row.get('feishu_text')) and not row.get('feishu_sent')
+        notifications.append({
+            'sender_email': sender_email,
+            'email_password': email_password,
+            'recipient': row['user_email'] if send_email else None,
+            'subject': row.get('subject'),
+            'email_body': row.get('content'),
+            'webhook_url': webhook_url if send_feishu else None,
+            'feishu_text': row.get('feishu_text')
+        })
+
+    outcomes = {}
+    sent_ids = []
+    now = _now()
+
+    for row, results in zip(rows, dispatch_many(notifications)):
+        email_sent = row.get('content') is None or bool(row.get('email_sent')) or \
+            bool(results['email'] and results['email']['success'])
+        # 没有配置 Webhook 时飞书通道无法发送，不再重试
+        feishu_sent = not row.get('feishu_text') or not webhook_url or bool(row.get('feishu_sent')) or \
+            bool(results['feishu'] and results['feishu']['success'])
+        delivered = (row.get('content') is not None and email_sent) or \
+            (bool(row.get('feishu_text')) and bool(webhook_url) and feishu_sent)
+
+        if email_sent and feishu_sent:
+            sent_ids.append(row['id'])
+            outcomes[row['id']] = {'success': True, 'status': 'sent'}
+            continue
+
+        attempts = (row.get('attempts') or 0) + 1
+        errors = [result['error'] for result in (results['email'], results['feishu']) if result and result['error']]
+        update = {
+            "attempts": attempts,
+            "email_sent": email_sent,
+            "feishu_sent": feishu_sent,
+            "last_error": "; ".join(errors) or "通道未发送"
+        }
+
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update["status"] = "failed"
+            print(f"❌ 通知 {row['id']} 已重试 {attempts} 次，标记为失败")
+        else:
+            delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+            update["status"] = "pending"
+            update["next_attempt_at"] = (now + timedelta(seconds=delay)).isoformat()
+            print(f"⚠️ 通知 {row['id']} 发送失败，{delay} 秒后重试")
+
+        response = client.patch(f"email_logs?id=eq.{row['id']}", json=update)
+        if response.status_code not in [200, 204]:
+            print(f"❌ 更新发件箱失败: {response.status_code} - {response.text}")
+
+        outcomes[row['id']] = {'success': delivered, 'status': update["status"]}
+
+    # 发送成功的行一次更新
+    if sent_ids:
+        response = client.patch(
+            "email_logs",
+            params={"id": in_filter(sent_ids)},
+            json={
+                "status": "sent",
+                "email_sent": True,
+                "feishu_sent": True,
+                "sent_at": now.isoformat(),
+                "last_error": None
+            }
+        )
+        if response.status_code not in [200, 204]:
+            print(f"❌ 更新发件箱失败: {response.status_code} - {response.text}")
+
+    return outcomes
+
+
+def drain_outbox(client, sender_email, email_password, webhook_url=None, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    分批发送所有到期的待发送通知
+
+    返回:
+        {'sent': 发送成功数, 'retry': 等待重试数, 'failed': 放弃数}
+    """
+    stats = {'sent': 0, 'retry': 0, 'failed': 0}
+
+    while True:
+        rows = claim_rows(client, limit=batch_size)
+        if not rows:
+            break
+
+        for outcome in deliver_rows(client, rows, sender_email, email_password, webhook_url).values():
+            if outcome['status'] == 'sent':
+                stats['sent'] += 1
+            elif outcome['status'] == 'failed':
+                stats['failed'] += 1
+            else:
+                stats['retry'] += 1
+
+        if len(rows) < batch_size:
+            break
+
+    return stats
+
+
+def send_notification(client, user_email, email_type, subject, email_body, feishu_text=None, dedupe_key=None,
+                      sender_email=None, email_password=None, webhook_url=None):
+    """
+    写入发件箱并立即发送这一条（延迟发送模式下只写入）
+
+    发件箱不可用时（例如 email_logs 还没有执行迁移）直接发送。
+
+    返回:
+        {'success': bool, 'duplicate': bool, 'queued': bool}
+    """
+    if client is not None:
+        queued = enqueue_notification(client, user_email, email_type, subject, email_body, feishu_text, dedupe_key)
+    else:
+        queued = {'success': False}
+
+    if not queued['success']:
+        print("⚠️ 发件箱不可用，直接发送")
+        results = dispatch_notification(sender_email, email_password, user_email, subject, email_body,
+                                        webhook_url=webhook_url, feishu_text=feishu_text)
+        return {'success': results['success'], 'duplicate': False, 'queued': False}
+
+    row = queued['row']
+
+    if queued['duplicate']:
+        if row is None or row.get('status') != 'failed':
+            print(f"⏭️ 通知已存在（{dedupe_key}），跳过")
+            return {'success': True, 'duplicate': True, 'queued': False}
+
+        # 之前发送失败过：重跑时重新排队
+        print(f"🔁 通知 {dedupe_key} 之前发送失败，重新发送")
+        client.patch(f"email_logs?id=eq.{row['id']}", json={
+            "status": "pending", "attempts": 0, "next_attempt_at": _now().isoformat()
+        })
+
+    if _deferred:
+        return {'success': True, 'duplicate': False, 'queued': True}
+
+    rows = claim_rows(client, ids=[row['id']])
+    if not rows:
+        # 已被其他发送进程领取
+        return {'success': True, 'duplicate': False, 'queued': True}
+
+    outcome = deliver_rows(client, rows, sender_email, email_password, webhook_url).get(row['id'], {})
+    return {'success': outcome.get('success', False), 'duplicate': False, 'queued': False}
+
+
+def main():
+    print(f"[{datetime.now()}] 开始发送待发通知")
+
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
+    webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
+    supabase_url = os.getenv("SUPABASE_URL", "").strip()
+    supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+
+    if not all([sender_email, email_password, supabase_url, supabase_key]):
+        print("❌ 环境变量未配置完整")
+        return False
+
+    with SupabaseClient(supabase_url, supabase_key) as client:
+        stats = drain_outbox(client, sender_email, email_password, webhook_url)
+
+    print(f"📊 发送成功 {stats['sent']}，等待重试 {stats['retry']}，放弃 {stats['failed']}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
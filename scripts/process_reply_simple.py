@@ -3,11 +3,76 @@
 """
 import os
 import sys
-import requests
 import json
 import re
+import time
 from datetime import datetime
 
+from supabase_client import SupabaseClient, build_query
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
+from outbox import send_notification
+
+# AI 解析提示词版本，修改提示词或返回格式时递增，使旧的缓存结果失效
+PARSE_PROMPT_VERSION = "simple-v1"
+
+def parse_reply_with_ai(reply_content, deepseek_api_key):
+    """
+    使用 AI 解析回复中的任务信息
+    
+    返回:
+        任务信息列表，失败返回 None
+    """
+    # 相同的回复直接使用上次的解析结果
+    llm_cache = get_llm_cache()
+    tasks_data = llm_cache.get('process_reply_simple', PARSE_PROMPT_VERSION, reply_content)
+    if tasks_data is not None:
+        print(f"AI 解析结果（缓存）: {tasks_data}")
+        return tasks_data
+    
+    # 使用 DeepSeek AI 解析回复
+    print("\n使用 AI 解析回复...")
+    started = time.monotonic()
+    
+    prompt = f"""请解析以下任务更新内容，提取任务信息。
+
+用户回复：
+{reply_content}
+
+请以JSON格式返回，包含以下字段：
+- task_name: 任务名称
+- progress: 进度百分比(0-100)
+- quadrant: 象限(Q1/Q2/Q3/Q4)
+- action: 动作(update/pause/complete)
+
+如果有多个任务，返回JSON数组。
+只返回JSON，不要其他内容。"""
+    
+    ai_response = get_llm_client(deepseek_api_key).complete(prompt, temperature=0.7)
+    
+    if ai_response is None:
+        print("❌ AI 解析失败")
+        return None
+    
+    # 清理 markdown 代码块
+    ai_response = re.sub(r'```json\s*', '', ai_response)
+    ai_response = re.sub(r'```\s*$', '', ai_response)
+    ai_response = ai_response.strip()
+    
+    print(f"AI 解析结果: {ai_response}")
+    
+    # 解析 JSON
+    try:
+        tasks_data = json.loads(ai_response)
+        if not isinstance(tasks_data, list):
+            tasks_data = [tasks_data]
+    except:
+        print("❌ 无法解析 AI 返回的 JSON")
+        return None
+    
+    llm_cache.put('process_reply_simple', PARSE_PROMPT_VERSION, reply_content, tasks_data, time.monotonic() - started)
+    return tasks_data
+
 def process_user_reply(reply_content):
     """处理用户回复"""
     print(f"[{datetime.now()}] 开始处理用户回复")
@@ -25,74 +90,14 @@ def process_user_reply(reply_content):
         return False
     
     try:
-        # 使用 DeepSeek AI 解析回复
-        print("\n使用 AI 解析回复...")
-        
-        headers = {
-            "Authorization": f"Bearer {deepseek_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        prompt = f"""请解析以下任务更新内容，提取任务信息。
-
-用户回复：
-{reply_content}
-
-请以JSON格式返回，包含以下字段：
-- task_name: 任务名称
-- progress: 进度百分比(0-100)
-- quadrant: 象限(Q1/Q2/Q3/Q4)
-- action: 动作(update/pause/complete)
-
-如果有多个任务，返回JSON数组。
-只返回JSON，不要其他内容。"""
-        
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
-        
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"❌ AI 解析失败: {response.status_code}")
-            return False
-        
-        result = response.json()
-        ai_response = result['choices'][0]['message']['content'].strip()
-        
-        # 清理 markdown 代码块
-        ai_response = re.sub(r'```json\s*', '', ai_response)
-        ai_response = re.sub(r'```\s*$', '', ai_response)
-        ai_response = ai_response.strip()
-        
-        print(f"AI 解析结果: {ai_response}")
-        
-        # 解析 JSON
-        try:
-            tasks_data = json.loads(ai_response)
-            if not isinstance(tasks_data, list):
-                tasks_data = [tasks_data]
-        except:
-            print("❌ 无法解析 AI 返回的 JSON")
+        tasks_data = parse_reply_with_ai(reply_content, deepseek_api_key)
+        if tasks_data is None:
             return False
         
         # 更新数据库
         print("\n更新数据库...")
         
-        db_headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        client = SupabaseClient(supabase_url, supabase_key)
         
         feedback_content = "📊 任务更新反馈\n\n"
         
@@ -132,9 +137,8 @@ def process_user_reply(reply_content):
                 if action not in ['update', 'pause', 'complete']:
                     action = 'update'
             
-            # 查询任务是否存在
-            query_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&task_name=eq.{task_name}&select=*"
-            query_response = requests.get(query_url, headers=db_headers, timeout=30)
+            # 查询任务是否存在（任务名称是用户输入的文本，由 requests 编码，名称中的 & 等字符不会截断查询）
+            query_response = client.get("tasks", params=build_query("id", user_email=user_email, task_name=task_name))
             
             if query_response.status_code == 200:
                 existing_tasks = query_response.json()
@@ -142,7 +146,6 @@ def process_user_reply(reply_content):
                 if existing_tasks:
                     # 更新现有任务
                     task_id = existing_tasks[0]['id']
-                    update_url = f"{supabase_url}/rest/v1/tasks?id=eq.{task_id}"
                     
                     update_data = {
                         "progress_percentage": progress,
@@ -151,7 +154,7 @@ def process_user_reply(reply_content):
                         "updated_at": datetime.now().isoformat()
                     }
                     
-                    update_response = requests.patch(update_url, headers=db_headers, json=update_data, timeout=30)
+                    update_response = client.patch("tasks", params={"id": f"eq.{task_id}"}, json=update_data)
                     
                     if update_response.status_code in [200, 204]:
                         status_emoji = "✅" if action == "complete" else ("⏸️" if action == "pause" else "🔄")
@@ -166,7 +169,7 @@ def process_user_reply(reply_content):
                         print(f"更新任务失败: {update_response.status_code}")
                 else:
                     # 创建新任务
-                    create_url = f"{supabase_url}/rest/v1/tasks"
+                    create_url = "tasks"
                     
                     create_data = {
                         "user_email": user_email,
@@ -178,7 +181,7 @@ def process_user_reply(reply_content):
                         "updated_at": datetime.now().isoformat()
                     }
                     
-                    create_response = requests.post(create_url, headers=db_headers, json=create_data, timeout=30)
+                    create_response = client.post(create_url, json=create_data)
                     
                     if create_response.status_code in [200, 201]:
                         filled = int(progress / 10)
@@ -193,22 +196,20 @@ def process_user_reply(reply_content):
         
         feedback_content += "💪 继续加油！"
         
-        # 发送反馈到飞书
+        # 发送反馈到飞书（写入发件箱，发送失败时按退避重试）
         if webhook_url:
-            message = {
-                "msg_type": "text",
-                "content": {
-                    "text": feedback_content
-                }
-            }
-            
-            response = requests.post(webhook_url, json=message, timeout=30)
+            results = send_notification(
+                client, user_email, "reply_feedback", "📊 任务更新反馈", None,
+                feishu_text=feedback_content, webhook_url=webhook_url
+            )
             
-            if response.status_code == 200:
+            if results['success']:
                 print("✅ 反馈已发送到飞书")
             else:
-                print(f"❌ 发送飞书消息失败: {response.status_code}")
+                print("❌ 发送飞书消息失败")
         
+        print(get_llm_cache().format_stats())
+        print(get_llm_client(deepseek_api_key).format_stats())
         print("\n✅ 用户回复处理完成")
         return True
         
@@ -0,0 +1,197 @@
+"""
+Supabase REST 客户端
+使用 requests.Session 复用 keep-alive 连接池，并在网络抖动时自动重试
+"""
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 连接池与重试配置（可通过环境变量覆盖）
+DEFAULT_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "10"))
+DEFAULT_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", "3"))
+DEFAULT_BACKOFF_FACTOR = float(os.getenv("SUPABASE_BACKOFF_FACTOR", "0.5"))
+DEFAULT_TIMEOUT = 30
+
+# 只对幂等方法按状态码重试；POST 仅在连接建立失败时重试（请求尚未发出）
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(["GET", "HEAD", "PATCH", "PUT", "DELETE", "OPTIONS"])
+
+# 分页查询默认每页行数（Supabase 默认 max-rows 为 1000）
+DEFAULT_PAGE_SIZE = 1000
+
+
+def in_filter(values):
+    """
+    生成 PostgREST in 过滤条件，例如 ['a@x.com', 'b@x.com'] → in.("a@x.com","b@x.com")
+
+    值统一加双引号，避免邮箱中的 '.'、'@' 等字符被误解析
+    """
+    quoted = []
+    for value in values:
+        text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        quoted.append(f'"{text}"')
+    return f"in.({','.join(quoted)})"
+
+
+class PostgrestFilter(str):
+    """已经拼好运算符的过滤条件（例如 gte.2024-01-01），build_query() 原样使用"""
+
+
+def op_filter(operator, value):
+    """
+    生成带运算符的过滤条件，例如 op_filter('gte', '2024-01-01') → gte.2024-01-01
+
+    参数:
+        operator: PostgREST 运算符（gt / gte / lt / lte / neq / like / is ...）
+        value: 比较值
+    """
+    if isinstance(value, bool):
+        value = str(value).lower()
+    return PostgrestFilter(f"{operator}.{value}")
+
+
+def build_query(columns="*", order=None, limit=None, **filters):
+    """
+    生成 PostgREST 查询参数，交给 SupabaseClient.get(path, params=...) 由 requests 做 URL 编码
+
+    过滤值按类型转换，不需要手动拼接 eq. 前缀：
+        普通值 → eq.值；True / False → eq.true / eq.false；None → is.null
+        list / tuple / set → in.(...)（同 in_filter()）；op_filter() 的结果原样使用
+
+    参数:
+        columns: 需要返回的列（列名序列或逗号分隔的字符串）
+        order: 排序，例如 "quadrant.asc,task_order.asc"
+        limit: 最多返回的行数
+        filters: 列名=过滤值
+
+    返回:
+        params 字典
+    """
+    params = {"select": columns if isinstance(columns, str) else ",".join(columns)}
+
+    for column, value in filters.items():
+        if isinstance(value, PostgrestFilter):
+            params[column] = value
+        elif value is None:
+            params[column] = "is.null"
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            params[column] = in_filter(value)
+        else:
+            params[column] = op_filter("eq", value)
+
+    if order:
+        params["order"] = order
+    if limit is not None:
+        params["limit"] = str(limit)
+
+    return params
+
+
+class SupabaseClient:
+    """
+    Supabase PostgREST 客户端，一次运行共享一个实例
+
+    参数:
+        supabase_url: Supabase URL
+        supabase_key: service_role key
+        pool_size: 连接池大小
+        max_retries: 最大重试次数
+        backoff_factor: 指数退避系数（秒）
+        timeout: 默认请求超时（秒）
+    """
+
+    def __init__(self, supabase_url, supabase_key, pool_size=DEFAULT_POOL_SIZE,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 timeout=DEFAULT_TIMEOUT):
+        self.supabase_url = supabase_url.rstrip('/')
+        self.rest_url = f"{self.supabase_url}/rest/v1"
+        self.timeout = timeout
+        # 可选：单次运行的用户游戏化数据缓存（gamification_utils.UserGamificationCache）
+        self.gamification_cache = None
+        self.headers = {
+            "apikey": supabase_key,
+            "Authorization": f"Bearer {supabase_key}",
+            "Content-Type": "application/json"
+        }
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=RETRY_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        """拼接 REST 路径，例如 'tasks?id=eq.1' → https://xxx.supabase.co/rest/v1/tasks?id=eq.1"""
+        return f"{self.rest_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, params=None, json=None, headers=None, timeout=None):
+        """发送请求，headers 会与默认请求头合并"""
+        return self.session.request(
+            method,
+            self.url(path),
+            params=params,
+            json=json,
+            headers=headers,
+            timeout=timeout or self.timeout
+        )
+
+    def get(self, path, params=None, headers=None, timeout=None):
+        return self.request("GET", path, params=params, headers=headers, timeout=timeout)
+
+    def post(self, path, json=None, params=None, headers=None, timeout=None):
+        return self.request("POST", path, params=params, json=json, headers=headers, timeout=timeout)
+
+    def patch(self, path, json=None, params=None, headers=None, timeout=None):
+        return self.request("PATCH", path, params=params, json=json, headers=headers, timeout=timeout)
+
+    def delete(self, path, params=None, headers=None, timeout=None):
+        return self.request("DELETE", path, params=params, headers=headers, timeout=timeout)
+
+    def get_all(self, path, params=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        按 limit/offset 分页读取全部结果（params 中应包含稳定的 order）
+
+        返回:
+            行列表，任一页查询失败返回 None
+        """
+        rows = []
+        offset = 0
+
+        while True:
+            page_params = dict(params or {})
+            page_params["limit"] = page_size
+            page_params["offset"] = offset
+
+            response = self.get(path, params=page_params)
+            if response.status_code != 200:
+                print(f"❌ 分页查询 {path} 失败: {response.status_code} - {response.text}")
+                return None
+
+            page = response.json()
+            rows.extend(page)
+
+            if len(page) < page_size:
+                return rows
+            offset += page_size
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,168 @@
+"""
+任务数据模型
+查询到的任务行只解析一次，转成 __slots__ 对象，并预先建立按状态、象限、编号的索引，
+供每日复盘、周报、月报等渲染和统计共用
+
+    - Task 只保留 tasks 表的列，select=* 返回的多余字段直接丢弃
+    - user_email / status 等重复出现的字符串做驻留，fanout.py 批量加载上万个任务时内存占用更低
+    - Task 同时支持 task['列名'] 和 task.get('列名')，可以直接传给原来接受字典的函数
+
+用法:
+    task_set = TaskSet.from_rows(response.json())
+    task_set.in_quadrant(1)              # Q1 活跃任务，按 task_order 升序
+    task_set.count('paused')             # 暂缓任务数
+    task_set.quadrant_counts('completed')  # {1: ..., 2: ..., 3: ..., 4: ...}
+    TaskSet.group_by_user(rows)          # {user_email: TaskSet}
+
+查询时用各视图对应的列集合（见下方 *_COLUMNS）代替 select=*:
+    client.get("tasks", params=build_query(REPORT_COLUMNS, user_email=user_email, status="paused"))
+"""
+import sys
+
+QUADRANTS = (1, 2, 3, 4)
+
+# 各视图需要的列（PostgREST select）
+# 每日复盘：清单渲染、暂缓任务提醒筛选、批量预取时按用户分组
+DAILY_REVIEW_COLUMNS = (
+    'id', 'user_email', 'task_name', 'quadrant', 'status', 'task_order',
+    'progress_percentage', 'is_deleted', 'last_reminded_date'
+)
+# 每日跟进：逐条展示任务
+TASK_LIST_COLUMNS = ('task_name', 'quadrant', 'status', 'task_order', 'progress_percentage')
+# 每周暂缓任务检查：逐条展示 + 暂缓天数
+PAUSED_CHECK_COLUMNS = TASK_LIST_COLUMNS + ('updated_at',)
+# 周报 / 月报：只统计状态和象限
+REPORT_COLUMNS = ('id', 'quadrant', 'status')
+
+
+class Task:
+    """tasks 表的一行"""
+
+    __slots__ = (
+        'id', 'user_email', 'task_name', 'quadrant', 'status', 'task_order', 'display_number',
+        'progress_percentage', 'is_deleted', 'deleted_at', 'created_at', 'updated_at',
+        'last_progress_update', 'last_reminded_date', 'stalled_days'
+    )
+
+    # 取值时缺失列的默认值（与 PostgREST 行中对应列为 null 时的处理一致）
+    DEFAULTS = {'quadrant': 1, 'progress_percentage': 0, 'task_order': 0, 'is_deleted': False}
+
+    # 重复出现的短字符串，驻留后同一个值只保存一份
+    _INTERNED = ('user_email', 'status', 'display_number')
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            value = columns.get(name)
+            if value is None:
+                value = self.DEFAULTS.get(name)
+            elif name in self._INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        """由 PostgREST 返回的字典创建"""
+        return cls(**row)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Task({self.display_number or self.task_order} {self.task_name!r}, {self.status})"
+
+
+class TaskSet:
+    """
+    一组任务及其索引（建立后只读）
+
+    参数:
+        tasks: Task 列表
+    """
+
+    __slots__ = ('tasks', '_by_id', '_by_status', '_by_quadrant', '_by_order')
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self._by_id = {}
+        self._by_status = {}
+        self._by_quadrant = {}
+        self._by_order = {}
+
+        for task in sorted(tasks, key=lambda task: (task.quadrant, task.task_order)):
+            self._by_id[task.id] = task
+            self._by_status.setdefault(task.status, []).append(task)
+            self._by_quadrant.setdefault((task.status, task.quadrant), []).append(task)
+            # 暂缓任务的编号不分象限
+            quadrant = None if task.status == 'paused' else task.quadrant
+            self._by_order[(task.status, quadrant, task.task_order)] = task
+
+        # 暂缓池按 task_order 统一排序
+        if 'paused' in self._by_status:
+            self._by_status['paused'].sort(key=lambda task: task.task_order)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由 PostgREST 返回的行列表创建"""
+        return cls([Task.from_row(row) for row in rows or []])
+
+    @classmethod
+    def group_by_user(cls, rows):
+        """
+        把多个用户的任务行按 user_email 分组
+
+        返回:
+            {user_email: TaskSet}（只包含有任务的用户）
+        """
+        grouped = {}
+        for row in rows or []:
+            task = Task.from_row(row)
+            grouped.setdefault(task.user_email, []).append(task)
+        return {user_email: cls(tasks) for user_email, tasks in grouped.items()}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def get(self, task_id):
+        """按 id 查找任务，不存在返回 None"""
+        return self._by_id.get(task_id)
+
+    def with_status(self, status):
+        """指定状态的任务列表（活跃任务按象限、task_order 排序，暂缓任务按 task_order 排序）"""
+        return list(self._by_status.get(status, ()))
+
+    def in_quadrant(self, quadrant, status='active'):
+        """指定象限、状态的任务列表，按 task_order 升序"""
+        return list(self._by_quadrant.get((status, quadrant), ()))
+
+    def at_order(self, task_order, quadrant=None, status='active'):
+        """按存储的 task_order 查找任务（暂缓任务不传 quadrant），不存在返回 None"""
+        if status == 'paused':
+            quadrant = None
+        return self._by_order.get((status, quadrant, task_order))
+
+    def count(self, status=None, quadrant=None):
+        """任务数，可按状态和象限筛选"""
+        if status is None:
+            if quadrant is None:
+                return len(self.tasks)
+            return sum(len(tasks) for (_, q), tasks in self._by_quadrant.items() if q == quadrant)
+        if quadrant is None:
+            return len(self._by_status.get(status, ()))
+        return len(self._by_quadrant.get((status, quadrant), ()))
+
+    def quadrant_counts(self, status='active'):
+        """{1: ..., 2: ..., 3: ..., 4: ...}，指定状态的各象限任务数"""
+        return {quadrant: self.count(status, quadrant) for quadrant in QUADRANTS}
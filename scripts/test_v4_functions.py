@@ -30,6 +30,7 @@ from gamification_utils import (
     pause_task,
     resume_paused_task
 )
+from supabase_client import SupabaseClient
 
 def test_v4_functions():
     """测试 v4.0 核心函数"""
@@ -46,11 +47,7 @@ def test_v4_functions():
         print("❌ 环境变量未配置完整")
         return False
     
-    headers = {
-        "apikey": supabase_key,
-        "Authorization": f"Bearer {supabase_key}",
-        "Content-Type": "application/json"
-    }
+    client = SupabaseClient(supabase_url, supabase_key)
     
     print(f"\n测试用户: {user_email}")
     print(f"Supabase URL: {supabase_url}")
@@ -60,7 +57,7 @@ def test_v4_functions():
     print("测试1: get_max_task_order()")
     print("=" * 60)
     try:
-        max_order = get_max_task_order(supabase_url, headers, user_email, 1)
+        max_order = get_max_task_order(client, user_email, 1)
         print(f"✅ Q1象限最大编号: {max_order}")
     except Exception as e:
         print(f"❌ 失败: {e}")
@@ -72,7 +69,7 @@ def test_v4_functions():
     print("=" * 60)
     try:
         if max_order > 0:
-            task = find_task(supabase_url, headers, user_email, 1, 1)
+            task = find_task(client, user_email, 1, 1)
             if task:
                 print(f"✅ 找到任务: {task.get('task_name', 'N/A')}")
                 print(f"   编号: Q1-{task.get('task_order', 'N/A')}")
@@ -90,7 +87,7 @@ def test_v4_functions():
     print("测试3: get_paused_tasks_to_remind()")
     print("=" * 60)
     try:
-        paused_tasks = get_paused_tasks_to_remind(supabase_url, headers, user_email)
+        paused_tasks = get_paused_tasks_to_remind(client, user_email)
         print(f"✅ 需要提醒的暂缓任务数: {len(paused_tasks)}")
         for task in paused_tasks[:3]:  # 只显示前3个
             print(f"   - {task.get('task_name', 'N/A')} (编号: {task.get('task_order', 'N/A')})")
@@ -104,7 +101,7 @@ def test_v4_functions():
     print("=" * 60)
     test_task_name = f"v4.0测试任务_{datetime.now().strftime('%H%M%S')}"
     try:
-        result = create_task(supabase_url, headers, user_email, test_task_name, 4)
+        result = create_task(client, user_email, test_task_name, 4)
         if result.get('success'):
             print(f"✅ 创建成功: {result.get('display_number', 'N/A')}")
             test_task_number = result.get('task_order')
@@ -120,7 +117,7 @@ def test_v4_functions():
     print("测试5: update_task_progress()")
     print("=" * 60)
     try:
-        result = update_task_progress(supabase_url, headers, user_email, 4, test_task_number, 50)
+        result = update_task_progress(client, user_email, 4, test_task_number, 50)
         if result.get('success'):
             print(f"✅ 更新成功")
             print(f"   进度: {result.get('new_progress', 0)}%")
@@ -137,7 +134,7 @@ def test_v4_functions():
     print("测试6: pause_task()")
     print("=" * 60)
     try:
-        result = pause_task(supabase_url, headers, user_email, 4, test_task_number)
+        result = pause_task(client, user_email, 4, test_task_number)
         if result.get('success'):
             print(f"✅ 暂缓成功")
             print(f"   任务: {result.get('task_name', 'N/A')}")
@@ -154,10 +151,10 @@ def test_v4_functions():
     print("=" * 60)
     try:
         # 获取最新的暂缓任务编号
-        paused_tasks = get_paused_tasks_to_remind(supabase_url, headers, user_email)
+        paused_tasks = get_paused_tasks_to_remind(client, user_email)
         if paused_tasks:
             paused_task_number = paused_tasks[-1].get('task_order')  # 最后一个应该是我们刚暂缓的
-            task = find_paused_task(supabase_url, headers, user_email, paused_task_number)
+            task = find_paused_task(client, user_email, paused_task_number)
             if task:
                 print(f"✅ 找到暂缓任务: {task.get('task_name', 'N/A')}")
             else:
@@ -175,7 +172,7 @@ def test_v4_functions():
     try:
         if paused_tasks:
             paused_task_number = paused_tasks[-1].get('task_order')
-            result = resume_paused_task(supabase_url, headers, user_email, paused_task_number, 4)
+            result = resume_paused_task(client, user_email, paused_task_number, 4)
             if result.get('success'):
                 print(f"✅ 恢复成功")
                 print(f"   新编号: {result.get('new_display_number', 'N/A')}")
@@ -195,7 +192,7 @@ def test_v4_functions():
     print("测试9: complete_task() - 清理测试数据")
     print("=" * 60)
     try:
-        result = complete_task(supabase_url, headers, user_email, 4, resumed_task_number)
+        result = complete_task(client, user_email, 4, resumed_task_number)
         if result.get('success'):
             print(f"✅ 完成成功（测试任务已清理）")
             print(f"   经验值: +{result.get('exp_gain', 0)} EXP")
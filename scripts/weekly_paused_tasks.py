@@ -4,37 +4,50 @@
 """
 import os
 import sys
-import requests
 from datetime import datetime
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def send_weekly_paused_tasks_reminder():
-    """发送每周暂缓任务提醒"""
+from supabase_client import SupabaseClient, build_query
+from task_models import PAUSED_CHECK_COLUMNS
+from outbox import send_notification
+
+def send_weekly_paused_tasks_reminder(user_email=None, client=None):
+    """
+    发送每周暂缓任务提醒
+    
+    参数:
+        user_email: 收件用户邮箱，默认为 EMAIL_163_USERNAME（单用户部署）
+        client: 可选，共享的 SupabaseClient（fanout.py 多用户批量运行时传入）
+    """
     print(f"[{datetime.now()}] 开始发送每周暂缓任务提醒")
     
     # 获取环境变量
     webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    user_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
     email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    user_email = user_email or sender_email
+    
+    # 飞书 Webhook 属于部署者本人，批量运行时只推送部署者自己的消息
+    if user_email != sender_email:
+        webhook_url = ""
     
-    if not all([webhook_url, user_email, email_password, supabase_url, supabase_key]):
+    if not all([sender_email, email_password, supabase_url, supabase_key]):
         print("❌ 环境变量未配置完整")
         return False
     
     try:
-        headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if client is None:
+            client = SupabaseClient(supabase_url, supabase_key)
         
         # 获取暂缓的任务
-        query_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.paused&select=*"
-        db_response = requests.get(query_url, headers=headers, timeout=30)
+        db_response = client.get(
+            "tasks",
+            params=build_query(PAUSED_CHECK_COLUMNS, user_email=user_email, status="paused")
+        )
         
         if db_response.status_code != 200:
             print(f"❌ 数据库查询失败: {db_response.status_code}")
@@ -84,54 +97,19 @@ def send_weekly_paused_tasks_reminder():
         content += "3. 有没有任务可以直接放弃？\n"
         content += "\n示例：重新开始数据库设计，继续暂缓API开发"
         
-        # 发送到飞书
-        message = {
-            "msg_type": "text",
-            "content": {
-                "text": content
-            }
-        }
+        # 飞书和邮件并发发送
+        print("发送暂缓任务提醒...")
         
-        feishu_success = False
-        response = requests.post(webhook_url, json=message, timeout=30)
+        email_body = f"{content}\n\n---\n请直接回复此邮件更新暂缓任务状态"
         
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("StatusCode") == 0:
-                print("✅ 飞书消息发送成功")
-                feishu_success = True
-            else:
-                print(f"❌ 飞书返回错误: {result}")
-        else:
-            print(f"❌ 飞书HTTP请求失败: {response.status_code}")
-        
-        # 发送邮件
-        try:
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            
-            print("发送邮件...")
-            
-            msg = MIMEMultipart()
-            msg['From'] = user_email
-            msg['To'] = user_email
-            msg['Subject'] = "📋 每周暂缓任务检查"
-            
-            email_body = f"{content}\n\n---\n请直接回复此邮件更新暂缓任务状态"
-            msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
-            
-            server = smtplib.SMTP_SSL("smtp.163.com", 465)
-            server.login(user_email, email_password)
-            server.send_message(msg)
-            server.quit()
-            
-            print("✅ 邮件发送成功")
-            return True
-            
-        except Exception as e:
-            print(f"❌ 邮件发送失败: {e}")
-            return feishu_success
+        # 写入发件箱后发送；同一周期重复运行时不会重复发送
+        results = send_notification(
+            client, user_email, "weekly_paused_tasks", "📋 每周暂缓任务检查", email_body,
+            feishu_text=content if webhook_url else None,
+            dedupe_key=f"weekly_paused_tasks:{user_email}:{datetime.now().strftime('%G-W%V')}",
+            sender_email=sender_email, email_password=email_password, webhook_url=webhook_url
+        )
+        return results['success']
             
     except Exception as e:
         print(f"❌ 发送失败: {e}")
@@ -4,13 +4,15 @@ v2.0 - 故事叙述风格 + ASCII图表可视化
 """
 import os
 import sys
-import requests
 from datetime import datetime, timedelta
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from gamification_utils import get_user_gamification_data
+from supabase_client import SupabaseClient, build_query, op_filter
+from task_models import TaskSet, REPORT_COLUMNS
+from outbox import send_notification
 
 def generate_ascii_bar_chart(data, max_width=20):
     """生成ASCII柱状图"""
@@ -132,124 +134,87 @@ def generate_story_narrative(stats, user_data):
     
     return story
 
-def send_weekly_report():
-    """发送周报"""
+def send_weekly_report(user_email=None, client=None):
+    """
+    发送周报
+    
+    参数:
+        user_email: 收件用户邮箱，默认为 EMAIL_163_USERNAME（单用户部署）
+        client: 可选，共享的 SupabaseClient（fanout.py 多用户批量运行时传入）
+    """
     print(f"[{datetime.now()}] 开始生成周报")
     
     # 获取环境变量
     webhook_url = os.getenv("FEISHU_WEBHOOK_URL", "").strip()
-    user_email = os.getenv("EMAIL_163_USERNAME", "").strip()
+    sender_email = os.getenv("EMAIL_163_USERNAME", "").strip()
     email_password = os.getenv("EMAIL_163_PASSWORD", "").strip()
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_key = os.getenv("SUPABASE_KEY", "").strip()
+    user_email = user_email or sender_email
+    
+    # 飞书 Webhook 属于部署者本人，批量运行时只推送部署者自己的消息
+    if user_email != sender_email:
+        webhook_url = ""
     
     try:
-        headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
-            "Content-Type": "application/json"
-        }
+        if client is None:
+            client = SupabaseClient(supabase_url, supabase_key)
         
         # 获取本周数据（过去7天）
         week_ago = (datetime.now() - timedelta(days=7)).isoformat()
         
         # 查询本周完成的任务
-        completed_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.completed&is_deleted=eq.true&updated_at=gte.{week_ago}&select=*"
-        completed_response = requests.get(completed_url, headers=headers, timeout=30)
-        
-        # 查询进行中的任务
-        active_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.active&is_deleted=eq.false&select=*"
-        active_response = requests.get(active_url, headers=headers, timeout=30)
+        completed_response = client.get("tasks", params=build_query(
+            REPORT_COLUMNS, user_email=user_email, status="completed", is_deleted=True,
+            updated_at=op_filter("gte", week_ago)
+        ))
         
-        # 查询暂缓任务
-        paused_url = f"{supabase_url}/rest/v1/tasks?user_email=eq.{user_email}&status=eq.paused&is_deleted=eq.false&select=*"
-        paused_response = requests.get(paused_url, headers=headers, timeout=30)
+        # 查询进行中和暂缓的任务
+        current_response = client.get("tasks", params=build_query(
+            REPORT_COLUMNS, user_email=user_email, status=["active", "paused"], is_deleted=False
+        ))
         
-        if completed_response.status_code != 200 or active_response.status_code != 200 or paused_response.status_code != 200:
+        if completed_response.status_code != 200 or current_response.status_code != 200:
             print(f"❌ 数据库查询失败")
             return False
         
-        completed_tasks = completed_response.json()
-        active_tasks = active_response.json()
-        paused_tasks = paused_response.json()
+        completed_tasks = TaskSet.from_rows(completed_response.json())
+        current_tasks = TaskSet.from_rows(current_response.json())
         
         # 计算统计数据
-        total_tasks = len(completed_tasks) + len(active_tasks)
-        completion_rate = (len(completed_tasks) / total_tasks * 100) if total_tasks > 0 else 0
-        
-        # 按象限统计
-        quadrant_stats = {1: 0, 2: 0, 3: 0, 4: 0}
-        for task in completed_tasks:
-            q = task.get('quadrant', 1)
-            quadrant_stats[q] = quadrant_stats.get(q, 0) + 1
+        completed_count = completed_tasks.count('completed')
+        active_count = current_tasks.count('active')
+        total_tasks = completed_count + active_count
+        completion_rate = (completed_count / total_tasks * 100) if total_tasks > 0 else 0
         
         # 获取用户游戏化数据
-        user_data = get_user_gamification_data(supabase_url, headers, user_email)
+        user_data = get_user_gamification_data(client, user_email)
         
         # 构建统计数据
         stats = {
-            'completed_count': len(completed_tasks),
-            'active_count': len(active_tasks),
-            'paused_count': len(paused_tasks),
+            'completed_count': completed_count,
+            'active_count': active_count,
+            'paused_count': current_tasks.count('paused'),
             'completion_rate': completion_rate,
-            'quadrant_stats': quadrant_stats
+            'quadrant_stats': completed_tasks.quadrant_counts('completed')
         }
         
         # 生成故事叙述
         content = generate_story_narrative(stats, user_data)
         
-        # 发送到飞书
-        feishu_success = False
-        if webhook_url:
-            message = {
-                "msg_type": "text",
-                "content": {
-                    "text": f"📊 每周报告\n\n{content}"
-                }
-            }
-            
-            response = requests.post(webhook_url, json=message, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("StatusCode") == 0:
-                    print("✅ 飞书周报发送成功")
-                    feishu_success = True
-                else:
-                    print(f"❌ 飞书返回错误: {result}")
-            else:
-                print(f"❌ 飞书HTTP请求失败: {response.status_code}")
+        # 飞书和邮件并发发送（没有配置邮箱授权码时只发飞书）
+        print("发送周报...")
         
-        # 发送邮件
-        if email_password:
-            try:
-                import smtplib
-                from email.mime.text import MIMEText
-                from email.mime.multipart import MIMEMultipart
-                
-                print("发送周报邮件...")
-                
-                msg = MIMEMultipart()
-                msg['From'] = user_email
-                msg['To'] = user_email
-                msg['Subject'] = "📊 每周成长报告"
-                
-                email_body = f"每周报告\n\n{content}\n\n---\n本周报告由AI邮件教练自动生成"
-                msg.attach(MIMEText(email_body, 'plain', 'utf-8'))
-                
-                server = smtplib.SMTP_SSL("smtp.163.com", 465)
-                server.login(user_email, email_password)
-                server.send_message(msg)
-                server.quit()
-                
-                print("✅ 周报邮件发送成功")
-                return True
-                
-            except Exception as e:
-                print(f"❌ 邮件发送失败: {e}")
-                return feishu_success
+        email_body = f"每周报告\n\n{content}\n\n---\n本周报告由AI邮件教练自动生成"
         
-        return feishu_success
+        # 写入发件箱后发送；同一周期重复运行时不会重复发送
+        results = send_notification(
+            client, user_email, "weekly_report", "📊 每周成长报告", email_body if email_password else None,
+            feishu_text=f"📊 每周报告\n\n{content}" if webhook_url else None,
+            dedupe_key=f"weekly_report:{user_email}:{datetime.now().strftime('%G-W%V')}",
+            sender_email=sender_email, email_password=email_password, webhook_url=webhook_url
+        )
+        return results['success']
                 
     except Exception as e:
         print(f"❌ 生成周报失败: {e}")
@@ -0,0 +1,148 @@
+"""
+测试公共配置
+    python -m pytest tests
+
+scripts/ 下的模块按脚本方式互相导入，这里把 scripts/ 加入 sys.path
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 测试中不读写本地 AI 解析缓存
+os.environ["LLM_CACHE_PATH"] = ""
+
+from fake_postgrest import FakePostgrest  # noqa: E402
+from supabase_client import SupabaseClient  # noqa: E402
+
+
+@pytest.fixture
+def postgrest():
+    with FakePostgrest() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(postgrest):
+    client = SupabaseClient(postgrest.url, "test-key", max_retries=0)
+    yield client
+    client.session.close()
+
+
+MAILBOX = 'coach@163.com'
+
+
+@pytest.fixture
+def pop3_sweep(postgrest, client, monkeypatch):
+    """运行一次 check_and_process_email_reply()（POP3 换成 FakePOP3，process_reply 只记录内容）"""
+    import check_email_reply
+    from fake_mail import FakePOP3
+
+    for name in ['EMAIL_163_USERNAME', 'EMAIL_163_PASSWORD', 'SUPABASE_URL', 'SUPABASE_KEY', 'DEEPSEEK_API_KEY']:
+        monkeypatch.setenv(name, MAILBOX if name == 'EMAIL_163_USERNAME' else 'x')
+    monkeypatch.setattr(check_email_reply, 'SupabaseClient', lambda url, key: client)
+    monkeypatch.setattr(check_email_reply, 'parse_task_operations_batch', lambda replies, key: {})
+    monkeypatch.setattr(check_email_reply, 'send_no_reply_reminder', lambda *args: None)
+
+    processed = []
+
+    def process_reply(client, content, *args, operations=None):
+        processed.append(content)
+        run.operations.append(operations)
+        return True
+
+    monkeypatch.setattr(check_email_reply, 'process_reply', process_reply)
+
+    def run(messages):
+        """返回本次处理的回复内容；传给 process_reply 的 operations 记录在 run.operations"""
+        processed.clear()
+        run.operations = []
+        monkeypatch.setattr(check_email_reply.poplib, 'POP3_SSL', FakePOP3(messages))
+        assert check_email_reply.check_and_process_email_reply()
+        return list(processed)
+
+    return run
+
+
+@pytest.fixture(autouse=True)
+def reset_missing_rpcs():
+    """每个测试重新探测数据库函数是否部署"""
+    import gamification_utils
+    gamification_utils._MISSING_GAMIFICATION_RPCS.clear()
+    yield
+    gamification_utils._MISSING_GAMIFICATION_RPCS.clear()
+
+
+# database_setup.sql 之后 v4 增加的任务列（线上通过 Supabase 控制台迁移，仓库内没有单独的迁移脚本）
+V4_TASK_COLUMNS = """
+ALTER TABLE tasks
+    ADD COLUMN IF NOT EXISTS task_order INTEGER,
+    ADD COLUMN IF NOT EXISTS display_number TEXT,
+    ADD COLUMN IF NOT EXISTS is_deleted BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS last_progress_update DATE,
+    ADD COLUMN IF NOT EXISTS last_reminded_date DATE;
+ALTER TABLE tasks DROP CONSTRAINT IF EXISTS tasks_status_check;
+ALTER TABLE tasks ADD CONSTRAINT tasks_status_check
+    CHECK (status IN ('active', 'paused', 'completed', 'backlog'));
+"""
+
+
+@pytest.fixture(scope="session")
+def pg_connection():
+    """
+    本地 Postgres（例如 pgserver 或 docker postgres），通过 TEST_DATABASE_URL 指定
+        TEST_DATABASE_URL=postgresql://postgres@/postgres?host=/tmp/pgdata python -m pytest tests
+
+    在独立的 schema 中加载 database_setup.sql 和 gamification_setup.sql，测试结束后删除
+    未设置 TEST_DATABASE_URL 或未安装 psycopg2 时跳过
+    """
+    psycopg2 = pytest.importorskip("psycopg2")
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("未设置 TEST_DATABASE_URL")
+
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    schema = f"ai_email_coach_test_{os.getpid()}"
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}, public")
+        for name in ("database_setup.sql", "gamification_setup.sql"):
+            with open(os.path.join(ROOT, name), encoding="utf-8") as f:
+                cur.execute(f.read())
+        cur.execute(V4_TASK_COLUMNS)
+
+    yield conn
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.close()
+
+
+@pytest.fixture
+def pg(pg_connection):
+    """清空测试数据的游标"""
+    with pg_connection.cursor() as cur:
+        cur.execute("TRUNCATE tasks, user_gamification, exp_history, punishment_history CASCADE")
+        yield cur
+
+
+def pg_rpc(cur, function_name):
+    """把 FakePostgrest 的 rpc/<函数> 转发到本地 Postgres 中的同名函数"""
+    from psycopg2.extras import Json
+
+    def call(body):
+        args = ", ".join(f"{key} => %({key})s" for key in body)
+        params = {key: Json(value) if isinstance(value, (dict, list)) else value
+                  for key, value in body.items()}
+        cur.execute(f"SELECT {function_name}({args})", params)
+        return cur.fetchone()[0]
+
+    return call
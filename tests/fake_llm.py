@@ -0,0 +1,101 @@
+"""
+本地 DeepSeek Chat Completions 模拟服务（测试用）
+在本地端口上提供 /v1/chat/completions，DeepSeekClient 走真实的 HTTP 请求
+
+    with FakeDeepSeek() as fake:
+        fake.failures = [(429, {'Retry-After': '2'}), (503, {})]   # 依次先返回这些失败
+        fake.delay = 0.2                                           # 每个请求的处理时间
+        client = DeepSeekClient("key", base_url=fake.url)
+
+成功时回复内容为 "echo: <最后一条消息>"；请求带 stream=true 时按 SSE 分段返回
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeDeepSeek:
+
+    def __init__(self):
+        self.failures = []
+        self.delay = 0
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(_Handler):
+            pass
+        Handler.fake = fake
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        fake = self.fake
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        with fake.lock:
+            fake.requests.append(payload)
+            fake.active += 1
+            fake.max_active = max(fake.max_active, fake.active)
+            failure = fake.failures.pop(0) if fake.failures else None
+
+        try:
+            if fake.delay:
+                # 不用 time.sleep：测试会替换 llm_client.time.sleep 来记录退避时间
+                threading.Event().wait(fake.delay)
+            if failure:
+                status, headers = failure
+                return self._send(status, {"error": {"message": "injected"}}, headers)
+
+            text = "echo: " + payload['messages'][-1]['content']
+            usage = {"prompt_tokens": 10, "completion_tokens": len(text), "total_tokens": 10 + len(text)}
+
+            if not payload.get('stream'):
+                return self._send(200, {"choices": [{"message": {"role": "assistant", "content": text}}],
+                                        "usage": usage})
+
+            # SSE：每两个字一段，最后一段带 usage，中间夹一行注释
+            events = [": keep-alive"]
+            for start in range(0, len(text), 2):
+                chunk = {"choices": [{"delta": {"content": text[start:start + 2]}}]}
+                events.append("data: " + json.dumps(chunk, ensure_ascii=False))
+            events.append("data: " + json.dumps({"choices": [], "usage": usage}))
+            events.append("data: [DONE]")
+            self._send(200, ("\n\n".join(events) + "\n\n").encode(), content_type="text/event-stream")
+        finally:
+            with fake.lock:
+                fake.active -= 1
@@ -0,0 +1,251 @@
+"""
+本地邮箱替身（测试用）
+    - FakePOP3: 内存中的 POP3 连接，替换 poplib.POP3_SSL
+    - FakeIMAPServer: 本地端口上的最小 IMAP4rev1 服务（LOGIN / ID / SELECT / UID SEARCH / UID FETCH / IDLE），
+      imaplib 走真实的网络连接
+    - FakeSMTPServer: 本地端口上的调试 SMTP 服务（不需要 AUTH），可以模拟拒绝连接、发送后断开
+"""
+import re
+import socketserver
+import threading
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+
+
+def make_message(subject, body, message_id=None):
+    """生成一封 CRLF 换行的邮件"""
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = 'user@example.com'
+    msg['Date'] = format_datetime(datetime.now(timezone.utc))
+    msg['Message-ID'] = message_id or make_msgid(domain='example.com')
+    msg.set_content(body)
+    return msg.as_bytes().replace(b'\n', b'\r\n')
+
+
+class FakePOP3:
+    """内存中的 POP3 邮箱（只实现 check_and_process_email_reply 用到的命令）"""
+
+    def __init__(self, messages):
+        self.messages = messages   # [(uid, bytes)]
+
+    def __call__(self, host, port):
+        return self
+
+    def user(self, name):
+        pass
+
+    def pass_(self, password):
+        pass
+
+    def list(self):
+        return b'+OK', [f'{i} {len(m)}'.encode() for i, (_, m) in enumerate(self.messages, 1)], 0
+
+    def uidl(self):
+        return b'+OK', [f'{i} {uid}'.encode() for i, (uid, _) in enumerate(self.messages, 1)], 0
+
+    def _lines(self, index):
+        return self.messages[index - 1][1].split(b'\r\n')
+
+    def top(self, index, count):
+        lines = self._lines(index)
+        return b'+OK', lines[:lines.index(b'')], 0
+
+    def retr(self, index):
+        return b'+OK', self._lines(index), 0
+
+    def quit(self):
+        pass
+
+
+class FakeIMAPServer:
+    """
+    用法:
+        with FakeIMAPServer() as server:
+            server.messages.append(make_message(...))      # UID 从 1 开始递增
+            server.arrive_during_idle.append(make_message(...))  # 下一次 IDLE 时到达，并推送 EXISTS
+            server.idle_in_one_write = True      # 「+ idling」和 EXISTS 在同一次写入中发送
+    """
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.arrive_during_idle = []
+        self.idle_in_one_write = False
+        self.commands = []
+        self.server = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(_IMAPHandler):
+            pass
+        Handler.fake = fake
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    fake = None
+
+    def _write(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode())
+
+    def handle(self):
+        self._write("* OK fake IMAP4rev1 ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command, args = (line.decode().rstrip('\r\n').split(' ', 2) + ['', ''])[:3]
+            command = command.upper()
+            self.fake.commands.append(f"{command} {args}".strip())
+
+            if command == 'CAPABILITY':
+                self._write("* CAPABILITY IMAP4rev1 IDLE ID\r\n")
+            elif command == 'ID':
+                self._write("* ID NIL\r\n")
+            elif command == 'SELECT':
+                self._write(f"* {len(self.fake.messages)} EXISTS\r\n")
+                self._write(f"* OK [UIDVALIDITY {self.fake.uidvalidity}] UIDs valid\r\n")
+                self._write(f"* OK [UIDNEXT {len(self.fake.messages) + 1}] Predicted next UID\r\n")
+            elif command == 'UID':
+                self._uid(args)
+            elif command == 'IDLE':
+                if self.fake.arrive_during_idle:
+                    self.fake.messages.extend(self.fake.arrive_during_idle)
+                    self.fake.arrive_during_idle.clear()
+                    exists = f"* {len(self.fake.messages)} EXISTS\r\n"
+                    if self.fake.idle_in_one_write:
+                        self._write("+ idling\r\n" + exists)
+                    else:
+                        self._write("+ idling\r\n")
+                        self._write(exists)
+                else:
+                    self._write("+ idling\r\n")
+                self.rfile.readline()   # DONE
+            elif command == 'LOGOUT':
+                self._write("* BYE\r\n")
+                self._write(f"{tag} OK LOGOUT completed\r\n")
+                return
+            self._write(f"{tag} OK {command} completed\r\n")
+
+    def _uid(self, args):
+        sub, rest = args.split(' ', 1)
+        if sub.upper() == 'SEARCH':
+            low = int(re.search(r'UID (\d+):\*', rest).group(1)) if 'UID' in rest else 1
+            uids = [uid for uid in range(1, len(self.fake.messages) + 1) if uid >= low]
+            # 与真实服务器一样，"n:*" 在没有新邮件时也返回最后一封
+            if not uids and self.fake.messages:
+                uids = [len(self.fake.messages)]
+            self._write(f"* SEARCH {' '.join(map(str, uids))}\r\n")
+            return
+
+        uid, items = rest.split(' ', 1)
+        raw = self.fake.messages[int(uid) - 1]
+        data = raw[:raw.index(b'\r\n\r\n') + 4] if 'HEADER' in items.upper() else raw
+        self._write(f"* {uid} FETCH (UID {uid} BODY[] {{{len(data)}}}\r\n".encode() + data + b")\r\n")
+
+
+class FakeSMTPServer:
+    """
+    用法:
+        with FakeSMTPServer() as server:
+            server.refuse_connections = 1        # 前 1 个连接回复 421 后关闭
+            server.drop_after_messages = 1       # 每个连接收到 1 封邮件后关闭连接（模拟服务器断开空闲连接）
+            ...
+            server.messages → [(连接序号, 邮件 bytes)]
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.refuse_connections = 0
+        self.drop_after_messages = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(_SMTPHandler):
+            pass
+        Handler.fake = fake
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    fake = None
+
+    def _write(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        with self.fake.lock:
+            self.fake.connections += 1
+            connection = self.fake.connections
+            refuse = self.fake.refuse_connections > 0
+            if refuse:
+                self.fake.refuse_connections -= 1
+
+        if refuse:
+            self._write("421 fake SMTP busy")
+            return
+
+        self._write("220 fake SMTP ready")
+        received = 0
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+
+            if command == 'EHLO':
+                self._write("250-fake")
+                self._write("250 8BITMIME")
+            elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._write("250 OK")
+            elif command == 'DATA':
+                self._write("354 End data with <CR><LF>.<CR><LF>")
+                data = b""
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk == b".\r\n":
+                        break
+                    data += chunk
+                with self.fake.lock:
+                    self.fake.messages.append((connection, data))
+                self._write("250 OK queued")
+                received += 1
+                if self.fake.drop_after_messages and received >= self.fake.drop_after_messages:
+                    return
+            elif command == 'QUIT':
+                self._write("221 Bye")
+                return
+            else:
+                self._write("502 Command not implemented")
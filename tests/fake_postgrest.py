@@ -0,0 +1,238 @@
+"""
+内存中的 PostgREST 替身（测试用）
+在本地端口上提供 /rest/v1/<表> 和 /rest/v1/rpc/<函数>，让 SupabaseClient 走真实的 HTTP 请求
+
+支持:
+    - GET: eq / neq / is / in / gt / gte / lt / lte / or 过滤，order、limit、offset、select 列投影
+    - POST: 单行 / 多行插入，on_conflict + resolution=merge-duplicates / ignore-duplicates
+    - PATCH: 按过滤条件更新
+    - unique: 表的唯一约束，违反时整个请求返回 409（与 Postgres 一样整条语句回滚）
+    - rpc: 注册 Python 函数模拟数据库函数，未注册时返回 404（PGRST202）
+    - fail: 按 (方法, 路径) 注入失败状态码
+"""
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+SPECIAL_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+def _coerce(value):
+    if value == 'true':
+        return True
+    if value == 'false':
+        return False
+    if value == 'null':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _split_list(text):
+    """拆分 in.(...) 的值列表（支持双引号包裹的值）"""
+    values, current, quoted, escaped = [], '', False, False
+    for char in text:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            values.append(current)
+            current = ''
+        else:
+            current += char
+    values.append(current)
+    return values
+
+
+def _match(row, key, expr):
+    if key == 'or':
+        return any(_match(row, *part.split('.', 1)) for part in _split_list(expr.strip('()')))
+
+    op, _, value = expr.partition('.')
+    current = row.get(key)
+
+    if op in ('eq', 'neq'):
+        equal = current == _coerce(value) or (current is not None and str(current) == value)
+        return equal if op == 'eq' else not equal
+    if op == 'is':
+        return current is None if value == 'null' else current == _coerce(value)
+    if op == 'in':
+        values = _split_list(value[1:-1])
+        return current in [_coerce(v) for v in values] or str(current) in values
+    if op in ('lt', 'lte', 'gt', 'gte'):
+        if current is None:
+            return False
+        a, b = current, _coerce(value)
+        if type(a) is not type(b):
+            a, b = str(a), str(b)
+        return {'lt': a < b, 'lte': a <= b, 'gt': a > b, 'gte': a >= b}[op]
+    raise ValueError(f"不支持的运算符: {op}")
+
+
+class FakePostgrest:
+    """
+    用法:
+        with FakePostgrest() as fake:
+            client = SupabaseClient(fake.url, "key")
+            fake.tables['tasks'] = [...]
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.unique = {}        # 表 → [(列, ...)]
+        self.rpc = {}           # 函数名 → fn(body) -> 返回值
+        self.fail = {}          # (方法, 路径) → 状态码
+        self.requests = []      # [(方法, 路径, 查询字符串)]
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(_Handler):
+            pass
+        Handler.fake = fake
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method=None, path=None):
+        """统计收到的请求数"""
+        return sum(1 for m, p, _ in self.requests
+                   if (method is None or m == method) and (path is None or p == path))
+
+    def rows(self, table, **filters):
+        return [row for row in self.tables.get(table, [])
+                if all(row.get(k) == v for k, v in filters.items())]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        path = parts.path.split('/rest/v1/', 1)[1]
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.fake.requests.append((self.command, path, parts.query))
+        return path, query, body
+
+    def _filtered(self, table, query):
+        return [row for row in self.fake.tables.setdefault(table, [])
+                if all(_match(row, k, v) for k, v in query if k not in SPECIAL_PARAMS)]
+
+    def _injected(self, path):
+        status = self.fake.fail.get((self.command, path))
+        if status:
+            self._send(status, {"message": "injected failure"})
+            return True
+        return False
+
+    def do_GET(self):
+        path, query, _ = self._parse()
+        if self._injected(path):
+            return
+        with self.fake.lock:
+            rows = [dict(row) for row in self._filtered(path, query)]
+        params = dict(query)
+        for spec in reversed(params.get('order', '').split(',') if params.get('order') else []):
+            column, _, direction = spec.partition('.')
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith('desc'))
+        rows = rows[int(params.get('offset', 0)):]
+        if 'limit' in params:
+            rows = rows[:int(params['limit'])]
+        if params.get('select', '*') != '*':
+            columns = params['select'].split(',')
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        self._send(200, rows)
+
+    def do_POST(self):
+        path, query, body = self._parse()
+        if self._injected(path):
+            return
+
+        if path.startswith('rpc/'):
+            fn = self.fake.rpc.get(path[4:])
+            if fn is None:
+                return self._send(404, {"code": "PGRST202", "message": "function not found"})
+            return self._send(200, fn(body))
+
+        params = dict(query)
+        prefer = self.headers.get('Prefer', '')
+        conflict = params.get('on_conflict')
+        rows = body if isinstance(body, list) else [body]
+
+        with self.fake.lock:
+            table = self.fake.tables.setdefault(path, [])
+            staged = [dict(row) for row in table]
+            written = []
+            for row in rows:
+                row = dict(row)
+                existing = None
+                if conflict:
+                    keys = conflict.split(',')
+                    existing = next((r for r in staged if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None:
+                    if 'ignore-duplicates' in prefer:
+                        continue
+                    existing.update(row)
+                    written.append(existing)
+                    continue
+                row.setdefault('id', str(uuid.uuid4()))
+                staged.append(row)
+                written.append(row)
+
+            for columns in self.fake.unique.get(path, []):
+                seen = set()
+                for row in staged:
+                    key = tuple(row.get(c) for c in columns)
+                    if key in seen:
+                        return self._send(409, {"code": "23505", "message": f"duplicate key {columns}"})
+                    seen.add(key)
+
+            table[:] = staged
+
+        self._send(201, None if 'return=minimal' in prefer or 'representation' not in prefer else written)
+
+    def do_PATCH(self):
+        path, query, body = self._parse()
+        if self._injected(path):
+            return
+        with self.fake.lock:
+            rows = self._filtered(path, query)
+            for row in rows:
+                row.update(body)
+            result = [dict(row) for row in rows]
+        if 'representation' in self.headers.get('Prefer', ''):
+            return self._send(200, result)
+        self._send(204)
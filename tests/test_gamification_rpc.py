@@ -0,0 +1,160 @@
+"""经验值 / 惩罚 / 扣款：数据库函数与读-改-写回退"""
+import pytest
+
+import gamification_utils as g
+from conftest import pg_rpc
+
+USER = 'u@x.com'
+
+
+def _seed(postgrest, **state):
+    row = {'user_email': USER, 'level': 1, 'current_exp': 0, 'total_exp': 0,
+           'coins': 200, 'consecutive_q1_days': 0, 'total_punishments': 0}
+    row.update(state)
+    postgrest.tables['user_gamification'] = [row]
+    return row
+
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_rpc_failure_does_not_fall_back(postgrest, client, status):
+    """网关错误时事务可能已经提交，不能再用读-改-写重放一次"""
+    _seed(postgrest)
+    postgrest.fail[('POST', 'rpc/apply_exp_and_coins')] = status
+
+    assert g.update_user_exp_and_coins(client, USER, 50, 10) is None
+    assert postgrest.count('PATCH', 'user_gamification') == 0
+    assert postgrest.count('POST', 'exp_history') == 0
+    assert postgrest.rows('user_gamification')[0]['coins'] == 200
+
+
+def test_punishment_rpc_failure_does_not_fall_back(postgrest, client):
+    _seed(postgrest, coins=100)
+    postgrest.fail[('POST', 'rpc/apply_punishment_delta')] = 502
+
+    assert g.apply_punishment(client, USER, 30, 20, 'no_reply') is None
+    assert postgrest.count('PATCH', 'user_gamification') == 0
+    assert postgrest.rows('user_gamification')[0]['coins'] == 100
+
+
+def test_spend_coins_rpc_failure_grants_nothing(postgrest, client):
+    _seed(postgrest, coins=300)
+    postgrest.tables['user_inventory'] = []
+    postgrest.fail[('POST', 'rpc/spend_coins')] = 504
+
+    result = g.purchase_item(client, USER, 'skip_card', {'price': 120, 'item_name': '跳过卡'})
+
+    assert not result['success']
+    assert postgrest.count('PATCH', 'user_gamification') == 0
+    assert postgrest.rows('user_inventory') == []
+
+
+def test_missing_function_falls_back(postgrest, client):
+    """函数未部署（404）时回退到读-改-写，之后不再探测"""
+    _seed(postgrest)
+
+    first = g.update_user_exp_and_coins(client, USER, 50, 10)
+    second = g.update_user_exp_and_coins(client, USER, 50, 10)
+
+    assert first['success'] and second['success']
+    assert postgrest.rows('user_gamification')[0]['coins'] == 220
+    assert postgrest.count('POST', 'rpc/apply_exp_and_coins') == 1
+
+
+# ==================== 与本地 Postgres 中的函数对比 ====================
+
+def _seed_pg(pg, **state):
+    pg.execute(
+        "INSERT INTO user_gamification (user_email, level, current_exp, total_exp, coins) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (USER, state.get('level', 1), state.get('current_exp', 0),
+         state.get('total_exp', 0), state.get('coins', 200)))
+
+
+def _pg_state(pg):
+    pg.execute("SELECT level, current_exp, total_exp, coins, consecutive_q1_days "
+               "FROM user_gamification WHERE user_email = %s", (USER,))
+    return dict(zip(['level', 'current_exp', 'total_exp', 'coins', 'consecutive_q1_days'], pg.fetchone()))
+
+
+def _fake_state(postgrest):
+    row = postgrest.rows('user_gamification')[0]
+    return {k: row[k] for k in ['level', 'current_exp', 'total_exp', 'coins', 'consecutive_q1_days']}
+
+
+def _fake_state_after(result):
+    return {'level': result['new_level'], 'current_exp': result['current_exp'],
+            'total_exp': result['total_exp'], 'coins': result['coins']}
+
+
+@pytest.mark.parametrize('state, exp_gain, coins_gain', [
+    ({'level': 1, 'current_exp': 30}, 40, 5),            # 不升级
+    ({'level': 1, 'current_exp': 90}, 250, 20),          # 连升两级
+    ({'level': 19, 'current_exp': 1800}, 5000, 0),       # 封顶 LV20
+    ({'level': 3, 'current_exp': 10, 'coins': 50}, 0, -20),
+])
+def test_apply_exp_and_coins_matches_fallback(pg, postgrest, client, state, exp_gain, coins_gain):
+    _seed(postgrest, **state)
+    fallback = g.update_user_exp_and_coins(client, USER, exp_gain, coins_gain, "测试")
+
+    g._MISSING_GAMIFICATION_RPCS.clear()
+    _seed(postgrest, **state)
+    _seed_pg(pg, **state)
+    postgrest.rpc['apply_exp_and_coins'] = pg_rpc(pg, 'apply_exp_and_coins')
+    atomic = g.update_user_exp_and_coins(client, USER, exp_gain, coins_gain, "测试")
+
+    assert atomic == fallback
+    assert _pg_state(pg) == {**_fake_state_after(fallback), 'consecutive_q1_days': 0}
+
+
+@pytest.mark.parametrize('state, coins_deduct, exp_deduct, punishment_type', [
+    ({'level': 5, 'current_exp': 300, 'coins': 100}, 30, 50, 'task_delay'),   # 不降级
+    ({'level': 4, 'current_exp': 20, 'coins': 10}, 30, 250, 'no_reply'),      # 连降两级，金币最低为 0
+    ({'level': 1, 'current_exp': 20, 'coins': 10}, 5, 100, 'no_reply'),       # LV1 经验值最低为 0
+])
+def test_apply_punishment_delta_matches_fallback(pg, postgrest, client, state, coins_deduct, exp_deduct,
+                                                 punishment_type):
+    _seed(postgrest, consecutive_q1_days=3, **state)
+    fallback = g.apply_punishment(client, USER, coins_deduct, exp_deduct, punishment_type)
+    fallback_state = _fake_state(postgrest)
+
+    g._MISSING_GAMIFICATION_RPCS.clear()
+    _seed(postgrest, consecutive_q1_days=3, **state)
+    _seed_pg(pg, **state)
+    pg.execute("UPDATE user_gamification SET consecutive_q1_days = 3")
+    postgrest.rpc['apply_punishment_delta'] = pg_rpc(pg, 'apply_punishment_delta')
+    atomic = g.apply_punishment(client, USER, coins_deduct, exp_deduct, punishment_type)
+
+    assert atomic == fallback
+    pg_state = _pg_state(pg)
+    assert {k: pg_state[k] for k in ['level', 'current_exp', 'coins', 'consecutive_q1_days']} == \
+        {k: fallback_state[k] for k in ['level', 'current_exp', 'coins', 'consecutive_q1_days']}
+
+
+@pytest.mark.parametrize('coins, price', [(300, 120), (120, 120)])
+def test_spend_coins_matches_fallback(pg, postgrest, client, coins, price):
+    item = {'price': price, 'item_name': '跳过卡'}
+    _seed(postgrest, coins=coins)
+    fallback = g.purchase_item(client, USER, 'skip_card', item)
+
+    g._MISSING_GAMIFICATION_RPCS.clear()
+    _seed(postgrest, coins=coins)
+    _seed_pg(pg, coins=coins)
+    postgrest.rpc['spend_coins'] = pg_rpc(pg, 'spend_coins')
+    atomic = g.purchase_item(client, USER, 'skip_card', item)
+
+    assert atomic == fallback
+    assert _pg_state(pg)['coins'] == coins - price
+
+
+def test_spend_coins_rejects_insufficient_balance(pg, postgrest, client):
+    """余额不足时数据库函数不扣款、不发放道具"""
+    _seed(postgrest, coins=50)
+    _seed_pg(pg, coins=50)
+    postgrest.tables['user_inventory'] = []
+    postgrest.rpc['spend_coins'] = pg_rpc(pg, 'spend_coins')
+
+    result = g.purchase_item(client, USER, 'skip_card', {'price': 120, 'item_name': '跳过卡'})
+
+    assert result == {'success': False, 'reason': '金币不足'}
+    assert _pg_state(pg)['coins'] == 50
+    assert postgrest.rows('user_inventory') == []
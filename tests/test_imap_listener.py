@@ -0,0 +1,113 @@
+"""IMAP IDLE 监听：对接本地 IMAP 替身"""
+import time
+
+import pytest
+
+import imap_listener
+from check_email_reply import TARGET_SUBJECTS
+from conftest import MAILBOX
+from fake_mail import FakeIMAPServer, make_message
+
+SUBJECT = TARGET_SUBJECTS[0]
+
+
+@pytest.fixture
+def imap_server():
+    with FakeIMAPServer() as server:
+        yield server
+
+
+@pytest.fixture
+def listener(postgrest, client, imap_server, monkeypatch):
+    # 之前已经处理到 UID 0，从第一封开始处理
+    postgrest.tables['mailbox_state'] = [{'mailbox': f'imap:{MAILBOX}:1', 'seen_uids': ['0']}]
+    listener = imap_listener.ReplyListener(client, MAILBOX, 'password', '', 'key',
+                                           host='127.0.0.1', port=imap_server.port, use_ssl=False,
+                                           idle_timeout=5)
+    listener.processed = []
+    return listener
+
+
+def _record(listener, expected, fail_on=()):
+    """替换 process_reply：记录内容，处理到 expected 封时停止监听"""
+    def process_reply(client, content, *args):
+        listener.processed.append(content)
+        if len(listener.processed) >= expected:
+            listener.stop_event.set()
+        if any(text in content for text in fail_on):
+            raise RuntimeError("模拟处理失败")
+        return True
+    return process_reply
+
+
+def test_processes_backlog_and_idle_notifications(listener, imap_server, postgrest, monkeypatch):
+    imap_server.messages += [make_message(SUBJECT, 'Q1: 1完成，第一封回复'),
+                             make_message('无关邮件', '这封不是回复，不处理')]
+    imap_server.arrive_during_idle.append(make_message(SUBJECT, 'Q2: 1进度50%，IDLE 期间到达'))
+    monkeypatch.setattr(imap_listener, 'process_reply', _record(listener, 2))
+
+    listener.run_once()
+
+    assert [c.split('，')[0] for c in listener.processed] == ['Q1: 1完成', 'Q2: 1进度50%']
+    assert 'IDLE' in imap_server.commands
+    assert postgrest.rows('mailbox_state', mailbox=f'imap:{MAILBOX}:1')[0]['seen_uids'] == ['3']
+    assert len(postgrest.rows('processed_replies')) == 2
+
+
+def test_idle_notice_in_same_segment_as_continuation(imap_server):
+    """「+ idling」和 EXISTS 一起到达时，EXISTS 已在 imaplib 的读缓冲区中，不等到 IDLE 超时"""
+    imap_server.idle_in_one_write = True
+    imap_server.arrive_during_idle.append(make_message(SUBJECT, 'Q1: 1完成'))
+    imap, _ = imap_listener.connect_imap(MAILBOX, 'password', host='127.0.0.1', port=imap_server.port,
+                                         use_ssl=False)
+
+    started = time.monotonic()
+    assert imap_listener.wait_for_new_mail(imap, timeout=10)
+    assert time.monotonic() - started < 3
+    imap.logout()
+
+
+def test_failed_reply_does_not_stop_later_replies(listener, imap_server, monkeypatch):
+    """单封回复处理异常时记录日志，继续处理后面的邮件"""
+    imap_server.messages += [make_message(SUBJECT, 'Q1: 1完成，这一封处理时出错'),
+                             make_message(SUBJECT, 'Q1: 2完成，这一封照常处理')]
+    monkeypatch.setattr(imap_listener, 'process_reply', _record(listener, 2, fail_on=['出错']))
+
+    listener.run_once()
+
+    assert len(listener.processed) == 2
+    assert listener.processed_count == 2
+
+
+def test_run_survives_non_imap_errors(listener, monkeypatch):
+    """run() 遇到非 IMAP 异常时重连而不是退出"""
+    calls = []
+
+    def run_once():
+        calls.append(1)
+        if len(calls) == 2:
+            listener.stop_event.set()
+        raise ValueError("数据库返回了意外的数据")
+
+    monkeypatch.setattr(listener, 'run_once', run_once)
+    monkeypatch.setattr(imap_listener, 'RECONNECT_MIN_DELAY', 0)
+
+    listener.run()
+
+    assert len(calls) == 2
+
+
+def test_reply_processed_once_by_listener_and_pop3_sweep(listener, imap_server, postgrest, pop3_sweep,
+                                                         monkeypatch):
+    """IMAP 监听和 POP3 定时检查同时运行时，同一封回复只处理一次（按 Message-ID 登记）"""
+    shared = make_message(SUBJECT, 'Q1: 1完成，两边都能看到的回复', message_id='<shared@example.com>')
+    imap_server.messages.append(shared)
+    monkeypatch.setattr(imap_listener, 'process_reply', _record(listener, 1))
+
+    listener.run_once()
+    assert len(listener.processed) == 1
+
+    # POP3 游标已有状态，两封都是新邮件
+    postgrest.tables['mailbox_state'].append({'mailbox': MAILBOX, 'seen_uids': []})
+    later = make_message(SUBJECT, 'Q1: 2完成，只有定时检查看到的回复')
+    assert pop3_sweep([('uidl-1', shared), ('uidl-2', later)]) == ['Q1: 2完成，只有定时检查看到的回复']
@@ -0,0 +1,104 @@
+"""DeepSeek 客户端：对接本地模拟服务"""
+import pytest
+
+import llm_client
+from fake_llm import FakeDeepSeek
+
+
+@pytest.fixture
+def fake():
+    with FakeDeepSeek() as fake:
+        yield fake
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避等待时间，不真正等待"""
+    waits = []
+    monkeypatch.setattr(llm_client.time, 'sleep', waits.append)
+    return waits
+
+
+def _client(fake, **kwargs):
+    return llm_client.DeepSeekClient("test-key", base_url=fake.url, **kwargs)
+
+
+def test_complete(fake):
+    with _client(fake) as llm:
+        assert llm.complete("你好") == "echo: 你好"
+
+    assert fake.requests[0]['messages'] == [{"role": "user", "content": "你好"}]
+    assert llm.stats['calls'] == 1 and llm.stats['prompt_tokens'] == 10
+
+
+def test_retry_after_on_429(fake, sleeps):
+    fake.failures = [(429, {'Retry-After': '2'})]
+
+    with _client(fake) as llm:
+        assert llm.complete("你好") == "echo: 你好"
+
+    assert sleeps == [2.0]
+    assert llm.stats['retries'] == 1 and llm.stats['failed'] == 0
+
+
+def test_retry_after_is_capped(fake, sleeps):
+    fake.failures = [(429, {'Retry-After': '600'})]
+
+    with _client(fake) as llm:
+        llm.complete("你好")
+
+    assert sleeps == [llm_client.LLM_BACKOFF_MAX]
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 504])
+def test_retries_5xx_with_backoff(fake, sleeps, status):
+    fake.failures = [(status, {}), (status, {})]
+
+    with _client(fake, max_retries=3) as llm:
+        assert llm.complete("你好") == "echo: 你好"
+
+    assert len(fake.requests) == 3
+    # 第 n 次重试前等待 0 ~ LLM_BACKOFF_BASE * 2^n 秒
+    assert len(sleeps) == 2 and sleeps[0] <= 1.0 and sleeps[1] <= 2.0
+
+
+def test_gives_up_after_max_retries(fake, sleeps):
+    fake.failures = [(503, {})] * 5
+
+    with _client(fake, max_retries=2) as llm:
+        assert llm.complete("你好") is None
+
+    assert len(fake.requests) == 3
+    assert llm.stats['failed'] == 1
+
+
+def test_does_not_retry_client_errors(fake, sleeps):
+    fake.failures = [(400, {})]
+
+    with _client(fake) as llm:
+        assert llm.complete("你好") is None
+
+    assert len(fake.requests) == 1 and sleeps == []
+
+
+def test_stream_parses_sse(fake):
+    chunks = []
+
+    with _client(fake) as llm:
+        text = llm.complete("流式返回的中文内容", stream=True, on_chunk=chunks.append)
+
+    assert text == "echo: 流式返回的中文内容"
+    assert ''.join(chunks) == text and len(chunks) > 1
+    assert fake.requests[0]['stream'] is True
+    # 最后一段的 usage 计入统计
+    assert llm.stats['completion_tokens'] == len(text)
+
+
+def test_concurrency_capped_by_semaphore(fake):
+    fake.delay = 0.2
+
+    with _client(fake, max_concurrency=2) as llm:
+        results = llm.complete_many([f"p{n}" for n in range(6)])
+
+    assert results == [f"echo: p{n}" for n in range(6)]
+    assert fake.max_active == 2
@@ -0,0 +1,108 @@
+"""SMTP 发送通道：对接本地调试 SMTP 服务"""
+import email
+import importlib
+import smtplib
+
+import pytest
+
+import mail_transport
+from fake_mail import FakeSMTPServer
+
+
+@pytest.fixture
+def smtp_server():
+    with FakeSMTPServer() as server:
+        yield server
+
+
+def _transport(server, **kwargs):
+    kwargs.setdefault('rate_limit', 0)
+    kwargs.setdefault('max_per_connection', 0)
+    return mail_transport.MailTransport('coach@163.com', 'password', host='127.0.0.1', port=server.port,
+                                        use_ssl=False, **kwargs)
+
+
+def _subjects(server):
+    return [email.message_from_bytes(data)['Subject'] for _, data in server.messages]
+
+
+def test_env_hooks_point_transport_at_local_server(smtp_server, monkeypatch):
+    """SMTP_HOST / SMTP_PORT / SMTP_SSL 环境变量决定默认连接的服务器"""
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(smtp_server.port))
+    monkeypatch.setenv('SMTP_SSL', 'false')
+    module = importlib.reload(mail_transport)
+    try:
+        transport = module.get_mail_transport('coach@163.com', 'password')
+        assert (transport.host, transport.port, transport.use_ssl) == ('127.0.0.1', smtp_server.port, False)
+
+        transport.send_text('user@example.com', 'hello', '正文')
+
+        assert smtp_server.connections == 1 and len(smtp_server.messages) == 1
+    finally:
+        module.close_mail_transports()
+        monkeypatch.undo()
+        importlib.reload(mail_transport)
+
+
+def test_reuses_one_connection(smtp_server):
+    with _transport(smtp_server) as transport:
+        results = transport.send_many([('user@example.com', f'm{n}', '正文') for n in range(3)])
+
+    assert all(r['success'] for r in results)
+    assert smtp_server.connections == 1
+    assert _subjects(smtp_server) == ['m0', 'm1', 'm2']
+
+
+def test_reconnects_once_when_server_drops_connection(smtp_server):
+    """服务器关闭了连接时重连后重试一次，邮件不丢"""
+    smtp_server.drop_after_messages = 1
+
+    with _transport(smtp_server) as transport:
+        transport.send_text('user@example.com', 'm0', '正文')
+        transport.send_text('user@example.com', 'm1', '正文')
+
+    assert _subjects(smtp_server) == ['m0', 'm1']
+    assert [connection for connection, _ in smtp_server.messages] == [1, 2]
+    assert transport.stats == {'sent': 2, 'failed': 0, 'connections': 2}
+
+
+def test_retries_failed_first_connect(smtp_server):
+    """第一次连接失败（421）时也重连一次"""
+    smtp_server.refuse_connections = 1
+
+    with _transport(smtp_server) as transport:
+        transport.send_text('user@example.com', 'm0', '正文')
+
+    assert _subjects(smtp_server) == ['m0']
+    assert smtp_server.connections == 2
+
+
+def test_gives_up_after_second_connect_failure(smtp_server):
+    smtp_server.refuse_connections = 2
+
+    with _transport(smtp_server) as transport:
+        with pytest.raises(smtplib.SMTPConnectError):
+            transport.send_text('user@example.com', 'm0', '正文')
+
+    assert smtp_server.messages == []
+    assert transport.stats['failed'] == 1
+
+
+def test_max_per_connection_rotates_connections(smtp_server):
+    with _transport(smtp_server, max_per_connection=2) as transport:
+        transport.send_many([('user@example.com', f'm{n}', '正文') for n in range(5)])
+
+    assert [connection for connection, _ in smtp_server.messages] == [1, 1, 2, 2, 3]
+
+
+def test_rate_limit_waits_for_window(smtp_server, monkeypatch):
+    """最近60秒内的发送数达到上限时等待"""
+    waits = []
+    monkeypatch.setattr(mail_transport.time, 'sleep', waits.append)
+
+    with _transport(smtp_server, rate_limit=2) as transport:
+        transport.send_many([('user@example.com', f'm{n}', '正文') for n in range(3)])
+
+    assert len(smtp_server.messages) == 3
+    assert len(waits) == 1 and 59 < waits[0] <= 60
@@ -0,0 +1,47 @@
+"""POP3 邮箱游标：每次运行只保存一次"""
+import check_email_reply
+from conftest import MAILBOX
+from fake_mail import make_message
+from mailbox_cursor import MailboxCursor
+
+
+def test_cursor_saved_once_per_run(postgrest, pop3_sweep):
+    postgrest.tables['mailbox_state'] = [{'mailbox': MAILBOX, 'seen_uids': ['old-1']}]
+    subject = check_email_reply.TARGET_SUBJECTS[0]
+    messages = [('old-1', make_message(subject, 'Q1: 1完成，已经处理过的回复'))]
+    messages += [(f'new-{n}', make_message(subject, f'Q1: {n}进度50%，新的回复内容')) for n in range(1, 4)]
+
+    processed = pop3_sweep(messages)
+
+    assert len(processed) == 3
+    assert postgrest.count('POST', 'mailbox_state') == 1
+    assert sorted(postgrest.rows('mailbox_state')[0]['seen_uids']) == ['new-1', 'new-2', 'new-3', 'old-1']
+
+    # 没有新邮件时不处理、不写游标
+    assert pop3_sweep(messages) == []
+    assert postgrest.count('POST', 'mailbox_state') == 1
+
+
+def test_cursor_prunes_deleted_messages(postgrest, client):
+    postgrest.tables['mailbox_state'] = [{'mailbox': MAILBOX, 'seen_uids': ['a', 'b', 'c']}]
+    cursor = MailboxCursor(MAILBOX, client, state_file='')
+    assert cursor.load() and cursor.has_state
+
+    cursor.prune(['b', 'c', 'd'])
+    assert cursor.save()
+
+    assert postgrest.rows('mailbox_state')[0]['seen_uids'] == ['b', 'c']
+
+
+def test_cursor_untouched_when_load_fails(postgrest, pop3_sweep):
+    """读取游标失败时只处理最新一封，其余未处理的回复不能被记为已检查"""
+    postgrest.tables['mailbox_state'] = [{'mailbox': MAILBOX, 'seen_uids': ['old-1']}]
+    postgrest.fail[('GET', 'mailbox_state')] = 500
+    subject = check_email_reply.TARGET_SUBJECTS[0]
+    messages = [('old-1', make_message(subject, 'Q1: 1完成，已经处理过的回复'))]
+    messages += [(f'new-{n}', make_message(subject, f'Q1: {n}进度50%，新的回复内容')) for n in range(1, 4)]
+
+    assert len(pop3_sweep(messages)) == 1
+
+    assert postgrest.count('POST', 'mailbox_state') == 0
+    assert postgrest.rows('mailbox_state')[0]['seen_uids'] == ['old-1']
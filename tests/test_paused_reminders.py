@@ -0,0 +1,30 @@
+"""暂缓任务提醒日期的批量写回"""
+import uuid
+
+import gamification_utils as g
+from daily_review import PausedReminderBatch
+
+
+def _paused_tasks(count):
+    return [{'id': str(uuid.uuid4()), 'status': 'paused', 'last_reminded_date': None} for _ in range(count)]
+
+
+def test_mark_reminded_chunks_long_id_lists(postgrest, client):
+    """id 很多时分块 PATCH，每个请求的 URL 都保持在网关限制以内"""
+    postgrest.tables['tasks'] = _paused_tasks(400)
+    batch = PausedReminderBatch()
+    batch.add([t['id'] for t in postgrest.tables['tasks']])
+
+    assert batch.flush(client)
+
+    patches = [query for method, path, query in postgrest.requests if method == 'PATCH' and path == 'tasks']
+    assert len(patches) == 3
+    assert max(len(query) for query in patches) < 8000
+    assert all(t['last_reminded_date'] for t in postgrest.rows('tasks'))
+
+
+def test_mark_reminded_reports_failed_chunk(postgrest, client):
+    postgrest.tables['tasks'] = _paused_tasks(3)
+    postgrest.fail[('PATCH', 'tasks')] = 500
+
+    assert not g.mark_paused_tasks_reminded(client, [t['id'] for t in postgrest.tables['tasks']], '2026-10-17')
@@ -0,0 +1,35 @@
+"""处理回复：批量解析失败后不再调用 AI"""
+import check_email_reply
+from conftest import MAILBOX
+from fake_mail import make_message
+
+SUBJECT = check_email_reply.TARGET_SUBJECTS[0]
+
+
+def test_failed_batch_parse_is_passed_as_already_tried(postgrest, pop3_sweep, monkeypatch):
+    postgrest.tables['mailbox_state'] = [{'mailbox': MAILBOX, 'seen_uids': []}]
+    # 第一封批量和逐封解析都失败，第二封解析成功
+    monkeypatch.setattr(check_email_reply, 'parse_task_operations_batch',
+                        lambda replies, key: dict(zip(sorted(replies), [None, [{'operation_type': 'create'}]])))
+
+    processed = pop3_sweep([('a', make_message(SUBJECT, '今天状态一般，没有什么进展')),
+                            ('b', make_message(SUBJECT, '新增：写论文 Q1 以及其他内容'))])
+
+    operations = dict(zip(processed, pop3_sweep.operations))
+    assert operations['今天状态一般，没有什么进展'] is check_email_reply.PARSE_ALREADY_FAILED
+    assert operations['新增：写论文 Q1 以及其他内容'] == [{'operation_type': 'create'}]
+
+
+def test_process_reply_does_not_parse_again(postgrest, client, monkeypatch):
+    """PARSE_ALREADY_FAILED 时不再调用 parse_task_operations_v4（第三次 AI 调用），按未检测到任务操作反馈"""
+    postgrest.tables['user_gamification'] = [{'user_email': MAILBOX, 'level': 1, 'coins': 200, 'current_exp': 0}]
+    monkeypatch.setattr(check_email_reply, 'parse_task_operations_v4',
+                        lambda *args: (_ for _ in ()).throw(AssertionError("不应再次解析")))
+    sent = []
+    monkeypatch.setattr(check_email_reply, 'send_notification',
+                        lambda client, user, kind, subject, content, **kwargs: sent.append(content))
+
+    assert check_email_reply.process_reply(client, '今天状态一般，没有什么进展', MAILBOX, 'password', '', 'key',
+                                           operations=check_email_reply.PARSE_ALREADY_FAILED)
+
+    assert len(sent) == 1 and '未检测到任务操作' in sent[0]
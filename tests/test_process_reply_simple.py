@@ -0,0 +1,44 @@
+"""简易回复处理：按任务名称查找任务、发送反馈"""
+import notifier
+import process_reply_simple
+
+
+def _setup(client, monkeypatch, tasks_data, webhook_url=None):
+    for key in ['SUPABASE_URL', 'SUPABASE_KEY', 'DEEPSEEK_API_KEY']:
+        monkeypatch.setenv(key, 'x')
+    monkeypatch.setenv('EMAIL_163_USERNAME', 'u@x.com')
+    if webhook_url:
+        monkeypatch.setenv('FEISHU_WEBHOOK_URL', webhook_url)
+    else:
+        monkeypatch.delenv('FEISHU_WEBHOOK_URL', raising=False)
+    monkeypatch.setattr(process_reply_simple, 'SupabaseClient', lambda url, key: client)
+    monkeypatch.setattr(process_reply_simple, 'parse_reply_with_ai', lambda content, key: tasks_data)
+
+
+def test_task_name_with_query_characters_updates_existing_task(postgrest, client, monkeypatch):
+    """任务名称中的 &、, 等字符作为查询参数编码，不会截断查询而误建重复任务"""
+    name = '整理周报 & 复盘,下周计划'
+    postgrest.tables['tasks'] = [{'id': 't1', 'user_email': 'u@x.com', 'task_name': name,
+                                  'quadrant': 2, 'status': 'active', 'progress_percentage': 10}]
+    _setup(client, monkeypatch, [{'task_name': name, 'progress': 60, 'quadrant': 'Q2', 'action': 'update'}])
+
+    process_reply_simple.process_user_reply('整理周报 & 复盘,下周计划 60%')
+
+    assert postgrest.rows('tasks') == [{'id': 't1', 'user_email': 'u@x.com', 'task_name': name, 'quadrant': 2,
+                                        'status': 'active', 'progress_percentage': 60,
+                                        'updated_at': postgrest.rows('tasks')[0]['updated_at']}]
+
+
+def test_failed_feedback_stays_in_outbox(postgrest, client, monkeypatch):
+    """飞书反馈发送失败时留在发件箱等待重试，而不是直接丢失"""
+    postgrest.tables['tasks'] = []
+    _setup(client, monkeypatch, [{'task_name': '写论文', 'progress': 10, 'quadrant': 'Q1', 'action': 'update'}],
+           webhook_url='https://feishu.example/hook')
+    monkeypatch.setattr(notifier, 'send_feishu', lambda url, text: {'success': False, 'error': 'HTTP 502'})
+
+    assert process_reply_simple.process_user_reply('写论文 10%')
+
+    [row] = postgrest.rows('email_logs')
+    assert (row['email_type'], row['content'], row['status'], row['feishu_sent']) == \
+        ('reply_feedback', None, 'pending', False)
+    assert '写论文' in row['feishu_text']
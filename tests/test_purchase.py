@@ -0,0 +1,33 @@
+"""商店购买：扣款与道具入库"""
+import gamification_utils as g
+
+
+def _seed(postgrest, coins=300):
+    postgrest.tables['user_gamification'] = [{'user_email': 'u@x.com', 'level': 5, 'coins': coins, 'current_exp': 0}]
+    postgrest.tables['user_inventory'] = []
+
+
+def test_fallback_writes_deduction_before_flush(postgrest, client):
+    """未部署 spend_coins 时，即使 flush() 从未执行，扣款也已经写入数据库"""
+    _seed(postgrest)
+    client.gamification_cache = g.UserGamificationCache(client)
+
+    result = g.purchase_item(client, 'u@x.com', 'skip_card', {'price': 120, 'item_name': '跳过卡'})
+
+    assert result['success'] and result['remaining_coins'] == 180
+    assert postgrest.rows('user_gamification')[0]['coins'] == 180
+    assert postgrest.rows('user_inventory')[0]['item_code'] == 'skip_card'
+    # 缓存同步为最新值，且没有遗留待写回的金币修改
+    assert client.gamification_cache.get('u@x.com')['coins'] == 180
+    assert 'u@x.com' not in client.gamification_cache.dirty
+
+
+def test_fallback_keeps_item_when_deduction_fails(postgrest, client):
+    """扣款写入失败时不发放道具"""
+    _seed(postgrest)
+    postgrest.fail[('PATCH', 'user_gamification')] = 500
+
+    result = g.purchase_item(client, 'u@x.com', 'skip_card', {'price': 120, 'item_name': '跳过卡'})
+
+    assert not result['success']
+    assert postgrest.rows('user_inventory') == []
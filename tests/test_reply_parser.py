@@ -0,0 +1,82 @@
+"""按文档格式在本地解析回复（parse_task_operations_local）"""
+import pytest
+
+import gamification_utils as g
+
+
+def _op(operation_type, quadrant, task_number=None, **extra):
+    op = {'operation_type': operation_type, 'quadrant': quadrant}
+    if task_number is not None:
+        op['task_number'] = task_number
+    op.update(extra)
+    return op
+
+
+@pytest.mark.parametrize('reply, expected', [
+    ('Q1: 1完成; 2进度50%', [_op('complete', 1, 1), _op('update', 1, 2, progress=50)]),
+    # 全角冒号、分号、百分号
+    ('Q2：1完成；任务2进度30％', [_op('complete', 2, 1), _op('update', 2, 2, progress=30)]),
+    ('Q3: 1暂缓, 2 100%', [_op('pause', 3, 1), _op('complete', 3, 2)]),
+    ('Q1-1完成', [_op('complete', 1, 1)]),
+    ('Q4任务2进度80%', [_op('update', 4, 2, progress=80)]),
+    ('Q2-15 0%', [_op('update', 2, 15, progress=0)]),
+    ('q1-3 done', [_op('complete', 1, 3)]),
+    ('新增：写论文（Q1）', [{'operation_type': 'create', 'quadrant': 1, 'task_name': '写论文'}]),
+    ('新增任务 整理书架 Q3', [{'operation_type': 'create', 'quadrant': 3, 'task_name': '整理书架'}]),
+    ('暂缓任务1恢复到Q1', [_op('resume', 1, 1)]),
+    ('暂缓2恢复Q4', [_op('resume', 4, 2)]),
+])
+def test_documented_formats(reply, expected):
+    assert g.parse_task_operations_local(reply) == expected
+
+
+def test_multiple_lines_keep_order():
+    reply = "Q1: 1完成\nQ2-1暂缓\n新增：写论文 Q2\n暂缓任务1恢复到Q1"
+    assert [op['operation_type'] for op in g.parse_task_operations_local(reply)] == \
+        ['complete', 'pause', 'create', 'resume']
+
+
+def test_skips_commands_quotes_and_signatures():
+    reply = "\n".join([
+        "切换性格：严厉",
+        "购买：跳过卡",
+        "Q1: 1完成",
+        "",
+        "发自我的iPhone",
+        "> Q9: 引用的内容不解析",
+        "------------------ 原始邮件 ------------------",
+        "Q2: 这一行在原邮件里，不解析",
+    ])
+    assert g.parse_task_operations_local(reply) == [_op('complete', 1, 1)]
+
+
+@pytest.mark.parametrize('reply', [
+    '今天把论文写完了，明天继续看书',
+    'Q1: 1完成; 今天状态不错',
+    'Q1-1完成了一大半',
+    # 编号和百分比之间没有空白时无法区分，例如「150%」不能当成任务15、进度0%
+    'Q1: 150%',
+    'Q1: 130%',
+    'Q1-130%',
+    'Q1: 1000%',
+])
+def test_free_text_returns_none(reply):
+    """无法按格式识别的内容交给 AI 解析"""
+    assert g.parse_task_operations_local(reply) is None
+
+
+@pytest.mark.parametrize('reply', [
+    '',
+    None,
+    '   \n\n',
+    '> Q1: 1完成\n> Q2: 1暂缓',
+    '在 2026年10月17日 写道：\nQ1: 1完成',
+    '购买：跳过卡\n发自我的iPhone',
+])
+def test_reply_without_task_lines_returns_empty_list(reply, monkeypatch):
+    """空回复、只有引用 / 命令 / 签名的回复明确返回 []：没有任务操作，也不调用 AI"""
+    monkeypatch.setattr(g, '_parse_task_operations_ai',
+                        lambda *args: pytest.fail("不应调用 AI 解析"))
+
+    assert g.parse_task_operations_local(reply) == []
+    assert g.parse_task_operations_v4(reply, 'key') == []
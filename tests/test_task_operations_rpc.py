@@ -0,0 +1,167 @@
+"""
+apply_task_operations 数据库函数与 Python 计划（compile_task_plan + execute_task_plan）对比
+
+同一组操作分别在本地 Postgres（TEST_DATABASE_URL）和 FakePostgrest 上执行，
+结果、任务行、奖励和经验值历史必须一致
+"""
+import uuid
+
+import pytest
+
+import gamification_utils as g
+from conftest import pg_rpc
+
+USER = 'u@x.com'
+GAP = g.TASK_ORDER_GAP
+
+
+def _tasks(sparse):
+    scale = GAP if sparse else 1
+    rows = [
+        ('a1', 1, 1, 'active', 20), ('a2', 1, 2, 'active', 0), ('a3', 1, 3, 'active', 50),
+        ('b1', 2, 1, 'active', 0), ('p1', 1, 1, 'paused', 0), ('p2', 3, 2, 'paused', 0),
+        ('已完成任务', 1, 9, 'completed', 100),
+    ]
+    tasks = []
+    for name, quadrant, order, status, progress in rows:
+        prefix = '暂缓' if status == 'paused' else f'Q{quadrant}'
+        tasks.append({
+            'id': str(uuid.uuid4()), 'user_email': USER, 'task_name': name, 'quadrant': quadrant,
+            'status': status, 'task_order': order * scale, 'display_number': f'{prefix}-{order}',
+            'progress_percentage': progress, 'is_deleted': status == 'completed',
+            'deleted_at': None, 'last_progress_update': None, 'last_reminded_date': None,
+        })
+    return tasks
+
+
+def _op(operation_type, quadrant=None, task_number=None, **extra):
+    return {'operation_type': operation_type, 'quadrant': quadrant, 'task_number': task_number, **extra}
+
+
+SCENARIOS = {
+    'complete_update_coalescing': [
+        _op('update', 1, 3, progress=70), _op('complete', 1, 3), _op('update', 1, 3, progress=10),
+        _op('update', 1, 1, progress=30), _op('update', 1, 1, progress=60), _op('update', 1, 2, progress=100),
+        _op('update', 2, 1, progress=0),
+    ],
+    'pause_and_resume': [
+        _op('pause', 1, 2), _op('resume', 2, 1), _op('resume', 2, 1), _op('pause', 2, 1), _op('complete', 1, 2),
+    ],
+    'creates': [
+        _op('create', 2, task_name='写论文'), _op('resume', 2, 2), _op('create', 2, task_name='写论文'),
+        _op('create', 1, task_name='读书'), _op('create', 1, task_name='已完成任务'),
+        _op('create', 3, task_name='读书'), _op('create', 1, task_name='跑步'), _op('create', 5, task_name='x'),
+        _op('create', 1, task_name=''),
+    ],
+    'missing_tasks': [
+        _op('complete', 3, 1), _op('resume', 1, 9), _op('resume', 7, 1), _op('update', 4, 1, progress=50),
+        _op('complete', 1, 1),
+    ],
+}
+
+TASK_COLUMNS = ['task_name', 'status', 'quadrant', 'task_order', 'display_number', 'progress_percentage',
+                'is_deleted']
+
+
+def _seed_pg(pg, tasks):
+    pg.execute("INSERT INTO user_gamification (user_email, level, current_exp, total_exp, coins) "
+               "VALUES (%s, 2, 150, 250, 100)", (USER,))
+    for task in tasks:
+        pg.execute(
+            "INSERT INTO tasks (id, user_email, task_name, quadrant, status, task_order, display_number, "
+            "progress_percentage, is_deleted) VALUES (%(id)s, %(user_email)s, %(task_name)s, %(quadrant)s, "
+            "%(status)s, %(task_order)s, %(display_number)s, %(progress_percentage)s, %(is_deleted)s)", task)
+
+
+def _seed_fake(postgrest, tasks):
+    postgrest.tables['user_gamification'] = [{'user_email': USER, 'level': 2, 'current_exp': 150,
+                                              'total_exp': 250, 'coins': 100}]
+    postgrest.tables['tasks'] = [dict(task) for task in tasks]
+    postgrest.tables['exp_history'] = []
+    postgrest.unique['tasks'] = [('user_email', 'task_name')]
+
+
+def _pg_rows(pg):
+    pg.execute(f"SELECT {', '.join(TASK_COLUMNS)} FROM tasks WHERE user_email = %s", (USER,))
+    return sorted((dict(zip(TASK_COLUMNS, row)) for row in pg.fetchall()), key=lambda row: row['task_name'])
+
+
+def _fake_rows(postgrest):
+    return sorted(({c: row.get(c) for c in TASK_COLUMNS} for row in postgrest.rows('tasks')),
+                  key=lambda row: row['task_name'])
+
+
+def _pg_history(pg):
+    pg.execute("SELECT exp_gained, coins_gained, reason FROM exp_history WHERE user_email = %s", (USER,))
+    return sorted(pg.fetchall())
+
+
+def _fake_history(postgrest):
+    return sorted((r['exp_gained'], r['coins_gained'], r['reason']) for r in postgrest.rows('exp_history'))
+
+
+@pytest.fixture(params=[False, True], ids=['dense', 'sparse'])
+def sparse(request, monkeypatch):
+    monkeypatch.setattr(g, 'TASK_NUMBERING_MODE', 'sparse' if request.param else 'dense')
+    return request.param
+
+
+@pytest.mark.parametrize('scenario', sorted(SCENARIOS))
+def test_database_function_matches_python_plan(pg, postgrest, client, sparse, scenario):
+    operations = SCENARIOS[scenario]
+    tasks = _tasks(sparse)
+
+    # 数据库函数
+    _seed_pg(pg, tasks)
+    postgrest.rpc['apply_task_operations'] = pg_rpc(pg, 'apply_task_operations')
+    atomic = g.process_task_operations_v4(client, USER, operations)
+
+    # Python 计划（函数未部署）
+    del postgrest.rpc['apply_task_operations']
+    _seed_fake(postgrest, tasks)
+    fallback = g.process_task_operations_v4(client, USER, operations)
+    assert postgrest.count('POST', 'rpc/apply_task_operations') == 2
+
+    assert atomic['results'] == fallback['results']
+    assert (atomic['total_exp_gain'], atomic['total_coins_gain']) == \
+        (fallback['total_exp_gain'], fallback['total_coins_gain'])
+    assert atomic['reward_result'] == fallback['reward_result']
+    assert _pg_rows(pg) == _fake_rows(postgrest)
+    assert _pg_history(pg) == _fake_history(postgrest)
+
+
+def test_creates_are_numbered_without_gaps(pg, postgrest, client, sparse):
+    """与已有任务重名的新增只让这一条失败（不让整个事务回滚），后面的新增不留空号"""
+    _seed_pg(pg, _tasks(sparse))
+    postgrest.rpc['apply_task_operations'] = pg_rpc(pg, 'apply_task_operations')
+
+    outcome = g.process_task_operations_v4(client, USER, SCENARIOS['creates'])
+
+    created = {r['result'].get('task_name'): r['result'] for r in outcome['results']
+               if r['operation'] == 'create' and r['result']['success']}
+    assert {name: r['display_number'] for name, r in created.items()} == {
+        '写论文': 'Q2-3', '读书': 'Q1-4', '跑步': 'Q1-5'}
+
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_rpc_failure_is_not_replayed_in_python(postgrest, client, status):
+    """网关错误时事务可能已经提交：整封回复按失败处理，Python 不做任何写入"""
+    _seed_fake(postgrest, _tasks(False))
+    postgrest.fail[('POST', 'rpc/apply_task_operations')] = status
+
+    outcome = g.process_task_operations_v4(client, USER, SCENARIOS['complete_update_coalescing'])
+
+    assert outcome['failed']
+    assert len(outcome['results']) == len(SCENARIOS['complete_update_coalescing'])
+    assert not any(r['result']['success'] for r in outcome['results'])
+    assert outcome['reward_result'] is None
+    assert [(m, p) for m, p, _ in postgrest.requests] == [('POST', 'rpc/apply_task_operations')]
+
+
+def test_missing_function_falls_back_to_python_plan(postgrest, client):
+    _seed_fake(postgrest, _tasks(False))
+
+    outcome = g.process_task_operations_v4(client, USER, [_op('complete', 1, 1)])
+
+    assert not outcome['failed'] and outcome['results'][0]['result']['success']
+    assert postgrest.rows('tasks', task_name='a1')[0]['status'] == 'completed'
@@ -0,0 +1,166 @@
+"""任务操作计划：compile_task_plan 的编号 / 合并规则和 execute_task_plan 的写入"""
+import gamification_utils as g
+
+USER = 'u@x.com'
+
+
+def _task(task_id, quadrant, order, name=None, status='active', progress=0):
+    prefix = '暂缓' if status == 'paused' else f'Q{quadrant}'
+    return {'id': task_id, 'user_email': USER, 'task_name': name or task_id, 'quadrant': quadrant,
+            'status': status, 'task_order': order, 'display_number': f'{prefix}-{order}',
+            'progress_percentage': progress, 'is_deleted': False, 'deleted_at': None,
+            'updated_at': None, 'last_progress_update': None, 'last_reminded_date': None}
+
+
+def _tasks():
+    return [_task('a1', 1, 1, progress=20), _task('a2', 1, 2), _task('a3', 1, 3, progress=50),
+            _task('b1', 2, 1), _task('p1', 1, 1, status='paused'), _task('p2', 3, 2, status='paused')]
+
+
+def _compile(operations, tasks=None, sparse=False):
+    return g.compile_task_plan(USER, operations, g.build_task_number_index(tasks or _tasks()), sparse=sparse)
+
+
+def _numbers(plan):
+    return {row['id']: (row['status'], row['quadrant'], row['task_order'], row['display_number'])
+            for row in plan['updates']}
+
+
+def _op(operation_type, quadrant=None, task_number=None, **extra):
+    return {'operation_type': operation_type, 'quadrant': quadrant, 'task_number': task_number, **extra}
+
+
+def test_numbers_resolve_against_snapshot_and_renumber():
+    """后面的编号按回复前的清单解析，完成后剩下的任务连续编号"""
+    plan = _compile([_op('complete', 1, 1), _op('update', 1, 3, progress=80)])
+
+    assert [(e['operation'], e['task_id']) for e in plan['entries']] == [('complete', 'a1'), ('update', 'a3')]
+    assert _numbers(plan) == {
+        'a1': ('completed', 1, 1, 'Q1-1'),
+        'a2': ('active', 1, 1, 'Q1-1'),
+        'a3': ('active', 1, 2, 'Q1-2'),
+    }
+    # 没有变化的象限不写
+    assert 'b1' not in _numbers(plan)
+
+
+def test_repeated_updates_keep_last_progress():
+    plan = _compile([_op('update', 1, 1, progress=30), _op('update', 1, 1, progress=60)])
+
+    [entry] = plan['entries']
+    assert entry['result']['old_progress'] == 20 and entry['result']['new_progress'] == 60
+    assert [reward[1:3] for reward in plan['rewards']] == [
+        (g.calculate_exp_gain(40, 1), g.calculate_coins_gain(60))]
+
+
+def test_complete_absorbs_earlier_update_and_ignores_later_ones():
+    plan = _compile([_op('update', 1, 3, progress=70), _op('complete', 1, 3), _op('update', 1, 3, progress=10),
+                     _op('update', 1, 2, progress=100)])
+
+    assert [(e['operation'], e['task_id']) for e in plan['entries']] == [('complete', 'a3'), ('complete', 'a2')]
+    # 奖励按快照中的进度计算
+    assert plan['rewards'][0][1] == g.calculate_exp_gain(50, 1)
+    # a1 仍是 Q1-1，不需要写回
+    assert 'a1' not in _numbers(plan)
+
+
+def test_pause_and_resume_in_one_reply():
+    plan = _compile([_op('pause', 1, 2), _op('resume', 2, 1), _op('resume', 2, 1)])
+
+    assert [e['operation'] for e in plan['entries']] == ['pause', 'resume']
+    assert plan['entries'][1]['result']['new_display_number'] == 'Q2-2'
+    assert _numbers(plan) == {
+        'a2': ('paused', 1, 2, '暂缓-2'),
+        'a3': ('active', 1, 2, 'Q1-2'),
+        'p1': ('active', 2, 2, 'Q2-2'),
+        'p2': ('paused', 3, 1, '暂缓-1'),
+    }
+
+
+def test_creates_append_after_resumed_tasks():
+    plan = _compile([_op('create', 2, task_name='写论文'), _op('resume', 2, 2), _op('create', 2, task_name='写论文'),
+                     _op('create', 5, task_name='无效象限'), _op('create', 1, task_name=' ')])
+
+    assert [(r['task_name'], r['task_order'], r['display_number']) for r in plan['inserts']] == [('写论文', 3, 'Q2-3')]
+    assert _numbers(plan)['p2'][1:] == (2, 2, 'Q2-2')
+    assert [e['result']['success'] for e in plan['entries']] == [True, True, False, False]
+    assert plan['entries'][0]['result']['display_number'] == 'Q2-3'
+
+
+def test_missing_tasks_fail_without_side_effects():
+    plan = _compile([_op('complete', 3, 1), _op('resume', 1, 9)])
+
+    assert [e['result'] for e in plan['entries']] == [
+        {'success': False, 'error': '任务不存在：Q3任务1'},
+        {'success': False, 'error': '暂缓任务不存在：暂缓任务9'},
+    ]
+    assert plan['updates'] == [] and plan['inserts'] == []
+
+
+def test_sparse_mode_only_orders_tasks_joining_a_list():
+    gap = g.TASK_ORDER_GAP
+    tasks = [_task('a1', 1, gap), _task('a2', 1, 2 * gap), _task('p1', 1, gap, status='paused')]
+    plan = _compile([_op('complete', 1, 1), _op('pause', 1, 2), _op('resume', 1, 1),
+                     _op('create', 1, task_name='新任务')], tasks, sparse=True)
+
+    numbers = _numbers(plan)
+    assert numbers['a1'][:2] == ('completed', 1)
+    # 新暂缓 / 恢复 / 新增的任务排到各自列表末尾，已有任务的 task_order 不改写
+    assert numbers['a2'][2] == 2 * gap
+    assert numbers['p1'][2] == 3 * gap
+    assert plan['inserts'][0]['task_order'] == 4 * gap
+    assert plan['inserts'][0]['display_number'] == 'Q1-2'
+
+
+# ==================== execute_task_plan ====================
+
+def test_conflicting_create_fails_alone(postgrest, client):
+    """与已完成的同名任务冲突（UNIQUE(user_email, task_name)）时只有这一条新增失败，后面的编号前移"""
+    postgrest.tables['tasks'] = _tasks() + [dict(_task('done', 1, 9, name='写论文'), status='completed',
+                                                 is_deleted=True)]
+    postgrest.unique['tasks'] = [('user_email', 'task_name')]
+
+    plan = _compile([_op('create', 1, task_name='写论文'), _op('create', 1, task_name='读书'),
+                     _op('update', 2, 1, progress=40)])
+    results = g.execute_task_plan(client, plan)
+
+    assert results[0]['result'] == {'success': False, 'error': '任务名称已存在：写论文'}
+    assert results[1]['result']['success'] and results[1]['result']['display_number'] == 'Q1-4'
+    assert results[2]['result']['success']
+    [row] = postgrest.rows('tasks', task_name='读书')
+    assert (row['task_order'], row['display_number']) == (4, 'Q1-4')
+    assert postgrest.rows('tasks', id='b1')[0]['progress_percentage'] == 40
+
+
+def test_failed_update_abandons_creates(postgrest, client):
+    postgrest.tables['tasks'] = _tasks()
+    postgrest.fail[('POST', 'tasks')] = 500
+
+    results = g.execute_task_plan(client, _compile([_op('complete', 1, 1), _op('create', 1, task_name='读书')]))
+
+    assert [r['result']['success'] for r in results] == [False, False]
+
+
+def test_fallback_without_snapshot_fails_sparse_operations(postgrest, client, monkeypatch):
+    """sparse 模式下快照加载失败时不再逐条重新加载，所有操作标记为失败"""
+    postgrest.tables['tasks'] = _tasks()
+    monkeypatch.setattr(g, 'TASK_NUMBERING_MODE', 'sparse')
+    monkeypatch.setattr(g, 'load_task_number_index', lambda client, user_email: None)
+
+    outcome = g.process_task_operations_v4(client, USER, [_op('complete', 1, 1), _op('create', 2, task_name='新任务')])
+
+    assert [item['result']['success'] for item in outcome['results']] == [False, False]
+    assert postgrest.count(path='tasks') == 0
+
+
+def test_fallback_without_snapshot_runs_dense_operations(postgrest, client, monkeypatch):
+    """dense 模式下快照加载失败时按 task_order 逐条执行"""
+    postgrest.tables['tasks'] = _tasks()
+    monkeypatch.setattr(g, 'TASK_NUMBERING_MODE', 'dense')
+    monkeypatch.setattr(g, 'load_task_number_index', lambda client, user_email: None)
+
+    outcome = g.process_task_operations_v4(client, USER, [_op('complete', 1, 1)])
+
+    assert outcome['results'][0]['result']['task_name'] == 'a1'
+    assert postgrest.rows('tasks', id='a1')[0]['status'] == 'completed'
+    assert [t['task_order'] for t in postgrest.rows('tasks', quadrant=1, status='active')] == [1, 2]